@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BookServiceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "book"
+
+    def ready(self):
+        import book.signals  # noqa: F401
@@ -0,0 +1,91 @@
+import hashlib
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from library_service import versions
+from library_service.routers import primary_reads
+
+CATALOG_VERSION_KEY = "book:catalog:version"
+RESPONSE_TIMEOUT = 60 * 60
+# Versions outlive the responses cached under them. One that expires is
+# recreated with a newer stamp, which only misses the response cache, and
+# stamps of books nobody asks for do not stay in the cache forever.
+VERSION_TIMEOUT = 24 * RESPONSE_TIMEOUT
+
+
+def book_version_key(book_id: int) -> str:
+    return f"book:{book_id}:version"
+
+
+def get_version(key: str) -> float:
+    return versions.get_version(key, VERSION_TIMEOUT)
+
+
+async def aget_version(key: str) -> float:
+    return await versions.aget_version(key, VERSION_TIMEOUT)
+
+
+def bump_book_versions(book_ids) -> None:
+    """Invalidate cached catalog responses for the given books"""
+    versions.bump_versions(
+        [*(book_version_key(book_id) for book_id in book_ids), CATALOG_VERSION_KEY],
+        VERSION_TIMEOUT,
+    )
+
+
+def _etag(key: str, version: float) -> tuple[str, str]:
+    cache_key = f"{key}:{version}"
+    return cache_key, quote_etag(hashlib.md5(cache_key.encode()).hexdigest())
+
+
+def _not_modified(request, etag: str):
+    # Only the ETag validates. Last-Modified has whole-second precision, so
+    # a bump in the second a response was served would still look fresh.
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified["ETag"] = etag
+    return not_modified
+
+
+def cached_response(request, key: str, version: float, render) -> Response:
+    """
+    Serve response data cached under key and version, answering conditional
+    requests with 304 Not Modified. render() builds the response on a miss.
+    """
+    cache_key, etag = _etag(key, version)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    data = cache.get(cache_key)
+    if data is None:
+        # A lagging replica could render data older than the version it is
+        # cached under, to be served until the next bump
+        with primary_reads():
+            response = render()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        cache.set(cache_key, response.data, RESPONSE_TIMEOUT)
+    else:
+        response = Response(data)
+    response["ETag"] = etag
+    return response
+
+
+async def acached_response(request, key: str, version: float, render) -> Response:
+    """Async form of cached_response(), render() returns the response data"""
+    cache_key, etag = _etag(key, version)
+    not_modified = _not_modified(request, etag)
+    if not_modified is not None:
+        return not_modified
+
+    data = await cache.aget(cache_key)
+    if data is None:
+        with primary_reads():
+            data = await render()
+        await cache.aset(cache_key, data, RESPONSE_TIMEOUT)
+    return Response(data, headers={"ETag": etag})
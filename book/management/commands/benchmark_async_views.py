@@ -0,0 +1,146 @@
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import httpx
+import requests
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+from django.test import AsyncRequestFactory, RequestFactory
+
+from book.models import Book
+from book.views import BookDetailAsyncView, BookViewSet
+
+
+def slow_upstream(delay: float) -> ThreadingHTTPServer:
+    """Local HTTP server answering after delay seconds, like a slow Stripe"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.request_queue_size = 1024
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Command(BaseCommand):
+    """Compare sync and async book detail throughput behind a slow call"""
+
+    help = (
+        "Serve book detail requests that each wait on a slow external call, "
+        "through the sync view on a pool of worker threads and through the "
+        "async view on one event loop, and report requests per second"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=400)
+        parser.add_argument("--delay-ms", type=int, default=100)
+        parser.add_argument(
+            "--threads", type=int, default=4, help="Threads of the sync worker"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=200,
+            help="Requests in flight on the async worker",
+        )
+
+    def run_sync(self, url: str, path: str, book_id: int, options) -> list[float]:
+        view = BookViewSet.as_view({"get": "retrieve"})
+        factory = RequestFactory()
+        local = threading.local()
+
+        def handle(_):
+            started = time.perf_counter()
+            if not hasattr(local, "session"):
+                local.session = requests.Session()
+            local.session.get(url).raise_for_status()
+            response = view(factory.get(path), pk=book_id)
+            response.render()
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - started
+
+        def close(_):
+            close_old_connections()
+
+        with ThreadPoolExecutor(options["threads"]) as executor:
+            timings = list(executor.map(handle, range(options["requests"])))
+            list(executor.map(close, range(options["threads"])))
+        return timings
+
+    async def run_async(self, url: str, path: str, book_id: int, options):
+        view = BookDetailAsyncView.as_view()
+        factory = AsyncRequestFactory()
+        in_flight = asyncio.Semaphore(options["concurrency"])
+        limits = httpx.Limits(max_connections=options["concurrency"])
+
+        async with httpx.AsyncClient(limits=limits) as client:
+
+            async def handle():
+                async with in_flight:
+                    started = time.perf_counter()
+                    (await client.get(url)).raise_for_status()
+                    response = await view(factory.get(path), pk=book_id)
+                    assert response.status_code == 200, response.status_code
+                    return time.perf_counter() - started
+
+            return await asyncio.gather(*(handle() for _ in range(options["requests"])))
+
+    def report(self, name: str, timings: list[float], elapsed: float) -> None:
+        self.stdout.write(
+            f"{name:>6} {len(timings) / elapsed:>10.1f} "
+            f"{statistics.median(timings) * 1000:>8.1f} "
+            f"{sorted(timings)[int(len(timings) * 0.99)] * 1000:>8.1f}"
+        )
+
+    def handle(self, *args, **options):
+        server = slow_upstream(options["delay_ms"] / 1000)
+        url = f"http://127.0.0.1:{server.server_port}/"
+        book = Book.objects.create(
+            title="Benchmark book",
+            author="Benchmark author",
+            cover=Book.Cover.HARD,
+            inventory=1,
+            daily_fee=1,
+        )
+        path = f"/api/books/{book.id}/"
+        # One client would be throttled long before the end
+        no_throttles = (
+            mock.patch.object(BookViewSet, "throttle_classes", []),
+            mock.patch.object(BookDetailAsyncView, "throttle_classes", []),
+        )
+        for patch in no_throttles:
+            patch.start()
+        try:
+            self.stdout.write(
+                f"{'view':>6} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8}   "
+                f"({options['requests']} requests, {options['delay_ms']} ms "
+                f"external call)"
+            )
+            started = time.perf_counter()
+            timings = self.run_sync(url, path, book.id, options)
+            self.report("sync", timings, time.perf_counter() - started)
+
+            started = time.perf_counter()
+            timings = asyncio.run(self.run_async(url, path, book.id, options))
+            self.report("async", timings, time.perf_counter() - started)
+        finally:
+            for patch in no_throttles:
+                patch.stop()
+            server.shutdown()
+            book.delete()
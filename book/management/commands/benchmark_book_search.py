@@ -0,0 +1,146 @@
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from book.views import BookViewSet
+
+WORDS = [
+    "war",
+    "peace",
+    "river",
+    "night",
+    "garden",
+    "empire",
+    "winter",
+    "shadow",
+    "ocean",
+    "letters",
+    "mountain",
+    "silence",
+    "kingdom",
+    "memory",
+    "harbor",
+    "orchard",
+]
+AUTHORS = [
+    "Tolstoy",
+    "Dostoevsky",
+    "Shevchenko",
+    "Franko",
+    "Austen",
+    "Orwell",
+    "Hemingway",
+    "Woolf",
+    "Kafka",
+    "Borges",
+    "Murakami",
+    "Achebe",
+]
+QUERIES = {
+    "title": {"search": "winter"},
+    "author": {"search": "tolstoy"},
+    "typo": {"search": "tolstoi"},
+    "search + filters": {
+        "search": "ocean",
+        "cover": "HARD",
+        "available": "true",
+        "max_daily_fee": "3",
+    },
+    "fee range": {"min_daily_fee": "1", "max_daily_fee": "1.2"},
+    "available": {"available": "true", "cover": "HARD"},
+    "available, cursor": {"available": "true", "cover": "HARD", "pagination": "cursor"},
+}
+
+
+class Command(BaseCommand):
+    """Measure catalog search latency on a generated catalog"""
+
+    help = (
+        "Seed a catalog inside a rolled back transaction and report the "
+        "latency of the first page of search and filter queries of the book "
+        "list endpoint, including the count of matching books"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--books", type=int, default=1_000_000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def seed(self, books: int) -> None:
+        """
+        Titles and author names are mostly pseudo-words drawn from large
+        vocabularies, with known words and authors mixed in at a realistic
+        rate so that a search matches a small share of the catalog.
+        """
+        words = "ARRAY[" + ", ".join(f"'{word}'" for word in WORDS) + "]"
+        authors = "ARRAY[" + ", ".join(f"'{author}'" for author in AUTHORS) + "]"
+        pseudo_word = (
+            "translate(substr(md5(({} %% 20000)::text), 1, 7), "
+            "'0123456789', 'ghjkmnpqvw')"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO book_book (title, author, cover, inventory, daily_fee)
+                SELECT
+                    initcap(
+                        CASE WHEN i %% 300 = 0
+                            THEN ({words})[1 + (i / 300) %% {len(WORDS)}]
+                            ELSE {pseudo_word.format("i * 7919")}
+                        END || ' ' || {pseudo_word.format("i * 104729 + 1")}
+                    ),
+                    CASE WHEN i %% 500 = 0
+                        THEN ({authors})[1 + (i / 500) %% {len(AUTHORS)}]
+                        ELSE initcap({pseudo_word.format("i * 31 + 7")})
+                    END,
+                    CASE WHEN (i / 300 + i) %% 2 = 0 THEN 'HARD' ELSE 'SOFT' END,
+                    (i / 7) %% 4,
+                    (i %% 500) / 100.0
+                FROM generate_series(1::bigint, %s) AS i
+                """,
+                [books],
+            )
+            # Merge the GIN pending lists, as autovacuum would after the load
+            cursor.execute(
+                "SELECT gin_clean_pending_list(indexrelid) FROM pg_index "
+                "JOIN pg_class ON pg_class.oid = indexrelid "
+                "JOIN pg_am ON pg_am.oid = relam "
+                "WHERE indrelid = 'book_book'::regclass AND amname = 'gin'"
+            )
+            cursor.execute("ANALYZE book_book")
+
+    def run_query(self, params: dict) -> tuple[int, float]:
+        """First page as the endpoint serves it, with its COUNT(*) query"""
+        request = Request(APIRequestFactory().get("/api/books/", params))
+        view = BookViewSet(request=request, action="list", format_kwarg=None)
+        started = time.perf_counter()
+        rows = len(view.paginator.paginate_queryset(view.get_queryset(), request, view))
+        return rows, (time.perf_counter() - started) * 1000
+
+    # Cursor pages build their links from the host of the request
+    @override_settings(ALLOWED_HOSTS=["testserver"])
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            started = time.perf_counter()
+            self.seed(options["books"])
+            self.stdout.write(
+                f"Seeded {options['books']} books "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+            self.stdout.write(f"{'query':<18} {'rows':>5} {'p50 ms':>8} {'p95 ms':>8}")
+            for name, params in QUERIES.items():
+                timings = []
+                for _ in range(options["repeat"]):
+                    rows, elapsed = self.run_query(params)
+                    timings.append(elapsed)
+                timings.sort()
+                p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+                self.stdout.write(
+                    f"{name:<18} {rows:>5} "
+                    f"{statistics.median(timings):>8.2f} {p95:>8.2f}"
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,74 @@
+# Generated by Django 4.2 on 2026-10-18 19:48
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE TRIGGER book_search_vector_update
+BEFORE INSERT OR UPDATE OF title, author ON book_book
+FOR EACH ROW EXECUTE FUNCTION
+tsvector_update_trigger(search_vector, 'pg_catalog.english', title, author);
+
+UPDATE book_book SET search_vector = to_tsvector(
+    'pg_catalog.english', coalesce(title, '') || ' ' || coalesce(author, '')
+);
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("book", "0001_initial"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name="book",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.RunSQL(
+            SEARCH_VECTOR_TRIGGER,
+            reverse_sql="DROP TRIGGER book_search_vector_update ON book_book;",
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="book_search_vector_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["title"], name="book_title_trgm_idx", opclasses=["gin_trgm_ops"]
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["author"],
+                name="book_author_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["cover"], name="book_cover_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(fields=["daily_fee"], name="book_daily_fee_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="book",
+            index=models.Index(
+                condition=models.Q(("inventory__gt", 0)),
+                fields=["id"],
+                name="book_available_idx",
+            ),
+        ),
+    ]
@@ -1,4 +1,42 @@
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+from book.cache import bump_book_versions
+
+SEARCH_CONFIG = "english"
+
+
+class BookQuerySet(models.QuerySet):
+    @staticmethod
+    def _quantity_case(quantities: dict[int, int]) -> Case:
+        return Case(
+            *(When(pk=pk, then=Value(quantity)) for pk, quantity in quantities.items()),
+            output_field=IntegerField(),
+        )
+
+    def reserve(self, quantities: dict[int, int]) -> int:
+        """
+        Take copies of several books with one conditional UPDATE.
+        Only books with enough inventory are updated; returns their number.
+        """
+        condition = Q()
+        for pk, quantity in quantities.items():
+            condition |= Q(pk=pk, inventory__gte=quantity)
+        updated = self.filter(condition).update(
+            inventory=F("inventory") - self._quantity_case(quantities)
+        )
+        bump_book_versions(quantities)
+        return updated
+
+    def restock(self, quantities: dict[int, int]) -> int:
+        """Put copies of several books back with one UPDATE"""
+        updated = self.filter(pk__in=quantities).update(
+            inventory=F("inventory") + self._quantity_case(quantities)
+        )
+        bump_book_versions(quantities)
+        return updated
 
 
 class Book(models.Model):
@@ -11,6 +49,30 @@ class Book(models.Model):
     cover = models.CharField(max_length=4, choices=Cover.choices)
     inventory = models.PositiveIntegerField()
     daily_fee = models.DecimalField(max_digits=8, decimal_places=2)
+    # Maintained from title and author by a database trigger, see migrations
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BookQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=["search_vector"], name="book_search_vector_idx"),
+            GinIndex(
+                fields=["title"], name="book_title_trgm_idx", opclasses=["gin_trgm_ops"]
+            ),
+            GinIndex(
+                fields=["author"],
+                name="book_author_trgm_idx",
+                opclasses=["gin_trgm_ops"],
+            ),
+            models.Index(fields=["cover"], name="book_cover_idx"),
+            models.Index(fields=["daily_fee"], name="book_daily_fee_idx"),
+            models.Index(
+                fields=["id"],
+                name="book_available_idx",
+                condition=Q(inventory__gt=0),
+            ),
+        ]
 
     def __str__(self):
         return self.title
@@ -6,4 +6,4 @@ from book.models import Book
 class BookSerializer(serializers.ModelSerializer):
     class Meta:
         model = Book
-        fields = "__all__"
+        exclude = ("search_vector",)
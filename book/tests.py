@@ -1,13 +1,21 @@
+from unittest import mock
+
+from asgiref.sync import sync_to_async
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
+from django.utils.http import http_date
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from book.cache import book_version_key
 from book.models import Book
 from book.serializers import BookSerializer
+from library_service import routers
 
 BOOK_URL = reverse("book:book-list")
+BOOK_ASYNC_URL = reverse("book:book-list-async")
 
 
 def sample_book(**params):
@@ -178,3 +186,195 @@ class AdminBookApiTest(TestCase):
         self.assertEqual(partial_updated_book.title, "new")
         self.assertEqual(res_partial_update.status_code, status.HTTP_200_OK)
         self.assertEqual(res_update.status_code, status.HTTP_200_OK)
+
+
+class CachedBookApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = sample_book()
+
+    def test_conditional_get(self):
+        res = self.client.get(detail_url(self.book.id))
+        res_not_modified = self.client.get(
+            detail_url(self.book.id), HTTP_IF_NONE_MATCH=res["ETag"]
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res_not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res_not_modified["ETag"], res["ETag"])
+
+    def test_change_in_same_second_is_not_hidden(self):
+        res = self.client.get(detail_url(self.book.id))
+        self.book.title = "New title"
+        self.book.save()
+
+        res_after_save = self.client.get(
+            detail_url(self.book.id), HTTP_IF_MODIFIED_SINCE=http_date()
+        )
+
+        self.assertNotIn("Last-Modified", res)
+        self.assertEqual(res_after_save.status_code, status.HTTP_200_OK)
+        self.assertEqual(res_after_save.data["title"], "New title")
+
+    def test_list_is_served_from_cache(self):
+        self.client.get(BOOK_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(BOOK_URL)
+
+        self.assertEqual(res.data["count"], 1)
+
+    def test_save_invalidates_cache(self):
+        res = self.client.get(detail_url(self.book.id))
+        self.book.title = "New title"
+        self.book.save()
+
+        res_after_save = self.client.get(
+            detail_url(self.book.id), HTTP_IF_NONE_MATCH=res["ETag"]
+        )
+
+        self.assertEqual(res_after_save.status_code, status.HTTP_200_OK)
+        self.assertEqual(res_after_save.data["title"], "New title")
+
+    def test_inventory_change_invalidates_cache(self):
+        self.client.get(BOOK_URL)
+
+        Book.objects.reserve({self.book.id: 1})
+        res = self.client.get(BOOK_URL)
+
+        self.assertEqual(res.data["results"][0]["inventory"], 4)
+
+    def test_invalid_id_is_not_cached(self):
+        res = self.client.get(f"{BOOK_URL}abc%20def/")
+        res_missing = self.client.get(detail_url(self.book.id + 1))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(res_missing.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertIsNone(cache.get(book_version_key("abc def")))
+
+    @override_settings(REPLICA_DATABASES=["replica"])
+    def test_cache_miss_rendered_from_primary(self):
+        # No "replica" database exists, rendering from it would fail
+        with mock.patch.object(routers, "healthy_replicas", return_value=["replica"]):
+            res_list = self.client.get(BOOK_URL)
+            res_detail = self.client.get(detail_url(self.book.id))
+
+        self.assertEqual(res_list.status_code, status.HTTP_200_OK)
+        self.assertEqual(res_detail.data["id"], self.book.id)
+
+
+class BookSearchApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.war = sample_book(
+            title="War and Peace", author="Leo Tolstoy", daily_fee=3, inventory=0
+        )
+        self.anna = sample_book(
+            title="Anna Karenina", author="Leo Tolstoy", cover="SOFT", daily_fee=1
+        )
+        self.idiot = sample_book(
+            title="The Idiot", author="Fyodor Dostoevsky", daily_fee=2
+        )
+
+    def titles(self, params):
+        res = self.client.get(BOOK_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return [book["title"] for book in res.data["results"]]
+
+    def test_full_text_search(self):
+        self.assertEqual(
+            self.titles({"search": "tolstoy"}), ["War and Peace", "Anna Karenina"]
+        )
+        self.assertEqual(self.titles({"search": "peace"}), ["War and Peace"])
+
+    def test_search_ranks_better_matches_first(self):
+        sample_book(title="Peace at Last", author="Peace Writer")
+
+        self.assertEqual(self.titles({"search": "peace"})[0], "Peace at Last")
+
+    def test_search_with_typo(self):
+        self.assertEqual(self.titles({"search": "dostoevski"}), ["The Idiot"])
+
+    def test_filters(self):
+        self.assertEqual(self.titles({"cover": "soft"}), ["Anna Karenina"])
+        self.assertEqual(
+            self.titles({"available": "true", "search": "tolstoy"}), ["Anna Karenina"]
+        )
+        self.assertEqual(
+            self.titles({"min_daily_fee": "1.5", "max_daily_fee": "2.5"}),
+            ["The Idiot"],
+        )
+
+    def test_invalid_fee_filter(self):
+        for value in ("cheap", "NaN", "sNaN", "Infinity", "-inf"):
+            res = self.client.get(BOOK_URL, {"min_daily_fee": value})
+            res_async = self.client.get(BOOK_ASYNC_URL, {"max_daily_fee": value})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(res_async.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pagination(self):
+        res = self.client.get(BOOK_URL, {"pagination": "cursor", "page_size": 2})
+        next_page = self.client.get(res.data["next"])
+
+        self.assertEqual(
+            [book["title"] for book in res.data["results"] + next_page.data["results"]],
+            ["War and Peace", "Anna Karenina", "The Idiot"],
+        )
+        self.assertIsNone(next_page.data["next"])
+
+    def test_search_rejects_cursor_pagination(self):
+        res = self.client.get(BOOK_URL, {"search": "tolstoy", "pagination": "cursor"})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncBookApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.book = sample_book()
+        sample_book(title="Second book", cover="SOFT")
+
+    async def test_list_matches_sync_view(self):
+        params = {"cover": "soft", "page_size": 1}
+        expected = await sync_to_async(self.client.get)(BOOK_URL, params)
+
+        res = await self.async_client.get(BOOK_ASYNC_URL, params)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["count"], expected.json()["count"])
+        self.assertEqual(res.json()["results"], expected.json()["results"])
+
+    async def test_detail_matches_sync_view(self):
+        expected = await sync_to_async(self.client.get)(detail_url(self.book.id))
+
+        res = await self.async_client.get(
+            reverse("book:book-detail-async", args=[self.book.id])
+        )
+        res_not_modified = await self.async_client.get(
+            reverse("book:book-detail-async", args=[self.book.id]),
+            headers={"If-None-Match": res["ETag"]},
+        )
+
+        self.assertEqual(res.json(), expected.json())
+        self.assertEqual(res_not_modified.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(REPLICA_DATABASES=["replica"])
+    async def test_cache_miss_rendered_from_primary(self):
+        with mock.patch.object(routers, "healthy_replicas", return_value=["replica"]):
+            res_list = await self.async_client.get(BOOK_ASYNC_URL)
+            res_detail = await self.async_client.get(
+                reverse("book:book-detail-async", args=[self.book.id])
+            )
+
+        self.assertEqual(res_list.status_code, status.HTTP_200_OK)
+        self.assertEqual(res_detail.json()["id"], self.book.id)
+
+    async def test_detail_not_found(self):
+        res = await self.async_client.get(reverse("book:book-detail-async", args=[0]))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(res.json(), {"detail": "Not found."})
@@ -1,10 +1,15 @@
+from django.urls import path
 from rest_framework import routers
 
-from book.views import BookViewSet
+from book.views import BookDetailAsyncView, BookListAsyncView, BookViewSet
 
 router = routers.DefaultRouter()
 router.register("", BookViewSet)
 
-urlpatterns = router.urls
+urlpatterns = [
+    path("async/", BookListAsyncView.as_view(), name="book-list-async"),
+    path("async/<int:pk>/", BookDetailAsyncView.as_view(), name="book-detail-async"),
+    *router.urls,
+]
 
 app_name = "book"
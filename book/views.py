@@ -1,22 +1,220 @@
+from decimal import Decimal, InvalidOperation
+
+from asgiref.sync import sync_to_async
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    TrigramWordSimilarity,
+)
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema, OpenApiParameter
 from rest_framework import viewsets
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import IsAdminUser
 
-from book.models import Book
+from book.cache import (
+    CATALOG_VERSION_KEY,
+    acached_response,
+    aget_version,
+    book_version_key,
+    cached_response,
+    get_version,
+)
+from book.models import Book, SEARCH_CONFIG
 from book.serializers import BookSerializer
+from library_service.async_views import AsyncReadView
+from library_service.pagination import OptionalCursorPagination
 
 
-class BookPagination(PageNumberPagination):
+class BookPagination(OptionalCursorPagination):
     page_size = 5
     max_page_size = 100
+    ordering = ("id",)
 
 
 class BookViewSet(viewsets.ModelViewSet):
-    queryset = Book.objects.all()
+    queryset = Book.objects.order_by("id")
     serializer_class = BookSerializer
     pagination_class = BookPagination
+    # Other ids never reach the cache, which keys a version on them
+    lookup_value_regex = r"\d+"
+    # Including the user lookup of JWT authentication
+    query_budget = {
+        "list": 4,
+        "retrieve": 2,
+        "create": 2,
+        "update": 3,
+        "partial_update": 3,
+    }
+
+    @staticmethod
+    def _params_to_decimal(name: str, value: str) -> Decimal:
+        try:
+            number = Decimal(value)
+        except InvalidOperation:
+            number = None
+        # NaN and Infinity parse but cannot be compared with a fee
+        if number is None or not number.is_finite():
+            raise ValidationError({name: "A valid number is required."})
+        return number
+
+    @staticmethod
+    def search(queryset, term: str):
+        """
+        Full-text search on title and author ranked by relevance. When no book
+        matches, fall back to trigram word similarity so typos still match.
+        """
+        query = SearchQuery(term, config=SEARCH_CONFIG)
+        matches = queryset.filter(search_vector=query)
+        if matches.exists():
+            return matches.annotate(
+                rank=SearchRank(F("search_vector"), query)
+            ).order_by("-rank", "id")
+        return (
+            queryset.filter(
+                Q(title__trigram_word_similar=term)
+                | Q(author__trigram_word_similar=term)
+            )
+            .annotate(
+                similarity=Greatest(
+                    TrigramWordSimilarity(term, "title"),
+                    TrigramWordSimilarity(term, "author"),
+                )
+            )
+            .order_by("-similarity", "id")
+        )
+
+    def get_queryset(self):
+        queryset = self.queryset
+        if self.action != "list":
+            return queryset
+
+        search = self.request.query_params.get("search")
+        cover = self.request.query_params.get("cover")
+        min_daily_fee = self.request.query_params.get("min_daily_fee")
+        max_daily_fee = self.request.query_params.get("max_daily_fee")
+        available = self.request.query_params.get("available")
+
+        if cover:
+            queryset = queryset.filter(cover=cover.upper())
+
+        if min_daily_fee:
+            queryset = queryset.filter(
+                daily_fee__gte=self._params_to_decimal("min_daily_fee", min_daily_fee)
+            )
+
+        if max_daily_fee:
+            queryset = queryset.filter(
+                daily_fee__lte=self._params_to_decimal("max_daily_fee", max_daily_fee)
+            )
+
+        if available == "true":
+            queryset = queryset.filter(inventory__gt=0)
+
+        if search:
+            # Relevance order has no stable keyset to continue from
+            if self.paginator.use_cursor(self.request):
+                raise ValidationError(
+                    {"search": "Search results use page number pagination."}
+                )
+            queryset = self.search(queryset, search)
+
+        return queryset
 
     def get_permissions(self):
         if self.action in ("create", "update", "partial_update", "destroy"):
             return [IsAdminUser()]
         return super().get_permissions()
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "search",
+                type=OpenApiTypes.STR,
+                description="Search by title and author (ex. ?search=tolstoy)",
+            ),
+            OpenApiParameter(
+                "cover",
+                type=OpenApiTypes.STR,
+                enum=Book.Cover.values,
+                description="Filter by cover (ex. ?cover=HARD)",
+            ),
+            OpenApiParameter(
+                "min_daily_fee",
+                type=OpenApiTypes.DECIMAL,
+                description="Filter by minimal daily fee (ex. ?min_daily_fee=0.5)",
+            ),
+            OpenApiParameter(
+                "max_daily_fee",
+                type=OpenApiTypes.DECIMAL,
+                description="Filter by maximal daily fee (ex. ?max_daily_fee=2)",
+            ),
+            OpenApiParameter(
+                "available",
+                type=OpenApiTypes.BOOL,
+                description="Only books in stock (ex. ?available=true)",
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        return cached_response(
+            request,
+            f"book:list:{request.get_full_path()}",
+            get_version(CATALOG_VERSION_KEY),
+            lambda: super(BookViewSet, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return cached_response(
+            request,
+            f"book:detail:{kwargs['pk']}",
+            get_version(book_version_key(kwargs["pk"])),
+            lambda: super(BookViewSet, self).retrieve(request, *args, **kwargs),
+        )
+
+
+class BookListAsyncView(AsyncReadView):
+    """Async form of the book list with the same filters, cache and pages"""
+
+    query_budget = BookViewSet.query_budget["list"]
+
+    async def get(self, request):
+        viewset = BookViewSet(request=request, action="list", format_kwarg=None)
+        paginator = viewset.paginator
+
+        def page():
+            queryset = viewset.get_queryset()
+            return paginator.paginate_queryset(queryset, request, viewset)
+
+        async def render():
+            books = await sync_to_async(page)()
+            data = BookSerializer(books, many=True).data
+            return paginator.get_paginated_response(data).data
+
+        return await acached_response(
+            request,
+            f"book:list:{request.get_full_path()}",
+            await aget_version(CATALOG_VERSION_KEY),
+            render,
+        )
+
+
+class BookDetailAsyncView(AsyncReadView):
+    query_budget = BookViewSet.query_budget["retrieve"]
+
+    async def get(self, request, pk):
+        async def render():
+            book = await BookViewSet.queryset.aget(pk=pk)
+            return BookSerializer(book).data
+
+        try:
+            return await acached_response(
+                request,
+                f"book:detail:{pk}",
+                await aget_version(book_version_key(pk)),
+                render,
+            )
+        except Book.DoesNotExist:
+            raise NotFound()
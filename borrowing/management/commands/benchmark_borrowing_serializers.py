@@ -0,0 +1,100 @@
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import Borrowing
+from borrowing.serializers import (
+    BorrowingDetailSerializer,
+    BorrowingValuesSerializer,
+    borrowing_read_queryset,
+)
+from payment.models import Payment
+
+PAGE_SIZE = 100
+
+
+class Command(BaseCommand):
+    """Compare the model and values() read paths of the borrowing list"""
+
+    help = (
+        "Seed borrowings with payments inside a rolled back transaction and "
+        "report fetch and serialization time per 100 rows"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def seed(self) -> None:
+        user = get_user_model().objects.create_user(
+            f"benchmark-{time.time_ns()}@example.com",
+            "benchmark",
+            first_name="Benchmark",
+            last_name="User",
+        )
+        book = Book.objects.create(
+            title="Benchmark book",
+            author="Benchmark author",
+            cover=Book.Cover.HARD,
+            inventory=PAGE_SIZE,
+            daily_fee=1,
+        )
+        borrowings = Borrowing.objects.bulk_create(
+            Borrowing(
+                expected_return_date=timezone.now() + timedelta(days=10),
+                book=book,
+                user=user,
+            )
+            for _ in range(PAGE_SIZE)
+        )
+        Payment.objects.bulk_create(
+            Payment(
+                status=Payment.Status.PENDING,
+                type=Payment.Type.PAYMENT,
+                borrowing=borrowing,
+                session_url="https://checkout.stripe.com/c/pay/cs_test",
+                session_id=f"cs_test_{borrowing.id}",
+                money_to_pay=Decimal("10.00"),
+            )
+            for borrowing in borrowings
+        )
+
+    @staticmethod
+    def model_path() -> tuple[float, float]:
+        started = time.perf_counter()
+        page = list(borrowing_read_queryset(Borrowing.objects.all())[:PAGE_SIZE])
+        fetched = time.perf_counter()
+        BorrowingDetailSerializer(page, many=True).data
+        return fetched - started, time.perf_counter() - fetched
+
+    @staticmethod
+    def values_path() -> tuple[float, float]:
+        started = time.perf_counter()
+        rows = BorrowingValuesSerializer.values(Borrowing.objects.all())
+        page = list(rows[:PAGE_SIZE])
+        fetched = time.perf_counter()
+        # Payments are read while rendering, as in the list view
+        BorrowingValuesSerializer(page).data
+        return fetched - started, time.perf_counter() - fetched
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'path':>8} {'fetch ms':>9} {'serialize ms':>13} {'total ms':>9}"
+        )
+        with transaction.atomic():
+            self.seed()
+            for name, run in (("model", self.model_path), ("values", self.values_path)):
+                run()
+                timings = [run() for _ in range(options["repeat"])]
+                fetch = statistics.median(fetch for fetch, _ in timings) * 1000
+                render = statistics.median(render for _, render in timings) * 1000
+                self.stdout.write(
+                    f"{name:>8} {fetch:>9.2f} {render:>13.2f} {fetch + render:>9.2f}"
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,86 @@
+import resource
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from book.models import Book
+from borrowing.models import Borrowing
+from borrowing.tasks import get_overdue_borrowings, notify_about_overdue_borrowings
+
+SEED_BATCH_SIZE = 5000
+
+
+def discard(messages: list[str]) -> None:
+    pass
+
+
+class Command(BaseCommand):
+    """Measure query count and memory of the overdue job on seeded data"""
+
+    help = (
+        "Seed overdue borrowings inside a rolled back transaction and report "
+        "query count and peak memory of the overdue notification job"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows", type=int, nargs="+", default=[1000, 10000, 100000]
+        )
+
+    def seed(self, rows: int) -> None:
+        user = get_user_model().objects.create_user(
+            f"benchmark-{time.time_ns()}@example.com", "benchmark"
+        )
+        book = Book.objects.create(
+            title="Benchmark book",
+            author="Benchmark author",
+            cover=Book.Cover.HARD,
+            inventory=rows,
+            daily_fee=1,
+        )
+        expected_return_date = timezone.now() - timedelta(days=1)
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            Borrowing.objects.bulk_create(
+                Borrowing(
+                    expected_return_date=expected_return_date, book=book, user=user
+                )
+                for _ in range(min(SEED_BATCH_SIZE, rows - start))
+            )
+
+    def run_job(self) -> tuple[int, int, float, int, int]:
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        started = time.perf_counter()
+        # A plain function rather than a Mock, which would keep every batch
+        with mock.patch("borrowing.tasks.send_telegram_notifications", discard):
+            with CaptureQueriesContext(connection) as queries:
+                summary = notify_about_overdue_borrowings(
+                    get_overdue_borrowings(timezone.now())
+                )
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        return summary["count"], len(queries), elapsed, peak, rss_growth
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'rows':>8} {'queries':>8} {'seconds':>8} "
+            f"{'py peak KiB':>12} {'RSS growth KiB':>15}"
+        )
+        for rows in options["rows"]:
+            with transaction.atomic():
+                self.seed(rows)
+                total, queries, elapsed, peak, rss_growth = self.run_job()
+                transaction.set_rollback(True)
+            self.stdout.write(
+                f"{total:>8} {queries:>8} {elapsed:>8.2f} "
+                f"{peak // 1024:>12} {rss_growth:>15}"
+            )
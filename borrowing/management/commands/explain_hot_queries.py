@@ -0,0 +1,184 @@
+import json
+import random
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from book.models import Book
+from borrowing.models import Borrowing
+from borrowing.tasks import get_overdue_borrowings
+from borrowing.views import BorrowingViewSet
+from payment.models import Payment
+
+SEED_BATCH_SIZE = 5000
+ACTIVE_SHARE = 0.1
+OVERDUE_SHARE = 0.3
+# Tables the hot queries filter on. Lookup tables joined to every row of a
+# large result, like users and books in the overdue job, are legitimately
+# read whole into a hash join
+FILTERED_TABLES = {Borrowing._meta.db_table, Payment._meta.db_table}
+
+
+class Rollback(Exception):
+    pass
+
+
+def seq_scans(plan: dict) -> list[str]:
+    """Relations read with a sequential scan anywhere in a JSON plan"""
+    scans = [plan["Relation Name"]] if plan["Node Type"] == "Seq Scan" else []
+    for child in plan.get("Plans", []):
+        scans += seq_scans(child)
+    return scans
+
+
+class Command(BaseCommand):
+    """Check that the borrowing hot queries are served by indexes"""
+
+    help = (
+        "Seed borrowings inside a rolled back transaction, run EXPLAIN "
+        "ANALYZE on every query of the borrowing list endpoints and the "
+        "overdue job, and fail if any plan reads the borrowing or payment "
+        "table with a sequential scan"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument("--users", type=int, default=5000)
+        parser.add_argument("--books", type=int, default=20000)
+        parser.add_argument(
+            "--verbose-plans", action="store_true", help="Print every plan"
+        )
+
+    def seed(self, rows: int, users: int, books: int):
+        random.seed(0)
+        user_model = get_user_model()
+        patrons = user_model.objects.bulk_create(
+            user_model(email=f"explain-{index}@example.com", password="!")
+            for index in range(users)
+        )
+        staff = user_model.objects.create(
+            email="explain-staff@example.com", password="!", is_staff=True
+        )
+        catalog = Book.objects.bulk_create(
+            Book(
+                title=f"Explain book {index}",
+                author="Explain author",
+                cover=Book.Cover.HARD,
+                inventory=rows,
+                daily_fee=1,
+            )
+            for index in range(books)
+        )
+        now = timezone.now()
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            borrowings = []
+            for _ in range(min(SEED_BATCH_SIZE, rows - start)):
+                active = random.random() < ACTIVE_SHARE
+                overdue = active and random.random() < OVERDUE_SHARE
+                expected = now + timedelta(
+                    days=random.randint(1, 30) * (-1 if overdue else 1)
+                )
+                borrowings.append(
+                    Borrowing(
+                        expected_return_date=(
+                            expected if active else now - timedelta(days=40)
+                        ),
+                        actual_return_date=None if active else now - timedelta(days=41),
+                        book=random.choice(catalog),
+                        user=random.choice(patrons),
+                    )
+                )
+            Borrowing.objects.bulk_create(borrowings)
+            Payment.objects.bulk_create(
+                Payment(
+                    status=(
+                        Payment.Status.PENDING
+                        if borrowing.actual_return_date is None
+                        else Payment.Status.PAID
+                    ),
+                    type=Payment.Type.PAYMENT,
+                    borrowing=borrowing,
+                    money_to_pay=1,
+                )
+                for borrowing in borrowings
+            )
+        with connection.cursor() as cursor:
+            for model in (Borrowing, Book, user_model, Payment):
+                cursor.execute(f"ANALYZE {model._meta.db_table}")
+        return patrons[0], staff
+
+    @staticmethod
+    def view_queries(user, params: dict) -> list[str]:
+        """SQL run by the borrowing list endpoint for the user"""
+        request = APIRequestFactory().get("/api/borrowings/", params)
+        force_authenticate(request, user=user)
+        view = BorrowingViewSet.as_view({"get": "list"})
+        # Page links are built from the host of the request
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            with CaptureQueriesContext(connection) as queries:
+                view(request).render()
+        return [query["sql"] for query in queries.captured_queries]
+
+    def hot_queries(self, patron, staff) -> list[tuple[str, str, list]]:
+        queries = []
+        endpoints = {
+            "patron list": (patron, {}),
+            "patron active list": (patron, {"is_active": "true"}),
+            "staff active list of a patron": (
+                staff,
+                {"is_active": "true", "user_id": patron.id},
+            ),
+            "patron list, cursor page": (patron, {"pagination": "cursor"}),
+        }
+        for name, (user, params) in endpoints.items():
+            for sql in self.view_queries(user, params):
+                queries.append((name, sql, None))
+        sql, params = get_overdue_borrowings(timezone.now()).query.sql_with_params()
+        queries.append(("overdue job", sql, params))
+        return queries
+
+    def explain(self, sql: str, params) -> dict:
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]
+
+    def handle(self, *args, **options):
+        if connection.vendor != "postgresql":
+            raise CommandError("EXPLAIN ANALYZE checks need PostgreSQL")
+        failures = []
+        try:
+            with transaction.atomic():
+                patron, staff = self.seed(
+                    options["rows"], options["users"], options["books"]
+                )
+                for name, sql, params in self.hot_queries(patron, staff):
+                    plan = self.explain(sql, params)
+                    scans = seq_scans(plan["Plan"])
+                    if FILTERED_TABLES.intersection(scans):
+                        status = f"SEQ SCAN on {', '.join(scans)}"
+                        failures.append(name)
+                    elif scans:
+                        status = f"ok, joins {', '.join(scans)} whole"
+                    else:
+                        status = "ok"
+                    self.stdout.write(
+                        f"{name:<32} {plan['Execution Time']:>9.3f} ms  {status}"
+                    )
+                    self.stdout.write(f"    {sql[:120]}")
+                    if options["verbose_plans"]:
+                        self.stdout.write(json.dumps(plan["Plan"], indent=2))
+                raise Rollback
+        except Rollback:
+            pass
+        if failures:
+            raise CommandError(
+                f"Sequential scans in: {', '.join(sorted(set(failures)))}"
+            )
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0002_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OverdueShard",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("run_date", models.DateField()),
+                ("start_pk", models.BigIntegerField()),
+                ("end_pk", models.BigIntegerField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "fines",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("completed_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="overdueshard",
+            constraint=models.UniqueConstraint(
+                fields=("run_date", "start_pk", "end_pk"), name="unique_overdue_shard"
+            ),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2 on 2026-10-18 20:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("borrowing", "0003_overdue_shard"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="borrowing",
+            options={"ordering": ["-borrow_date", "id"]},
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["-borrow_date", "id"], name="borrowing_borrow_date_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrowing",
+            index=models.Index(
+                fields=["user", "-borrow_date", "id"], name="borrowing_user_borrow_idx"
+            ),
+        ),
+    ]
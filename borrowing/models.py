@@ -16,7 +16,45 @@ class Borrowing(models.Model):
     )
 
     class Meta:
-        ordering = ["-borrow_date"]
+        ordering = ["-borrow_date", "id"]
+        indexes = [
+            models.Index(
+                fields=["-borrow_date", "id"], name="borrowing_borrow_date_id_idx"
+            ),
+            models.Index(
+                fields=["user", "-borrow_date", "id"],
+                name="borrowing_user_borrow_idx",
+            ),
+            # Overdue job, only the few borrowings not returned yet
+            models.Index(
+                fields=["expected_return_date"],
+                condition=models.Q(actual_return_date__isnull=True),
+                name="borrowing_active_expected_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.get_full_name()} borrowed {self.book.title}"
+
+
+class OverdueShard(models.Model):
+    """Completed primary-key range of a sharded overdue run"""
+
+    run_date = models.DateField()
+    start_pk = models.BigIntegerField()
+    end_pk = models.BigIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    fines = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    failures = models.PositiveIntegerField(default=0)
+    completed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["run_date", "start_pk", "end_pk"],
+                name="unique_overdue_shard",
+            )
+        ]
+
+    def __str__(self):
+        return f"Overdue shard {self.start_pk}-{self.end_pk} of {self.run_date}"
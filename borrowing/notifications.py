@@ -1,13 +1,247 @@
-import requests
+import logging
+import threading
+import time
+
+from django.db import transaction
 
 from library_service import settings
+from library_service.instrumentation import timed, timed_call
+from library_service.throttling import get_redis, get_sliding_window_script
+
+logger = logging.getLogger(__name__)
 
 BOT_TOKEN = settings.TELEGRAM_BOT_TOKEN
 URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
 CHAT_ID = settings.TELEGRAM_CHAT_ID
 
+MESSAGE_LIMIT = 4096
+MESSAGE_SEPARATOR = "\n\n"
+REQUEST_TIMEOUT = (3.05, 10)
+# Telegram allows about one message per second to the same chat
+MESSAGES_PER_SECOND = 1
+BURST = 3
+# Messages queued for delivery by any process, drained by the workers
+QUEUE_KEY = "telegram:queue"
+DRAIN_BATCH_SIZE = 100
+
+
+class TelegramError(Exception):
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.pending = []
+
+
+class TokenBucket:
+    """Thread-safe token bucket, blocks until a token is available"""
+
+    def __init__(
+        self, rate: float, capacity: int, clock=time.monotonic, sleep=time.sleep
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+class SharedRateLimiter:
+    """
+    Rate limit shared by all worker processes, kept in Redis with the
+    sliding window script of the API throttles. While Redis is unavailable
+    each process falls back to its own token bucket.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        rate: float,
+        burst: int,
+        script,
+        clock=time.time,
+        sleep=time.sleep,
+    ):
+        self.key = key
+        self.limit = burst
+        self.window_ms = int(burst / rate * 1000)
+        self.script = script
+        self.clock = clock
+        self.sleep = sleep
+        self.fallback = TokenBucket(rate, burst, sleep=sleep)
+
+    def acquire(self) -> None:
+        # Already loaded by get_sliding_window_script
+        from redis import RedisError
+
+        while True:
+            try:
+                allowed, wait = self.script(
+                    keys=[self.key],
+                    args=[int(self.clock() * 1000), self.window_ms, self.limit],
+                )
+            except RedisError:
+                logger.warning("Shared Telegram rate limit unavailable", exc_info=True)
+                self.fallback.acquire()
+                return
+            if allowed:
+                return
+            self.sleep(max(wait, 1) / 1000)
+
+
+def coalesce(messages: list[str], limit: int = MESSAGE_LIMIT) -> list[str]:
+    """Join messages into as few Telegram messages as the size limit allows"""
+    chunks = []
+    current = ""
+    for message in messages:
+        parts = [message[i : i + limit] for i in range(0, len(message), limit)]
+        for part in parts or [""]:
+            if not current:
+                current = part
+            elif len(current) + len(MESSAGE_SEPARATOR) + len(part) <= limit:
+                current += MESSAGE_SEPARATOR + part
+            else:
+                chunks.append(current)
+                current = part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def rate_limiter(chat_id: str):
+    """Limiter shared by every worker when Redis is configured"""
+    script = get_sliding_window_script()
+    if script is None:
+        return TokenBucket(MESSAGES_PER_SECOND, BURST)
+    return SharedRateLimiter(
+        f"telegram:rate:{chat_id}", MESSAGES_PER_SECOND, BURST, script
+    )
+
+
+class TelegramClient:
+    """Sends messages over a pooled keep-alive HTTP session"""
+
+    def __init__(self, url: str = URL, chat_id: str = CHAT_ID, bucket=None):
+        self.url = url
+        self.chat_id = chat_id
+        self.bucket = bucket or rate_limiter(chat_id)
+        # Imported here so only processes that send messages pay for it
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.request_error = requests.RequestException
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=10))
+
+    def send(self, text: str) -> None:
+        self.bucket.acquire()
+        try:
+            with timed("telegram"):
+                response = self.session.post(
+                    self.url,
+                    json={"chat_id": self.chat_id, "text": text},
+                    timeout=REQUEST_TIMEOUT,
+                )
+        except self.request_error as exc:
+            raise TelegramError(str(exc)) from exc
+        if response.status_code == 429:
+            retry_after = response.json().get("parameters", {}).get("retry_after")
+            raise TelegramError("Telegram rate limit exceeded", retry_after)
+        if not response.ok:
+            raise TelegramError(f"Telegram responded with {response.status_code}")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> TelegramClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = TelegramClient()
+        return _client
+
+
+def deliver_messages(messages: list[str]) -> int:
+    """
+    Send messages coalesced into as few requests as possible.
+    On failure the undelivered chunks are attached to the raised error.
+    """
+    client = get_client()
+    chunks = coalesce(messages)
+    for index, chunk in enumerate(chunks):
+        try:
+            client.send(chunk)
+        except TelegramError as exc:
+            exc.pending = chunks[index:]
+            raise
+    return len(chunks)
+
+
+def drain_queued_messages(limit: int = DRAIN_BATCH_SIZE) -> list[str]:
+    """Take up to limit of the oldest queued messages off the shared queue"""
+    client = get_redis()
+    if client is None:
+        return []
+    with client.pipeline() as pipeline:
+        pipeline.lrange(QUEUE_KEY, 0, limit - 1)
+        pipeline.ltrim(QUEUE_KEY, limit, -1)
+        messages, _ = pipeline.execute()
+    return [message.decode() for message in messages]
+
+
+def enqueue_messages(messages: list[str]) -> None:
+    """
+    Add messages to the shared queue and wake a worker to drain it, so
+    messages queued by many requests go out coalesced. Without Redis the
+    messages travel with the task instead.
+    """
+    from borrowing.tasks import deliver_telegram_messages
+
+    client = get_redis()
+    if client is not None:
+        from redis import RedisError
+
+        try:
+            client.rpush(QUEUE_KEY, *messages)
+        except RedisError:
+            logger.warning("Telegram queue unavailable", exc_info=True)
+        else:
+            deliver_telegram_messages.delay()
+            return
+    deliver_telegram_messages.delay(messages)
+
+
+# The request only queues the messages, a worker sends them
+@timed_call("telegram_enqueue")
+def send_telegram_notifications(messages: list[str]) -> None:
+    """Queue messages for delivery once the current transaction commits"""
+    messages = list(messages)
+    if messages:
+        # A broker error is logged rather than failing the committed request
+        transaction.on_commit(lambda: enqueue_messages(messages), robust=True)
+
 
 def send_telegram_notification(
     message: str,
 ):
-    requests.post(URL, json={"chat_id": CHAT_ID, "text": message})
+    send_telegram_notifications([message])
@@ -1,12 +1,19 @@
+from collections import Counter
+
 from django.db import transaction
+from django.db.models import Prefetch
 from rest_framework import serializers
 
 from book.models import Book
 from book.serializers import BookSerializer
 from borrowing.models import Borrowing
 from borrowing.notifications import send_telegram_notification
+from payment.models import Payment
 from payment.serializers import PaymentSerializer
-from payment.sessions import create_payment_session
+from payment.sessions import create_combined_payment_session, create_payment_session
+
+BULK_BORROWING_LIMIT = 50
+BULK_RETURN_LIMIT = 1000
 
 
 class BorrowingDetailSerializer(serializers.ModelSerializer):
@@ -30,6 +37,129 @@ class BorrowingDetailSerializer(serializers.ModelSerializer):
         return object.user.get_full_name() or object.user.username
 
 
+BORROWING_READ_FIELDS = (
+    "id",
+    "borrow_date",
+    "expected_return_date",
+    "actual_return_date",
+)
+BOOK_READ_FIELDS = ("id", "title", "author", "cover", "inventory", "daily_fee")
+USER_READ_FIELDS = ("first_name", "last_name")
+PAYMENT_READ_FIELDS = (
+    "id",
+    "status",
+    "type",
+    "borrowing",
+    "outbox",
+    "session_url",
+    "session_id",
+    "money_to_pay",
+    "session_expires_at",
+)
+
+
+def borrowing_read_queryset(queryset):
+    """
+    Load only the columns BorrowingDetailSerializer renders and fetch the
+    payments of all rows with one extra query
+    """
+    return (
+        queryset.select_related("book", "user")
+        .only(
+            *BORROWING_READ_FIELDS[1:],
+            *(f"book__{field}" for field in BOOK_READ_FIELDS),
+            *(f"user__{field}" for field in USER_READ_FIELDS),
+        )
+        .prefetch_related(
+            Prefetch(
+                "payments",
+                queryset=Payment.objects.only(*PAYMENT_READ_FIELDS).order_by("id"),
+            )
+        )
+    )
+
+
+def _formatters(fields: dict) -> dict:
+    formatters = {}
+    for name, field in fields.items():
+        if isinstance(field, serializers.RelatedField):
+            # Rendered as the raw primary key from values()
+            field = None
+        elif isinstance(field, serializers.DateTimeField) and not hasattr(
+            field, "timezone"
+        ):
+            # Resolve the active timezone once instead of for every value
+            field.timezone = field.default_timezone()
+        formatters[name] = field
+    return formatters
+
+
+def _format(formatters: dict, row: dict, prefix: str = "") -> dict:
+    data = {}
+    for name, field in formatters.items():
+        value = row[prefix + name]
+        if field is not None and value is not None:
+            value = field.to_representation(value)
+        data[name] = value
+    return data
+
+
+class BorrowingValuesSerializer:
+    """
+    Read-only equivalent of BorrowingDetailSerializer that renders values()
+    rows, skipping model instances and nested serializers altogether
+    """
+
+    columns = (
+        *BORROWING_READ_FIELDS,
+        *(f"book__{field}" for field in BOOK_READ_FIELDS),
+        *(f"user__{field}" for field in USER_READ_FIELDS),
+    )
+
+    def __init__(self, rows: list[dict]):
+        self.rows = rows
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.prefetch_related(None).values(*cls.columns)
+
+    def payments(self):
+        return (
+            Payment.objects.filter(borrowing_id__in=[row["id"] for row in self.rows])
+            .values(*PAYMENT_READ_FIELDS)
+            .order_by("id")
+        )
+
+    @property
+    def data(self) -> list[dict]:
+        return self.render(self.payments())
+
+    async def adata(self) -> list[dict]:
+        return self.render([payment async for payment in self.payments()])
+
+    def render(self, payment_rows) -> list[dict]:
+        detail = BorrowingDetailSerializer()
+        borrowing_formatters = _formatters(
+            {name: detail.fields[name] for name in BORROWING_READ_FIELDS}
+        )
+        book_formatters = _formatters(detail.fields["book"].fields)
+        payment_formatters = _formatters(PaymentSerializer().fields)
+
+        payments = {row["id"]: [] for row in self.rows}
+        for payment in payment_rows:
+            payments[payment["borrowing"]].append(_format(payment_formatters, payment))
+
+        data = []
+        for row in self.rows:
+            item = _format(borrowing_formatters, row)
+            item["book"] = _format(book_formatters, row, "book__")
+            full_name = f"{row['user__first_name']} {row['user__last_name']}"
+            item["user"] = full_name.strip() or None
+            item["payments"] = payments[row["id"]]
+            data.append(item)
+        return data
+
+
 class BorrowingCreateSerializer(serializers.ModelSerializer):
     payments = PaymentSerializer(many=True, read_only=True)
 
@@ -52,9 +182,13 @@ class BorrowingCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         with transaction.atomic():
             book = validated_data["book"]
+            # The inventory check above may be stale; this conditional update
+            # is what actually guards against overselling under concurrency.
+            if not Book.objects.reserve({book.id: 1}):
+                raise serializers.ValidationError("This book is out of inventory")
             borrowing = Borrowing.objects.create(**validated_data)
-            create_payment_session(borrowing)
-            Book.objects.filter(pk=book.id).update(inventory=book.inventory - 1)
+            # A new borrowing has no payment to reuse
+            create_payment_session(borrowing, reuse_pending=False)
             message = (
                 f"New borrowing created:\nUser: {borrowing.user}\n"
                 f"Book: {borrowing.book}\nBorrow date: {borrowing.borrow_date}"
@@ -64,6 +198,62 @@ class BorrowingCreateSerializer(serializers.ModelSerializer):
             return borrowing
 
 
+class BorrowingBulkCreateSerializer(serializers.Serializer):
+    books = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BULK_BORROWING_LIMIT,
+    )
+    expected_return_date = serializers.DateTimeField()
+
+    def validate_books(self, value):
+        self.book_map = Book.objects.in_bulk(value)
+        missing = [pk for pk in value if pk not in self.book_map]
+        if missing:
+            raise serializers.ValidationError(
+                f'Invalid pk "{missing[0]}" - object does not exist.'
+            )
+        return value
+
+    def create(self, validated_data):
+        """
+        Reserve every book of the cart with one conditional UPDATE and create
+        all borrowings with one INSERT. If any book is short of copies the
+        whole transaction rolls back.
+        """
+        quantities = Counter(validated_data["books"])
+        with transaction.atomic():
+            if Book.objects.reserve(quantities) != len(quantities):
+                raise serializers.ValidationError(
+                    "Some of the books are out of inventory"
+                )
+            borrowings = Borrowing.objects.bulk_create(
+                Borrowing(
+                    expected_return_date=validated_data["expected_return_date"],
+                    book=self.book_map[pk],
+                    user=validated_data["user"],
+                )
+                for pk in validated_data["books"]
+            )
+            create_combined_payment_session(borrowings, reuse_pending=False)
+            message = (
+                f"New borrowings created:\nUser: {validated_data['user']}\n"
+                f"Books: {', '.join(str(borrowing.book) for borrowing in borrowings)}\n"
+                f"Borrow date: {borrowings[0].borrow_date}"
+            )
+
+            send_telegram_notification(message)
+            return borrowings
+
+
+class BorrowingBulkReturnSerializer(serializers.Serializer):
+    borrowings = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        min_length=1,
+        max_length=BULK_RETURN_LIMIT,
+    )
+
+
 class BorrowingReturnSerializer(serializers.ModelSerializer):
     class Meta:
         model = Borrowing
@@ -1,25 +1,195 @@
 import datetime
+import logging
+from decimal import Decimal
 
-from borrowing.models import Borrowing
+from celery import chord, shared_task
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
 
-from celery import shared_task
+from borrowing.models import Borrowing, OverdueShard
+from borrowing.notifications import (
+    TelegramError,
+    deliver_messages,
+    drain_queued_messages,
+    send_telegram_notification,
+    send_telegram_notifications,
+)
+from payment.sessions import FINE_MULTIPLIER
 
-from borrowing.notifications import send_telegram_notification
+logger = logging.getLogger(__name__)
 
+OVERDUE_CHUNK_SIZE = 2000
+OVERDUE_MESSAGES_PER_BATCH = 100
 
-@shared_task
-def notification_about_overdue_borrowings():
-    today = datetime.datetime.now()
-    queryset = Borrowing.objects.filter(
-        actual_return_date__isnull=True, expected_return_date__lt=today
+
+def get_overdue_borrowings(today):
+    return (
+        Borrowing.objects.filter(
+            actual_return_date__isnull=True, expected_return_date__lt=today
+        )
+        .select_related("user", "book")
+        .only(
+            "borrow_date",
+            "expected_return_date",
+            "user__email",
+            "book__title",
+            "book__daily_fee",
+        )
+        .order_by("pk")
+    )
+
+
+def overdue_message(borrowing: Borrowing) -> str:
+    return (
+        f"This borrowing is overdue:\nUser: {borrowing.user}\n"
+        f"Book: {borrowing.book}\nBorrow date: {borrowing.borrow_date}\n"
+        f"Expected return date: {borrowing.expected_return_date}"
     )
-    if not queryset:
+
+
+def accrued_fine(borrowing: Borrowing, today) -> Decimal:
+    days = (today.date() - borrowing.expected_return_date.date()).days
+    return Decimal(int(borrowing.book.daily_fee) * days * FINE_MULTIPLIER)
+
+
+def notify_about_overdue_borrowings(queryset, today=None) -> dict:
+    """
+    Stream overdue borrowings through a server-side cursor and hand their
+    messages to the notification sender in batches. Runs a single query and
+    keeps at most one chunk of rows in memory.
+    """
+    today = today or timezone.now()
+    summary = {"count": 0, "fines": Decimal(0), "failures": 0}
+    batch = []
+    for borrowing in queryset.iterator(chunk_size=OVERDUE_CHUNK_SIZE):
+        try:
+            batch.append(overdue_message(borrowing))
+            summary["fines"] += accrued_fine(borrowing, today)
+        except Exception:
+            logger.exception("Failed to process overdue borrowing %s", borrowing.pk)
+            summary["failures"] += 1
+            continue
+        if len(batch) == OVERDUE_MESSAGES_PER_BATCH:
+            send_telegram_notifications(batch)
+            summary["count"] += len(batch)
+            batch = []
+    if batch:
+        send_telegram_notifications(batch)
+        summary["count"] += len(batch)
+    return summary
+
+
+def shard_ranges(start_pk: int, end_pk: int, shard_size: int) -> list[list[int]]:
+    """
+    Split the inclusive pk range into half-open [start, end) shards aligned
+    to multiples of shard_size, so the shard of a borrowing does not depend
+    on which other borrowings are overdue when the range is computed
+    """
+    first = start_pk // shard_size * shard_size
+    return [
+        [start, start + shard_size] for start in range(first, end_pk + 1, shard_size)
+    ]
+
+
+def shard_result(shard: OverdueShard) -> dict:
+    return {
+        "count": shard.count,
+        "fines": f"{shard.fines:.2f}",
+        "failures": shard.failures,
+    }
+
+
+@shared_task
+def notification_about_overdue_borrowings() -> int:
+    if settings.OVERDUE_FAN_OUT:
+        dispatch_overdue_shards.delay()
+        return 0
+    today = timezone.now()
+    summary = notify_about_overdue_borrowings(get_overdue_borrowings(today), today)
+    if not summary["count"]:
         send_telegram_notification("No borrowings overdue today!")
-    else:
-        for borrowing_overdue in queryset:
-            message = (
-                f"This borrowing is overdue:\nUser: {borrowing_overdue.user}\n"
-                f"Book: {borrowing_overdue.book}\nBorrow date: {borrowing_overdue.borrow_date}\n"
-                f"Expected return date: {borrowing_overdue.expected_return_date}"
-            )
-            send_telegram_notification(message)
+    return summary["count"]
+
+
+@shared_task
+def dispatch_overdue_shards(shard_size: int = None) -> int:
+    """
+    Split today's overdue borrowings into primary-key ranges and process them
+    as a chord of shard tasks on all workers. Returns the number of shards.
+    """
+    shard_size = shard_size or settings.OVERDUE_SHARD_SIZE
+    today = timezone.now()
+    bounds = get_overdue_borrowings(today).aggregate(start=Min("pk"), end=Max("pk"))
+    if bounds["start"] is None:
+        send_telegram_notification("No borrowings overdue today!")
+        return 0
+
+    ranges = shard_ranges(bounds["start"], bounds["end"], shard_size)
+    cutoff = today.isoformat()
+    chord(process_overdue_shard.s(cutoff, start, end) for start, end in ranges)(
+        summarize_overdue_shards.s(cutoff)
+    )
+    return len(ranges)
+
+
+@shared_task
+def process_overdue_shard(cutoff: str, start_pk: int, end_pk: int) -> dict:
+    """
+    Notify about overdue borrowings with start_pk <= pk < end_pk.
+    A shard that already completed for the run date returns its stored
+    result, so rerunning the whole fan-out after a crash sends nothing twice.
+    """
+    today = datetime.datetime.fromisoformat(cutoff)
+    run_date = timezone.localdate(today)
+    shard_key = {"run_date": run_date, "start_pk": start_pk, "end_pk": end_pk}
+
+    completed = OverdueShard.objects.filter(**shard_key).first()
+    if completed:
+        return shard_result(completed)
+
+    queryset = get_overdue_borrowings(today).filter(pk__gte=start_pk, pk__lt=end_pk)
+    try:
+        # Notifications are only queued if the shard record commits with them
+        with transaction.atomic():
+            summary = notify_about_overdue_borrowings(queryset, today)
+            shard = OverdueShard.objects.create(**shard_key, **summary)
+    except IntegrityError:
+        return shard_result(OverdueShard.objects.get(**shard_key))
+    except Exception:
+        logger.exception("Overdue shard %s-%s failed", start_pk, end_pk)
+        return {"count": 0, "fines": "0.00", "failures": 1}
+    return shard_result(shard)
+
+
+@shared_task
+def summarize_overdue_shards(results: list[dict], cutoff: str) -> dict:
+    summary = {
+        "run_date": cutoff,
+        "shards": len(results),
+        "count": sum(result["count"] for result in results),
+        "fines": f"{sum(Decimal(result['fines']) for result in results):.2f}",
+        "failures": sum(result["failures"] for result in results),
+    }
+    logger.info("Overdue borrowings summary: %s", summary)
+    return summary
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=5)
+def deliver_telegram_messages(self, messages: list[str] = None) -> int:
+    """
+    Send the given messages, or drain the shared queue and send everything
+    queued so far coalesced into as few Telegram messages as possible
+    """
+    try:
+        if messages is not None:
+            return deliver_messages(messages)
+        sent = 0
+        while messages := drain_queued_messages():
+            sent += deliver_messages(messages)
+        return sent
+    except TelegramError as exc:
+        raise self.retry(
+            args=(exc.pending or messages,), exc=exc, countdown=exc.retry_after
+        )
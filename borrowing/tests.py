@@ -1,18 +1,52 @@
+import json
+from io import StringIO
 from datetime import timedelta, datetime
+from decimal import Decimal
+from threading import Barrier, Thread
+from unittest import mock, skipUnless
 
+import redis
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
 from book.models import Book
 from book.tests import sample_book
-from borrowing.models import Borrowing
+from borrowing.models import Borrowing, OverdueShard
+from borrowing.notifications import (
+    BURST,
+    QUEUE_KEY,
+    SharedRateLimiter,
+    TelegramError,
+    TokenBucket,
+    coalesce,
+    deliver_messages,
+    send_telegram_notification,
+)
+from borrowing.tasks import (
+    deliver_telegram_messages,
+    dispatch_overdue_shards,
+    notification_about_overdue_borrowings,
+    process_overdue_shard,
+    shard_ranges,
+)
 from borrowing.serializers import (
+    BULK_BORROWING_LIMIT,
     BorrowingDetailSerializer,
 )
+from library_service.celery import app as celery_app
+from library_service.throttling import get_sliding_window_script
+from payment.models import Payment
 from user.tests import sample_user
 
 BORROWING_URL = reverse("borrowing:borrowing-list")
@@ -201,3 +235,683 @@ class AdminBorrowingApiTests(TestCase):
 
         self.assertIn(serializer1.data, res.data)
         self.assertNotIn(serializer2.data, res.data)
+
+
+class TelegramNotificationTests(TestCase):
+    def test_coalesce_messages_up_to_limit(self):
+        chunks = coalesce(["a" * 10, "b" * 10, "c" * 10], limit=25)
+
+        self.assertEqual(chunks, ["a" * 10 + "\n\n" + "b" * 10, "c" * 10])
+
+    def test_coalesce_splits_long_message(self):
+        chunks = coalesce(["a" * 30], limit=25)
+
+        self.assertEqual(chunks, ["a" * 25, "a" * 5])
+
+    def test_token_bucket_waits_for_refill(self):
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(rate=2, capacity=1, clock=lambda: now[0], sleep=sleep)
+        bucket.acquire()
+        bucket.acquire()
+
+        self.assertEqual(waits, [0.5])
+
+    def test_shared_limiter_falls_back_without_redis(self):
+        script = mock.Mock(side_effect=redis.RedisError("down"))
+        limiter = SharedRateLimiter("telegram:rate:test", 1, 1, script)
+
+        with self.assertLogs("borrowing.notifications", "WARNING"):
+            limiter.acquire()
+
+        self.assertEqual(limiter.fallback.tokens, 0)
+
+    @skipUnless(settings.REDIS_URL, "Requires a Redis server")
+    def test_rate_limit_shared_between_processes(self):
+        client = redis.Redis.from_url(settings.REDIS_URL)
+        key = "telegram:rate:test"
+        client.delete(key)
+        self.addCleanup(client.delete, key)
+        now = [1_700_000_000.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        # Separate limiters stand in for separate worker processes
+        limiters = [
+            SharedRateLimiter(
+                key, 1, BURST, get_sliding_window_script(), lambda: now[0], sleep
+            )
+            for _ in range(2)
+        ]
+        for index in range(BURST):
+            limiters[index % 2].acquire()
+        self.assertEqual(waits, [])
+
+        # About one second, as the burst was spread over both processes
+        limiters[1].acquire()
+        self.assertAlmostEqual(sum(waits), 1, places=2)
+
+    @override_settings(REDIS_URL=None)
+    def test_notification_sent_after_commit(self):
+        with mock.patch("borrowing.tasks.deliver_telegram_messages.delay") as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                send_telegram_notification("message")
+                delay.assert_not_called()
+
+        delay.assert_called_once_with(["message"])
+
+    def test_broker_outage_does_not_fail_request(self):
+        with mock.patch(
+            "borrowing.tasks.deliver_telegram_messages.delay",
+            side_effect=OSError("Broker down"),
+        ), self.assertLogs("django.test", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                send_telegram_notification("message")
+
+    @skipUnless(settings.REDIS_URL, "Requires a Redis server")
+    def test_worker_coalesces_queued_messages(self):
+        client = redis.Redis.from_url(settings.REDIS_URL)
+        client.delete(QUEUE_KEY)
+        self.addCleanup(client.delete, QUEUE_KEY)
+        telegram = mock.Mock()
+
+        with mock.patch("borrowing.tasks.deliver_telegram_messages.delay") as delay:
+            for message in ("first", "second"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    send_telegram_notification(message)
+        with mock.patch("borrowing.notifications.get_client", return_value=telegram):
+            sent = deliver_telegram_messages()
+
+        self.assertEqual(delay.call_args_list, [mock.call(), mock.call()])
+        self.assertEqual(sent, 1)
+        telegram.send.assert_called_once_with("first\n\nsecond")
+        self.assertEqual(client.llen(QUEUE_KEY), 0)
+
+    def test_deliver_messages_keeps_undelivered_chunks(self):
+        client = mock.Mock()
+        client.send.side_effect = [None, TelegramError("down")]
+
+        with mock.patch("borrowing.notifications.get_client", return_value=client):
+            with self.assertRaises(TelegramError) as context:
+                deliver_messages(["a" * 4000, "b" * 4000, "c" * 4000])
+
+        self.assertEqual(context.exception.pending, ["b" * 4000, "c" * 4000])
+
+
+class OverdueBorrowingsTaskTests(TestCase):
+    def setUp(self):
+        self.book = sample_book()
+        self.user = sample_user()
+
+    def create_overdue(self, count):
+        Borrowing.objects.bulk_create(
+            Borrowing(
+                expected_return_date=timezone.now() - timedelta(days=1),
+                book=self.book,
+                user=self.user,
+            )
+            for _ in range(count)
+        )
+
+    @mock.patch("borrowing.tasks.send_telegram_notifications")
+    def test_query_count_does_not_depend_on_rows(self, send):
+        self.create_overdue(3)
+        with self.assertNumQueries(1):
+            notification_about_overdue_borrowings()
+
+        self.create_overdue(250)
+        with self.assertNumQueries(1):
+            total = notification_about_overdue_borrowings()
+
+        self.assertEqual(total, 253)
+        self.assertEqual(
+            [len(call.args[0]) for call in send.call_args_list][-3:], [100, 100, 53]
+        )
+
+    @mock.patch("borrowing.tasks.send_telegram_notification")
+    def test_no_overdue_borrowings(self, send):
+        Borrowing.objects.create(
+            expected_return_date=timezone.now() + timedelta(days=1),
+            book=self.book,
+            user=self.user,
+        )
+
+        notification_about_overdue_borrowings()
+
+        send.assert_called_once_with("No borrowings overdue today!")
+
+
+@skipUnless(connection.vendor == "postgresql", "Needs EXPLAIN ANALYZE")
+class HotQueryPlanTests(TestCase):
+    def test_hot_queries_do_not_scan_borrowings(self):
+        out = StringIO()
+
+        call_command(
+            "explain_hot_queries",
+            rows=20000,
+            users=2000,
+            books=10000,
+            stdout=out,
+        )
+
+        self.assertIn("overdue job", out.getvalue())
+        self.assertFalse(Borrowing.objects.exists())
+
+
+class ShardedOverdueBorrowingsTests(TestCase):
+    def setUp(self):
+        self.book = sample_book(daily_fee=2)
+        self.user = sample_user()
+        Borrowing.objects.bulk_create(
+            Borrowing(
+                expected_return_date=timezone.now() - timedelta(days=3),
+                book=self.book,
+                user=self.user,
+            )
+            for _ in range(5)
+        )
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, "task_always_eager", False)
+
+    def test_shard_ranges(self):
+        self.assertEqual(shard_ranges(1, 25, 10), [[0, 10], [10, 20], [20, 30]])
+        self.assertEqual(shard_ranges(12, 25, 10), [[10, 20], [20, 30]])
+
+    @mock.patch("borrowing.tasks.send_telegram_notifications")
+    def test_fan_out_summary(self, send):
+        with mock.patch("borrowing.tasks.logger") as logger:
+            shards = dispatch_overdue_shards(shard_size=2)
+
+        summary = logger.info.call_args.args[1]
+        self.assertEqual(shards, 3)
+        self.assertEqual(OverdueShard.objects.count(), 3)
+        self.assertEqual(summary["count"], 5)
+        self.assertEqual(summary["fines"], "60.00")
+        self.assertEqual(summary["failures"], 0)
+
+    @mock.patch("borrowing.tasks.send_telegram_notifications")
+    def test_rerun_after_bounds_change_sends_nothing_twice(self, send):
+        dispatch_overdue_shards(shard_size=2)
+        first = Borrowing.objects.order_by("pk").first()
+        first.actual_return_date = timezone.now()
+        first.save()
+        send.reset_mock()
+
+        dispatch_overdue_shards(shard_size=2)
+
+        send.assert_not_called()
+        self.assertEqual(OverdueShard.objects.count(), 3)
+
+    @mock.patch("borrowing.tasks.send_telegram_notifications")
+    def test_shard_rerun_does_not_notify_twice(self, send):
+        cutoff = timezone.now().isoformat()
+        first_pk = Borrowing.objects.order_by("pk").first().pk
+
+        first = process_overdue_shard(cutoff, first_pk, first_pk + 5)
+        second = process_overdue_shard(cutoff, first_pk, first_pk + 5)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first["count"], 5)
+        send.assert_called_once()
+
+
+@skipUnless(connection.vendor == "postgresql", "Needs row-level locking")
+class ConcurrentInventoryTests(TransactionTestCase):
+    threads = 20
+
+    def setUp(self):
+        self.book = sample_book(inventory=5)
+        self.users = [
+            get_user_model().objects.create_user(f"user{i}@test.com", "testpass")
+            for i in range(self.threads)
+        ]
+        for target in (
+            "payment.sessions.create_checkout_session.delay",
+            "borrowing.tasks.deliver_telegram_messages.delay",
+        ):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_concurrently(self, requests):
+        barrier = Barrier(len(requests))
+        responses = []
+
+        def run(user, method, url, data):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                responses.append(getattr(client, method)(url, data))
+            finally:
+                connection.close()
+
+        workers = [Thread(target=run, args=request) for request in requests]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return responses
+
+    def test_concurrent_borrow_and_return(self):
+        payload = {
+            "expected_return_date": timezone.now() + timedelta(days=10),
+            "book": self.book.id,
+        }
+        responses = self.run_concurrently(
+            [(user, "post", BORROWING_URL, payload) for user in self.users]
+        )
+        created = [res for res in responses if res.status_code == 201]
+
+        self.book.refresh_from_db()
+        self.assertEqual(len(created), 5)
+        self.assertEqual(self.book.inventory, 0)
+        self.assertEqual(Borrowing.objects.count(), 5)
+
+        borrowings = Borrowing.objects.select_related("user")
+        self.run_concurrently(
+            [
+                (borrowing.user, "post", return_url(borrowing.id), {})
+                for borrowing in borrowings
+            ]
+        )
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 5)
+
+
+BULK_BORROWING_URL = reverse("borrowing:borrowing-bulk")
+
+
+class BulkBorrowingApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user("bulk@test.com", "testpass")
+        self.client.force_authenticate(self.user)
+        self.books = [sample_book(title=f"Book {i}", inventory=2) for i in range(3)]
+
+    def payload(self, books):
+        return {
+            "expected_return_date": timezone.now() + timedelta(days=10),
+            "books": [book.id for book in books],
+        }
+
+    def test_bulk_borrowing(self):
+        books = self.books + [self.books[0]]
+
+        res = self.client.post(BULK_BORROWING_URL, self.payload(books), format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), 4)
+        self.assertEqual(
+            [book.inventory for book in Book.objects.order_by("id")], [0, 1, 1]
+        )
+        payments = Payment.objects.filter(borrowing__user=self.user)
+        self.assertEqual(payments.count(), 4)
+        self.assertEqual(payments.values("outbox").distinct().count(), 1)
+        self.assertEqual(len(payments.first().outbox.line_items), 4)
+
+    def test_full_cart_within_query_budget(self):
+        books = [
+            sample_book(title=f"Cart {i}", inventory=1)
+            for i in range(BULK_BORROWING_LIMIT)
+        ]
+
+        # The test runner fails requests over their query budget
+        res = self.client.post(BULK_BORROWING_URL, self.payload(books), format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data), BULK_BORROWING_LIMIT)
+        self.assertTrue(all(len(item["payments"]) == 1 for item in res.data))
+
+    def test_bulk_borrowing_is_all_or_nothing(self):
+        books = self.books + [self.books[1], self.books[1]]
+
+        res = self.client.post(BULK_BORROWING_URL, self.payload(books), format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            [book.inventory for book in Book.objects.order_by("id")], [2, 2, 2]
+        )
+        self.assertFalse(Borrowing.objects.exists())
+        self.assertFalse(Payment.objects.exists())
+
+    def test_bulk_borrowing_unknown_book(self):
+        payload = self.payload(self.books)
+        payload["books"].append(0)
+
+        res = self.client.post(BULK_BORROWING_URL, payload, format="json")
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("books", res.data)
+
+
+BULK_RETURN_URL = reverse("borrowing:borrowing-bulk-return")
+
+
+class BulkReturnApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = get_user_model().objects.create_user(
+            "desk@test.com", "testpass", is_staff=True
+        )
+        self.patron = sample_user()
+        self.book = sample_book(inventory=0, daily_fee=3)
+
+    def borrowing(self, days_overdue, user=None):
+        return Borrowing.objects.create(
+            expected_return_date=timezone.now() - timedelta(days=days_overdue),
+            book=self.book,
+            user=user or self.patron,
+        )
+
+    def test_bulk_return_with_fines(self):
+        overdue = [self.borrowing(2), self.borrowing(5)]
+        on_time = self.borrowing(-3, user=self.admin)
+        self.client.force_authenticate(self.admin)
+
+        res = self.client.post(
+            BULK_RETURN_URL,
+            {"borrowings": [borrowing.id for borrowing in overdue + [on_time]]},
+            format="json",
+        )
+
+        self.book.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.book.inventory, 3)
+        self.assertFalse(
+            Borrowing.objects.filter(actual_return_date__isnull=True).exists()
+        )
+        fines = Payment.objects.filter(type=Payment.Type.FINE).order_by("money_to_pay")
+        self.assertEqual(
+            [fine.money_to_pay for fine in fines], [Decimal("12"), Decimal("30")]
+        )
+        self.assertEqual(fines[0].outbox_id, fines[1].outbox_id)
+        self.assertFalse(on_time.payments.exists())
+
+    def test_query_count_does_not_depend_on_borrowings(self):
+        self.client.force_authenticate(self.patron)
+        counts = []
+        for size in (3, 30):
+            ids = [self.borrowing(2).id for _ in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(
+                    BULK_RETURN_URL, {"borrowings": ids}, format="json"
+                )
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertTrue(all(len(item["payments"]) == 1 for item in res.data))
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+
+    def test_query_count_does_not_depend_on_patrons(self):
+        self.client.force_authenticate(self.admin)
+        counts = []
+        for size in (3, 30):
+            ids = [
+                self.borrowing(2, user=sample_user(email=f"{size}-{n}@test.com")).id
+                for n in range(size)
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.post(
+                    BULK_RETURN_URL, {"borrowings": ids}, format="json"
+                )
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+
+        fines = Payment.objects.filter(type=Payment.Type.FINE)
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(fines.count(), 33)
+        self.assertEqual(fines.values("outbox").distinct().count(), 33)
+
+    def test_bulk_return_rejects_returned_borrowings(self):
+        borrowing = self.borrowing(1)
+        returned = self.borrowing(1)
+        returned.actual_return_date = timezone.now()
+        returned.save()
+        self.client.force_authenticate(self.patron)
+
+        res = self.client.post(
+            BULK_RETURN_URL, {"borrowings": [borrowing.id, returned.id]}, format="json"
+        )
+
+        borrowing.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIsNone(borrowing.actual_return_date)
+
+    def test_patron_cannot_return_others_borrowings(self):
+        borrowing = self.borrowing(1, user=self.admin)
+        self.client.force_authenticate(self.patron)
+
+        res = self.client.post(
+            BULK_RETURN_URL, {"borrowings": [borrowing.id]}, format="json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user()
+        self.client.force_authenticate(self.user)
+        book = sample_book(inventory=10)
+        same_time = timezone.now() - timedelta(days=1)
+        for index in range(7):
+            borrowing = Borrowing.objects.create(
+                expected_return_date=timezone.now() + timedelta(days=10),
+                book=book,
+                user=self.user,
+            )
+            if index % 2:
+                # Ties on borrow_date are broken by id
+                Borrowing.objects.filter(pk=borrowing.pk).update(borrow_date=same_time)
+        self.expected = list(
+            Borrowing.objects.order_by("-borrow_date", "id").values_list(
+                "id", flat=True
+            )
+        )
+
+    def walk(self, url, params=None):
+        pages = []
+        res = self.client.get(url, params)
+        while True:
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            pages.append(res.data)
+            if not res.data["next"]:
+                return pages
+            res = self.client.get(res.data["next"])
+
+    def test_pages_follow_keyset_ordering(self):
+        pages = self.walk(BORROWING_URL, {"pagination": "cursor", "page_size": 3})
+
+        ids = [item["id"] for page in pages for item in page["results"]]
+        self.assertEqual(ids, self.expected)
+        self.assertEqual([len(page["results"]) for page in pages], [3, 3, 1])
+        self.assertIsNone(pages[0]["previous"])
+        self.assertNotIn("count", pages[0])
+
+    def test_previous_link(self):
+        pages = self.walk(BORROWING_URL, {"pagination": "cursor", "page_size": 3})
+
+        res = self.client.get(pages[2]["previous"])
+
+        self.assertEqual(res.data["results"], pages[1]["results"])
+        self.assertEqual(res.data["next"], pages[1]["next"])
+
+    def test_optional_count(self):
+        res = self.client.get(BORROWING_URL, {"pagination": "cursor", "count": "true"})
+
+        self.assertEqual(res.data["count"], 7)
+
+    def test_page_size_capped(self):
+        with mock.patch("borrowing.views.BorrowingPagination.max_page_size", 4):
+            res = self.client.get(
+                BORROWING_URL, {"pagination": "cursor", "page_size": 50}
+            )
+
+        self.assertEqual(len(res.data["results"]), 4)
+
+    def test_deep_page_does_not_count_or_offset(self):
+        pages = self.walk(BORROWING_URL, {"pagination": "cursor", "page_size": 3})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(pages[1]["next"])
+
+        sql = queries.captured_queries[0]["sql"].upper()
+        self.assertIn("BORROWING_BORROWING", sql)
+        self.assertNotIn("COUNT(", sql)
+        self.assertNotIn("OFFSET", sql)
+
+    def test_invalid_cursor(self):
+        res = self.client.get(BORROWING_URL, {"cursor": "not-a-cursor"})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BorrowingListQueryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(first_name="Ada", last_name="Lovelace")
+        self.client.force_authenticate(self.user)
+        book = sample_book(inventory=50)
+        for index in range(30):
+            borrowing = Borrowing.objects.create(
+                expected_return_date=timezone.now() + timedelta(days=10),
+                book=book,
+                user=self.user,
+            )
+            for payment_type in (Payment.Type.PAYMENT, Payment.Type.FINE)[: index % 3]:
+                Payment.objects.create(
+                    status=Payment.Status.PENDING,
+                    type=payment_type,
+                    borrowing=borrowing,
+                    session_url="https://checkout.example.com",
+                    session_id=f"cs_{index}_{payment_type}",
+                    money_to_pay=Decimal("1.50"),
+                )
+
+    def assert_constant_queries(self, params):
+        counts = []
+        for page_size in (1, 10, 30):
+            with CaptureQueriesContext(connection) as queries:
+                res = self.client.get(BORROWING_URL, {**params, "page_size": page_size})
+            self.assertEqual(len(res.data["results"]), page_size)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, counts)
+        return counts[0]
+
+    def test_list_query_count_is_constant(self):
+        # count, page with book and user joined, payments
+        self.assertEqual(self.assert_constant_queries({}), 3)
+        self.assertEqual(self.assert_constant_queries({"pagination": "cursor"}), 2)
+
+    def test_retrieve_query_count(self):
+        borrowing = Borrowing.objects.first()
+
+        with self.assertNumQueries(2):
+            res = self.client.get(detail_url(borrowing.id))
+
+        self.assertEqual(res.data["user"], "Ada Lovelace")
+
+    @override_settings(BORROWING_FAST_READS=True)
+    def test_fast_list_query_count_is_constant(self):
+        self.assertEqual(self.assert_constant_queries({}), 3)
+        self.assertEqual(self.assert_constant_queries({"pagination": "cursor"}), 2)
+
+    def test_fast_list_matches_detail_serializer(self):
+        params = {"page_size": 30}
+        expected = self.client.get(BORROWING_URL, params).data
+
+        with override_settings(BORROWING_FAST_READS=True):
+            res = self.client.get(BORROWING_URL, params)
+
+        self.assertEqual(
+            json.loads(json.dumps(res.data, cls=DjangoJSONEncoder)),
+            json.loads(json.dumps(expected, cls=DjangoJSONEncoder)),
+        )
+
+    @override_settings(BORROWING_FAST_READS=True)
+    def test_fast_list_cursor_pages(self):
+        first = self.client.get(
+            BORROWING_URL, {"pagination": "cursor", "page_size": 20}
+        )
+        second = self.client.get(first.data["next"])
+
+        ids = [row["id"] for row in first.data["results"] + second.data["results"]]
+        self.assertEqual(
+            ids,
+            list(
+                Borrowing.objects.order_by("-borrow_date", "id").values_list(
+                    "id", flat=True
+                )
+            ),
+        )
+
+
+BORROWING_ASYNC_URL = reverse("borrowing:borrowing-list-async")
+
+
+class AsyncBorrowingApiTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = sample_user(first_name="Ada", last_name="Lovelace")
+        self.client.force_authenticate(self.user)
+        self.headers = {"Authorize": f"Bearer {AccessToken.for_user(self.user)}"}
+        book = sample_book(inventory=50)
+        self.borrowing = Borrowing.objects.create(
+            expected_return_date=timezone.now() + timedelta(days=10),
+            book=book,
+            user=self.user,
+        )
+        Payment.objects.create(
+            status=Payment.Status.PENDING,
+            type=Payment.Type.PAYMENT,
+            borrowing=self.borrowing,
+            session_url="https://checkout.example.com",
+            session_id="cs_async",
+            money_to_pay=Decimal("1.50"),
+        )
+        self.other = Borrowing.objects.create(
+            expected_return_date=timezone.now() + timedelta(days=10),
+            book=book,
+            user=sample_user(email="other@gmail.com"),
+        )
+
+    async def test_auth_required(self):
+        res = await self.async_client.get(BORROWING_ASYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn("WWW-Authenticate", res)
+
+    async def test_list_matches_sync_view(self):
+        expected = await sync_to_async(self.client.get)(BORROWING_URL)
+
+        res = await self.async_client.get(BORROWING_ASYNC_URL, headers=self.headers)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json()["count"], 1)
+        self.assertEqual(res.json()["results"], expected.json()["results"])
+
+    async def test_detail_matches_sync_view(self):
+        url = reverse("borrowing:borrowing-detail-async", args=[self.borrowing.id])
+        expected = await sync_to_async(self.client.get)(detail_url(self.borrowing.id))
+
+        res = await self.async_client.get(url, headers=self.headers)
+
+        self.assertEqual(res.json(), expected.json())
+
+    async def test_detail_of_other_user_not_found(self):
+        url = reverse("borrowing:borrowing-detail-async", args=[self.other.id])
+
+        res = await self.async_client.get(url, headers=self.headers)
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
@@ -1,7 +1,11 @@
 from rest_framework import routers
 from django.urls import path, include
 
-from borrowing.views import BorrowingViewSet
+from borrowing.views import (
+    BorrowingDetailAsyncView,
+    BorrowingListAsyncView,
+    BorrowingViewSet,
+)
 
 router = routers.DefaultRouter()
 
@@ -9,6 +13,12 @@ router = routers.DefaultRouter()
 router.register("", BorrowingViewSet)
 
 urlpatterns = [
+    path("async/", BorrowingListAsyncView.as_view(), name="borrowing-list-async"),
+    path(
+        "async/<int:pk>/",
+        BorrowingDetailAsyncView.as_view(),
+        name="borrowing-detail-async",
+    ),
     path(
         "<int:pk>/return",
         BorrowingViewSet.as_view({"post": "return_book"}),
@@ -0,0 +1,81 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+
+class AsyncReadView(View):
+    """
+    Read-only endpoint for ASGI workers. It authenticates, checks permissions
+    and throttles with the DRF classes of the sync views and renders the same
+    JSON, while the handler awaits the ORM instead of holding a thread.
+    Handlers return response data or a Response.
+    """
+
+    http_method_names = ["get", "head"]
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = api_settings.DEFAULT_PERMISSION_CLASSES
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
+    renderer = JSONRenderer()
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.request = Request(
+            request,
+            authenticators=[auth() for auth in self.authentication_classes],
+        )
+        try:
+            await sync_to_async(self.initial)(self.request)
+            data = await super().dispatch(self.request, *args, **kwargs)
+        except Http404:
+            return self.handle_exception(exceptions.NotFound())
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+        if isinstance(data, Response):
+            return self.render(data.data, data.status_code, data.items())
+        if isinstance(data, HttpResponse):
+            return data
+        return self.render(data)
+
+    def initial(self, request) -> None:
+        """Authentication, permissions and throttling as in APIView.initial"""
+        request.user  # authenticates
+        for permission in self.permission_classes:
+            if not permission().has_permission(request, self):
+                if request.authenticators and not request.successful_authenticator:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied()
+        waits = [
+            throttle.wait()
+            for throttle in (throttle() for throttle in self.throttle_classes)
+            if not throttle.allow_request(request, self)
+        ]
+        if waits:
+            raise exceptions.Throttled(
+                max((wait for wait in waits if wait is not None), default=None)
+            )
+
+    def handle_exception(self, exc) -> HttpResponse:
+        if isinstance(
+            exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)
+        ):
+            exc.auth_header = self.request.authenticators[0].authenticate_header(
+                self.request
+            )
+        response = exception_handler(exc, {"view": self, "request": self.request})
+        return self.render(response.data, response.status_code, response.items())
+
+    def render(self, data, status: int = 200, headers=()) -> HttpResponse:
+        response = HttpResponse(
+            self.renderer.render(data),
+            status=status,
+            content_type="application/json",
+        )
+        for header, value in headers:
+            if header != "Content-Type":
+                response[header] = value
+        return response
@@ -1,6 +1,7 @@
 import os
 
 from celery import Celery
+from celery.schedules import crontab
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_service.settings")
@@ -16,6 +17,30 @@ app.config_from_object("django.conf:settings", namespace="CELERY")
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+# Kept here rather than in settings so loading settings does not need Celery
+app.conf.beat_schedule = {
+    "notification_about_overdue_borrowings": {
+        "task": "borrowing.tasks.notification_about_overdue_borrowings",
+        "schedule": crontab(minute=0, hour=9),
+    },
+    "dispatch_payment_outbox": {
+        "task": "payment.tasks.dispatch_payment_outbox",
+        "schedule": crontab(),
+    },
+    "process_stripe_events": {
+        "task": "payment.tasks.process_stripe_events",
+        "schedule": crontab(),
+    },
+    "expire_payment_sessions": {
+        "task": "payment.tasks.expire_payment_sessions",
+        "schedule": crontab(minute="*/10"),
+    },
+    "reconcile_payments": {
+        "task": "payment.tasks.reconcile_payments",
+        "schedule": crontab(minute="*/15"),
+    },
+}
+
 
 @app.task(bind=True)
 def debug_task(self):
@@ -0,0 +1,131 @@
+import logging
+import time
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+COUNTERS = ("calls", "failures", "rejected", "opened")
+
+
+class CircuitOpen(Exception):
+    """Call refused without trying while the dependency is unhealthy"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stop calling a dependency after failure_threshold consecutive failures.
+    Calls then fail fast with CircuitOpen for reset_timeout seconds, after
+    which a single trial call decides whether the circuit closes again.
+    State and counters live in the cache, so every web and Celery process
+    sees the same circuit.
+    """
+
+    timer = time.time
+
+    def __init__(
+        self,
+        name: str,
+        failure_exceptions: tuple[type[Exception], ...],
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        trial_timeout: float = 60,
+    ):
+        self.name = name
+        self.failure_exceptions = failure_exceptions
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = trial_timeout
+
+    def key(self, suffix: str) -> str:
+        return f"breaker:{self.name}:{suffix}"
+
+    def incr(self, counter: str) -> int:
+        key = self.key(counter)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            cache.add(key, 0, None)
+            return cache.incr(key)
+
+    @property
+    def state(self) -> str:
+        opened_until = cache.get(self.key("opened_until"))
+        if opened_until is None:
+            return CLOSED
+        return OPEN if self.timer() < opened_until else HALF_OPEN
+
+    def call(self, func, *args, **kwargs):
+        self.before_call()
+        try:
+            result = func(*args, **kwargs)
+        except self.failure_exceptions:
+            self.record_failure()
+            raise
+        except Exception:
+            # The dependency answered, it refused this particular call
+            self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def before_call(self) -> None:
+        opened_until = cache.get(self.key("opened_until"))
+        if opened_until is not None:
+            now = self.timer()
+            # Once the timeout is over one caller tries, the others wait for it
+            if now < opened_until or not cache.add(
+                self.key("trial"), True, self.trial_timeout
+            ):
+                self.incr("rejected")
+                raise CircuitOpen(self.name, max(opened_until - now, 1))
+        self.incr("calls")
+
+    def record_failure(self) -> None:
+        self.incr("failures")
+        failures = self.incr("consecutive_failures")
+        if (
+            failures >= self.failure_threshold
+            or cache.get(self.key("opened_until")) is not None
+        ):
+            self.open()
+
+    def record_success(self) -> None:
+        cache.delete(self.key("consecutive_failures"))
+        if cache.get(self.key("opened_until")) is not None:
+            cache.delete_many([self.key("opened_until"), self.key("trial")])
+            logger.warning("Circuit %s closed", self.name)
+
+    def open(self) -> None:
+        cache.set(self.key("opened_until"), self.timer() + self.reset_timeout, None)
+        cache.delete(self.key("trial"))
+        self.incr("opened")
+        logger.warning("Circuit %s opened for %ss", self.name, self.reset_timeout)
+
+    def metrics(self) -> dict:
+        values = cache.get_many(
+            [self.key(name) for name in (*COUNTERS, "consecutive_failures")]
+            + [self.key("opened_until")]
+        )
+        opened_until = values.get(self.key("opened_until"))
+        now = self.timer()
+        if opened_until is None:
+            state, retry_after = CLOSED, 0
+        elif now < opened_until:
+            state, retry_after = OPEN, opened_until - now
+        else:
+            state, retry_after = HALF_OPEN, 0
+        return {
+            "name": self.name,
+            "state": state,
+            "retry_after": round(retry_after, 3),
+            "consecutive_failures": values.get(self.key("consecutive_failures"), 0),
+            **{name: values.get(self.key(name), 0) for name in COUNTERS},
+        }
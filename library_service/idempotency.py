@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings
+
+IDEMPOTENCY_HEADER = "HTTP_IDEMPOTENCY_KEY"
+MAX_KEY_LENGTH = 255
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+# Conflicts, throttling and server errors may succeed when retried
+NOT_STORED_STATUSES = (409, 429)
+POLL_INTERVAL = 0.05
+
+
+def fingerprint(request) -> str:
+    digest = hashlib.sha256(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def token_user(request) -> str | None:
+    """Id of the user of the request's access token, None without a valid one"""
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    if header is None:
+        return None
+    try:
+        raw_token = authentication.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = authentication.get_validated_token(raw_token)
+        return str(token[api_settings.USER_ID_CLAIM])
+    except (AuthenticationFailed, KeyError):
+        return None
+
+
+def client_scope(request) -> str | None:
+    """
+    The user of a valid access token, so a retry made with a refreshed token
+    still matches, or the address of an anonymous client. None for invalid
+    credentials, which the view refuses anyway.
+    """
+    if JWTAuthentication().get_header(request) is None:
+        ident = BaseThrottle().get_ident(request)
+        return f"anon:{hashlib.sha1(ident.encode()).hexdigest()}"
+    user_id = token_user(request)
+    return None if user_id is None else f"user:{user_id}"
+
+
+def cache_key(request, key: str) -> str | None:
+    """Keys are scoped to the client the request was made by"""
+    scope = client_scope(request)
+    if scope is None:
+        return None
+    return f"idempotency:{scope}:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+class IdempotencyMiddleware:
+    """
+    Apply an unsafe request carrying an Idempotency-Key header once per
+    client, the authenticated user or the address of an anonymous one. The
+    first response is kept in the cache for IDEMPOTENCY_TTL seconds and
+    replayed to retries with the same key, marked with Idempotent-Replayed.
+    A request arriving while the first one is still running waits for it on
+    a lock in the cache, then gets the replay, or 409 after
+    IDEMPOTENCY_LOCK_WAIT seconds. Reusing a key for a different request
+    is refused with 422.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        parsed = self.parse(request)
+        if not isinstance(parsed, tuple):
+            return parsed or self.get_response(request)
+        key, request_fingerprint = parsed
+
+        deadline = time.monotonic() + settings.IDEMPOTENCY_LOCK_WAIT
+        while (token := self.lock(key)) is None:
+            response = self.replay(key, request_fingerprint)
+            if response is not None:
+                return response
+            if time.monotonic() >= deadline:
+                return self.in_progress()
+            time.sleep(POLL_INTERVAL)
+        try:
+            response = self.replay(key, request_fingerprint)
+            if response is None:
+                response = self.get_response(request)
+                self.store(key, request_fingerprint, response)
+        finally:
+            self.unlock(key, token)
+        return response
+
+    async def __acall__(self, request):
+        parsed = self.parse(request)
+        if not isinstance(parsed, tuple):
+            return parsed or await self.get_response(request)
+        key, request_fingerprint = parsed
+
+        deadline = time.monotonic() + settings.IDEMPOTENCY_LOCK_WAIT
+        while (token := self.lock(key)) is None:
+            response = self.replay(key, request_fingerprint)
+            if response is not None:
+                return response
+            if time.monotonic() >= deadline:
+                return self.in_progress()
+            await asyncio.sleep(POLL_INTERVAL)
+        try:
+            response = self.replay(key, request_fingerprint)
+            if response is None:
+                response = await self.get_response(request)
+                self.store(key, request_fingerprint, response)
+        finally:
+            self.unlock(key, token)
+        return response
+
+    @staticmethod
+    def parse(request) -> tuple[str, str] | HttpResponse | None:
+        """Cache key and fingerprint of the request, None without a key"""
+        key = request.META.get(IDEMPOTENCY_HEADER)
+        if not key or request.method in SAFE_METHODS:
+            return None
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse(
+                {"detail": f"Idempotency-Key is longer than {MAX_KEY_LENGTH}"},
+                status=400,
+            )
+        scoped_key = cache_key(request, key)
+        if scoped_key is None:
+            return None
+        return scoped_key, fingerprint(request)
+
+    @staticmethod
+    def lock(key: str) -> str | None:
+        token = uuid.uuid4().hex
+        if cache.add(f"{key}:lock", token, settings.IDEMPOTENCY_LOCK_TIMEOUT):
+            return token
+        return None
+
+    @staticmethod
+    def unlock(key: str, token: str) -> None:
+        # The lock may have timed out and been taken by another request
+        if cache.get(f"{key}:lock") == token:
+            cache.delete(f"{key}:lock")
+
+    @staticmethod
+    def replay(key: str, request_fingerprint: str) -> HttpResponse | None:
+        stored = cache.get(key)
+        if stored is None:
+            return None
+        if stored["fingerprint"] != request_fingerprint:
+            return JsonResponse(
+                {"detail": "Idempotency-Key was already used for another request"},
+                status=422,
+            )
+        response = HttpResponse(stored["content"], status=stored["status"])
+        for header, value in stored["headers"]:
+            response[header] = value
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+    @staticmethod
+    def store(key: str, request_fingerprint: str, response) -> None:
+        if (
+            response.streaming
+            or response.status_code >= 500
+            or response.status_code in NOT_STORED_STATUSES
+        ):
+            return
+        cache.set(
+            key,
+            {
+                "fingerprint": request_fingerprint,
+                "status": response.status_code,
+                "content": response.content,
+                "headers": list(response.items()),
+            },
+            settings.IDEMPOTENCY_TTL,
+        )
+
+    @staticmethod
+    def in_progress() -> HttpResponse:
+        response = JsonResponse(
+            {"detail": "A request with this Idempotency-Key is still in progress"},
+            status=409,
+        )
+        response["Retry-After"] = "1"
+        return response
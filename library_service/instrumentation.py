@@ -0,0 +1,201 @@
+import contextvars
+import functools
+import json
+import logging
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """A view ran more SQL queries than it declared"""
+
+
+@dataclass
+class RequestMetrics:
+    queries: int = 0
+    db_time: float = 0.0
+    timings: dict = field(default_factory=dict)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(name: str):
+    """Add the time spent in the block to the current request's timings"""
+    metrics = _metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - started)
+
+
+def timed_call(name: str):
+    """Decorator form of timed()"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def query_budget(limit: int):
+    """Declare the maximum number of SQL queries a function view may run"""
+
+    def decorator(view):
+        view.query_budget = limit
+        return view
+
+    return decorator
+
+
+def get_query_budget(view_func, request) -> int | None:
+    """
+    Budget of a view. Class based views declare query_budget as an int or,
+    for viewsets, as a mapping of action names to ints.
+    """
+    budget = getattr(view_func, "query_budget", None)
+    view_class = getattr(view_func, "cls", None) or getattr(
+        view_func, "view_class", None
+    )
+    if budget is None and view_class is not None:
+        budget = getattr(view_class, "query_budget", None)
+    if isinstance(budget, dict):
+        actions = getattr(view_func, "actions", None) or {}
+        budget = budget.get(actions.get(request.method.lower()))
+    return budget
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(connection) -> None:
+    # First in the list, as execute_wrapper() blocks pop the last one on exit
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+
+@receiver(connection_created)
+def _record_queries_of_new_connection(sender, connection, **kwargs):
+    # Async views run their queries on connections of another thread
+    install_query_recorder(connection)
+
+
+class RequestMetricsMiddleware:
+    """
+    Record SQL query count and time and named timings of external calls per
+    request. They are returned in a Server-Timing header and logged as one
+    JSON line. Successful responses of views over their query budget are
+    logged as a warning, or fail with QueryBudgetExceeded when
+    QUERY_BUDGET_STRICT is set.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token, started = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    async def __acall__(self, request):
+        metrics, token, started = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, started)
+
+    @staticmethod
+    def start(request):
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        request.query_budget = None
+        for connection in connections.all():
+            install_query_recorder(connection)
+        return metrics, token, time.perf_counter()
+
+    def finish(self, request, response, metrics: RequestMetrics, started: float):
+        total = time.perf_counter() - started
+        response["Server-Timing"] = self.server_timing(metrics, total)
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": _ms(total),
+            "queries": metrics.queries,
+            "db_ms": _ms(metrics.db_time),
+            **{f"{name}_ms": _ms(seconds) for name, seconds in metrics.timings.items()},
+        }
+        logger.info(json.dumps(record), extra={"request_metrics": record})
+        self.check_budget(request, response, metrics)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func, request)
+
+    @staticmethod
+    def server_timing(metrics: RequestMetrics, total: float) -> str:
+        entries = [f'db;dur={_ms(metrics.db_time)};desc="{metrics.queries} queries"']
+        entries += [
+            f"{name};dur={_ms(seconds)}" for name, seconds in metrics.timings.items()
+        ]
+        entries.append(f"total;dur={_ms(total)}")
+        return ", ".join(entries)
+
+    @staticmethod
+    def check_budget(request, response, metrics: RequestMetrics) -> None:
+        budget = request.query_budget
+        # Errors may run extra queries, and raising here would hide them
+        if budget is None or metrics.queries <= budget or response.status_code >= 400:
+            return
+        message = (
+            f"{request.method} {request.path} ran {metrics.queries} SQL queries, "
+            f"over its budget of {budget}"
+        )
+        if settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,96 @@
+import copy
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db.utils import ConnectionHandler
+
+from library_service.postgresql_pool.pool import close_pools
+
+
+class Command(BaseCommand):
+    """Measure the connection overhead of each DB_POOL_MODE"""
+
+    help = (
+        "Run simulated requests of one short query through each connection "
+        "mode and report time per request and the server sessions used"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument(
+            "--pgbouncer",
+            metavar="HOST:PORT",
+            help="PgBouncer in transaction mode in front of the same database",
+        )
+
+    def modes(self, pgbouncer: str | None) -> dict[str, dict]:
+        base = copy.deepcopy(settings.DATABASES["default"])
+        base.update(
+            ENGINE="django.db.backends.postgresql",
+            CONN_MAX_AGE=0,
+            CONN_HEALTH_CHECKS=False,
+        )
+        base.pop("POOL", None)
+        modes = {
+            "none": base,
+            "persistent": {
+                **base,
+                "CONN_MAX_AGE": settings.DB_CONN_MAX_AGE,
+                "CONN_HEALTH_CHECKS": True,
+            },
+            "pool": {
+                **base,
+                "ENGINE": "library_service.postgresql_pool",
+                "POOL": {
+                    "SIZE": settings.DB_POOL_SIZE,
+                    "MAX_LIFETIME": settings.DB_CONN_MAX_AGE,
+                    "TIMEOUT": settings.DB_POOL_TIMEOUT,
+                },
+            },
+        }
+        if pgbouncer:
+            host, port = pgbouncer.rsplit(":", 1)
+            modes["pgbouncer"] = {
+                **modes["persistent"],
+                "HOST": host,
+                "PORT": port,
+                "DISABLE_SERVER_SIDE_CURSORS": True,
+            }
+        return modes
+
+    def run(self, database: dict, requests: int) -> tuple[list[float], int]:
+        connection = ConnectionHandler({"default": database})["default"]
+        timings = []
+        backends = set()
+        try:
+            for _ in range(requests):
+                started = time.perf_counter()
+                # What request_started and request_finished do around a view
+                connection.close_if_unusable_or_obsolete()
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT pg_backend_pid()")
+                    backends.add(cursor.fetchone()[0])
+                connection.close_if_unusable_or_obsolete()
+                timings.append(time.perf_counter() - started)
+        finally:
+            connection.close()
+            close_pools()
+        return timings, len(backends)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'mode':>11} {'requests':>9} {'mean ms':>8} {'p50 ms':>7} "
+            f"{'p99 ms':>7} {'sessions':>9}"
+        )
+        for mode, database in self.modes(options["pgbouncer"]).items():
+            timings, sessions = self.run(database, options["requests"])
+            timings.sort()
+            self.stdout.write(
+                f"{mode:>11} {len(timings):>9} "
+                f"{statistics.mean(timings) * 1000:>8.2f} "
+                f"{statistics.median(timings) * 1000:>7.2f} "
+                f"{timings[int(len(timings) * 0.99)] * 1000:>7.2f} "
+                f"{sessions:>9}"
+            )
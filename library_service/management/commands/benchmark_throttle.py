@@ -0,0 +1,82 @@
+import statistics
+import time
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from rest_framework.throttling import AnonRateThrottle
+
+from library_service.throttling import SlidingWindowAnonThrottle
+
+# High enough that every request is allowed and DRF's history keeps growing
+BENCHMARK_RATE = "10000000/day"
+
+
+class DrfThrottle(AnonRateThrottle):
+    rate = BENCHMARK_RATE
+
+
+class SlidingWindowThrottle(SlidingWindowAnonThrottle):
+    rate = BENCHMARK_RATE
+
+
+class Command(BaseCommand):
+    """Measure the per-request cost of the throttle implementations"""
+
+    help = (
+        "Run requests of one client through DRF's cache throttle and the "
+        "Redis sliding window throttle and report time per request and the "
+        "memory held for the client"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, nargs="+", default=[100, 1000, 10000]
+        )
+
+    def run(self, throttle_class, request, requests: int) -> list[float]:
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            allowed = throttle_class().allow_request(request, None)
+            timings.append(time.perf_counter() - started)
+            if not allowed:
+                raise CommandError(f"{throttle_class.__name__} throttled")
+        return timings
+
+    def handle(self, *args, **options):
+        if not settings.REDIS_URL:
+            raise CommandError("Set REDIS_URL to compare against Redis")
+        client = redis.Redis.from_url(settings.REDIS_URL)
+        request = Request(
+            APIRequestFactory().get("/api/books/", REMOTE_ADDR="203.0.113.7")
+        )
+        key = SlidingWindowThrottle().get_cache_key(request, None)
+
+        self.stdout.write(
+            f"{'throttle':>15} {'requests':>9} {'p50 us':>8} {'p99 us':>8} "
+            f"{'bytes':>8}"
+        )
+        for requests in options["requests"]:
+            for name, throttle_class in (
+                ("drf cache", DrfThrottle),
+                ("sliding window", SlidingWindowThrottle),
+            ):
+                cache.delete(key)
+                client.delete(key)
+                timings = sorted(self.run(throttle_class, request, requests))
+                p50 = statistics.median(timings) * 1_000_000
+                p99 = timings[int(len(timings) * 0.99)] * 1_000_000
+                if throttle_class is DrfThrottle:
+                    stored = client.memory_usage(cache.make_key(key))
+                else:
+                    stored = client.memory_usage(key)
+                self.stdout.write(
+                    f"{name:>15} {requests:>9} {p50:>8.0f} {p99:>8.0f} "
+                    f"{stored or 0:>8}"
+                )
+        cache.delete(key)
+        client.delete(key)
@@ -0,0 +1,54 @@
+import subprocess
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from library_service.startup import TARGETS, package_times, profile_imports, total_ms
+
+
+class Command(BaseCommand):
+    """Report where a cold start of the web or Celery process spends its time"""
+
+    help = (
+        "Start a fresh interpreter under -X importtime, import what a web "
+        "or Celery worker imports at startup and report import time per "
+        "package, project apps marked with *"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=sorted(TARGETS), default="web")
+        parser.add_argument(
+            "--top", type=int, default=20, help="Number of packages to list"
+        )
+        parser.add_argument(
+            "--budget-ms",
+            type=float,
+            default=settings.STARTUP_IMPORT_BUDGET_MS,
+            help="Fail when the total import time is above it",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            modules = profile_imports(options["target"])
+        except subprocess.CalledProcessError as exc:
+            raise CommandError(f"Import failed:\n{exc.stderr}") from exc
+
+        self.stdout.write(f"{'package':<28} {'self ms':>9} {'cumul. ms':>10}")
+        for times in package_times(modules)[: options["top"]]:
+            name = f"{times.package} *" if times.is_project else times.package
+            self.stdout.write(
+                f"{name:<28} {times.self_ms:>9.1f} {times.cumulative_ms:>10.1f}"
+            )
+        project_ms = sum(
+            times.self_ms for times in package_times(modules) if times.is_project
+        )
+        total = total_ms(modules)
+        self.stdout.write(
+            f"{len(modules)} modules, {total:.1f} ms in total, "
+            f"{project_ms:.1f} ms in project apps"
+        )
+        if total > options["budget_ms"]:
+            raise CommandError(
+                f"Startup imports took {total:.1f} ms, over the budget of "
+                f"{options['budget_ms']:.0f} ms"
+            )
@@ -0,0 +1,236 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+from collections.abc import Mapping
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    PageNumberPagination,
+    _positive_int,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value):
+    # Full precision, unlike DjangoJSONEncoder which drops microseconds
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def _flip(field: str) -> str:
+    return field[1:] if field.startswith("-") else f"-{field}"
+
+
+def _after(ordering: list[str], values: list) -> Q:
+    """
+    Condition selecting rows that come after values in ordering, e.g.
+    a < x OR (a = x AND (b > y OR ...)) for ordering ("-a", "b").
+    """
+    field, *rest = ordering
+    name = field.lstrip("-")
+    lookup = "lt" if field.startswith("-") else "gt"
+    condition = Q(**{f"{name}__{lookup}": values[0]})
+    if rest:
+        condition |= Q(**{name: values[0]}) & _after(rest, values[1:])
+    return condition
+
+
+def keyset_filter(ordering: list[str], values: list) -> Q:
+    """
+    Rows after values in ordering. The redundant bound on the first field
+    lets the database turn the condition into an index range.
+    """
+    field = ordering[0]
+    lookup = "lte" if field.startswith("-") else "gte"
+    bound = Q(**{f"{field.lstrip('-')}__{lookup}": values[0]})
+    return bound & _after(ordering, values)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique ordering. The cursor holds the ordering
+    values of the row at the page edge and the next page is selected with a
+    range condition on them instead of OFFSET, so every page costs one index
+    range scan however deep it is. The total count is only computed when the
+    client asks for it.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    count_query_param = "count"
+    invalid_cursor_message = "Invalid cursor"
+    page_size = 5
+    max_page_size = 100
+    # The last field must be unique so that every row has a distinct position
+    ordering = ("id",)
+
+    def get_page_size(self, request) -> int:
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def decode_cursor(self, request) -> tuple[list, bool] | None:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, reverse = cursor["v"], bool(cursor["r"])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def encode_cursor(self, item, reverse: bool) -> str:
+        names = [field.lstrip("-") for field in self.ordering]
+        if isinstance(item, Mapping):
+            values = [item[name] for name in names]
+        else:
+            values = [getattr(item, name) for name in names]
+        cursor = json.dumps({"v": values, "r": int(reverse)}, default=_encode_value)
+        encoded = base64.urlsafe_b64encode(cursor.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == "true":
+            self.count = queryset.count()
+
+        values, self.reverse = self.cursor or (None, False)
+        ordering = list(self.ordering)
+        if self.reverse:
+            ordering = [_flip(field) for field in ordering]
+        if values is not None:
+            try:
+                queryset = queryset.filter(keyset_filter(ordering, values))
+            except (DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset.order_by(*ordering)[: self.page_size + 1])
+        self.has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        if self.reverse:
+            self.page.reverse()
+        return self.page
+
+    def get_next_link(self) -> str | None:
+        if not self.page or not (self.reverse or self.has_more):
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self) -> str | None:
+        if not self.page or self.cursor is None:
+            return None
+        if self.reverse and not self.has_more:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data) -> Response:
+        content = [
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]
+        if self.count is not None:
+            content.insert(0, ("count", self.count))
+        return Response(OrderedDict(content))
+
+    def get_schema_operation_parameters(self, view) -> list[dict]:
+        return [
+            {
+                "name": self.cursor_query_param,
+                "required": False,
+                "in": "query",
+                "description": "The pagination cursor value.",
+                "schema": {"type": "string"},
+            },
+            {
+                "name": self.page_size_query_param,
+                "required": False,
+                "in": "query",
+                "description": (
+                    f"Number of results to return per page "
+                    f"(at most {self.max_page_size})."
+                ),
+                "schema": {"type": "integer"},
+            },
+            {
+                "name": self.count_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Include the total number of results (true).",
+                "schema": {"type": "boolean"},
+            },
+        ]
+
+
+class OptionalCursorPagination(PageNumberPagination):
+    """
+    Page number pagination that switches to keyset pagination when the
+    client sends ?pagination=cursor or a cursor from a previous page.
+    """
+
+    page_size = 5
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    mode_query_param = "pagination"
+    ordering = ("id",)
+    keyset = None
+
+    def use_cursor(self, request) -> bool:
+        return (
+            request.query_params.get(self.mode_query_param) == "cursor"
+            or KeysetPagination.cursor_query_param in request.query_params
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.use_cursor(request):
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = KeysetPagination()
+        self.keyset.page_size = self.page_size
+        self.keyset.max_page_size = self.max_page_size
+        self.keyset.ordering = self.ordering
+        return self.keyset.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data) -> Response:
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view) -> list[dict]:
+        keyset = KeysetPagination()
+        keyset.max_page_size = self.max_page_size
+        return [
+            *super().get_schema_operation_parameters(view),
+            {
+                "name": self.mode_query_param,
+                "required": False,
+                "in": "query",
+                "description": "Use cursor pagination instead of page numbers.",
+                "schema": {"type": "string", "enum": ["cursor"]},
+            },
+            *[
+                parameter
+                for parameter in keyset.get_schema_operation_parameters(view)
+                if parameter["name"] != self.page_size_query_param
+            ],
+        ]
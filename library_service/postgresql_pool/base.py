@@ -0,0 +1,43 @@
+"""
+PostgreSQL backend taking connections from a process wide pool. Django
+closes the connection at the end of each request or Celery task as usual
+and the pool keeps it open for the next one.
+"""
+import functools
+
+from django.db.backends.postgresql import base, creation
+
+from library_service.postgresql_pool.pool import close_pools, get_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would block DROP DATABASE
+        close_pools()
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_pool(self, conn_params):
+        options = self.settings_dict["POOL"]
+        key = tuple(sorted((name, str(value)) for name, value in conn_params.items()))
+        return get_pool(
+            key,
+            max_size=options["SIZE"],
+            max_lifetime=options["MAX_LIFETIME"],
+            timeout=options["TIMEOUT"],
+        )
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        return self.pool.acquire(
+            functools.partial(super().get_new_connection, conn_params)
+        )
+
+    def _close(self):
+        if self.connection is None:
+            return
+        with self.wrap_database_errors:
+            self.pool.release(self.connection)
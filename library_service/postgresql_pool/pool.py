@@ -0,0 +1,145 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+from psycopg2 import extensions
+
+# Idle connections older than this are pinged before being handed out
+PING_AFTER = 30
+
+
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = time.monotonic()
+        self.released = self.created
+
+
+class ConnectionPool:
+    """
+    Process wide pool of psycopg2 connections. At most max_size connections
+    are open at once; acquire() waits up to timeout seconds for one to be
+    released. Connections past max_lifetime or found broken are replaced.
+    """
+
+    def __init__(self, max_size: int, max_lifetime: int, timeout: float):
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.in_use = {}
+
+    def acquire(self, connect):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise OperationalError(
+                f"No database connection available within {self.timeout}s, "
+                f"all {self.max_size} are in use"
+            )
+        try:
+            pooled = self._take_idle() or PooledConnection(connect())
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.in_use[id(pooled.connection)] = pooled
+        return pooled.connection
+
+    def release(self, connection) -> None:
+        with self.lock:
+            pooled = self.in_use.pop(id(connection), None)
+        if pooled is None:
+            connection.close()
+            return
+        try:
+            if self._reset(pooled):
+                pooled.released = time.monotonic()
+                with self.lock:
+                    self.idle.append(pooled)
+            else:
+                pooled.connection.close()
+        finally:
+            self.slots.release()
+
+    def close(self) -> None:
+        """Close idle connections, in use ones are closed on release"""
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+            self.in_use.clear()
+        for pooled in idle:
+            pooled.connection.close()
+
+    def _take_idle(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                # Most recently used first, so surplus connections age out
+                pooled = self.idle.pop()
+            if self._healthy(pooled):
+                return pooled
+            pooled.connection.close()
+
+    def _expired(self, pooled: PooledConnection) -> bool:
+        return time.monotonic() - pooled.created > self.max_lifetime
+
+    def _healthy(self, pooled: PooledConnection) -> bool:
+        connection = pooled.connection
+        if connection.closed or self._expired(pooled):
+            return False
+        if time.monotonic() - pooled.released < PING_AFTER:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except Exception:
+            return False
+        return True
+
+    def _reset(self, pooled: PooledConnection) -> bool:
+        """Leave the connection idle outside a transaction, or report it broken"""
+        connection = pooled.connection
+        if connection.closed or self._expired(pooled):
+            return False
+        status = connection.info.transaction_status
+        if status == extensions.TRANSACTION_STATUS_IDLE:
+            return True
+        if status in (
+            extensions.TRANSACTION_STATUS_INTRANS,
+            extensions.TRANSACTION_STATUS_INERROR,
+        ):
+            try:
+                connection.rollback()
+            except Exception:
+                return False
+            return True
+        return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def get_pool(key, **options) -> ConnectionPool:
+    """Pool for one set of connection parameters, fresh after a fork"""
+    global _pid
+    with _pools_lock:
+        if _pid != os.getpid():
+            # Connections inherited from the parent must not be shared
+            _pools.clear()
+            _pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(**options)
+        return pool
+
+
+def close_pools() -> None:
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        pool.close()
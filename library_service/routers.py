@@ -0,0 +1,168 @@
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from library_service.idempotency import token_user
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = "use_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Seconds the replica has not yet replayed, 0 when it is caught up or is a
+# primary itself, NULL when it never replayed anything
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery()
+        OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+_replica_reads = contextvars.ContextVar("replica_reads", default=False)
+# alias -> (checked at, lag in seconds or None when unknown)
+_lag = {}
+
+
+def replica_lag(alias: str) -> float | None:
+    """Replication lag of a replica, re-checked every REPLICA_LAG_CHECK_INTERVAL"""
+    checked_at, lag = _lag.get(alias, (None, None))
+    now = time.monotonic()
+    if (
+        checked_at is not None
+        and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL
+    ):
+        return lag
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning("Replica %s unavailable", alias, exc_info=True)
+        lag = None
+    lag = None if lag is None else float(lag)
+    _lag[alias] = (now, lag)
+    return lag
+
+
+def healthy_replicas() -> list[str]:
+    return [
+        alias
+        for alias in settings.REPLICA_DATABASES
+        if (lag := replica_lag(alias)) is not None and lag <= settings.REPLICA_MAX_LAG
+    ]
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside the block, even where a replica is allowed"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads to a caught up replica while ReplicaRoutingMiddleware allows
+    it for the current request, everything else to the primary. Celery tasks
+    and management commands always use the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        replicas = healthy_replicas()
+        if not replicas:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+def sticky_key(request) -> str | None:
+    """
+    Cache key of the user of the request's access token, since API clients
+    may not keep cookies. Keyed by user so a refreshed token still sticks.
+    """
+    user_id = token_user(request)
+    return None if user_id is None else f"replica:sticky:user:{user_id}"
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Allow replica reads for safe requests. A client that has written keeps
+    reading from the primary for REPLICA_STICKY_SECONDS so it sees its own
+    writes, tracked with a cache entry for its user and with a cookie for
+    clients without a valid token.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+        key, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        return self.finish(request, response, key)
+
+    async def __acall__(self, request):
+        if not settings.REPLICA_DATABASES:
+            return await self.get_response(request)
+        key, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        return self.finish(request, response, key)
+
+    def start(self, request):
+        key = sticky_key(request)
+        use_replica = request.method in SAFE_METHODS and not self.is_sticky(
+            request, key
+        )
+        return key, _replica_reads.set(use_replica)
+
+    @staticmethod
+    def finish(request, response, key: str | None):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            window = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(
+                STICKY_COOKIE, "1", max_age=window, httponly=True, samesite="Lax"
+            )
+            if key is not None:
+                cache.set(key, True, window)
+        return response
+
+    @staticmethod
+    def is_sticky(request, key: str | None) -> bool:
+        if STICKY_COOKIE in request.COOKIES:
+            return True
+        return key is not None and cache.get(key) is not None
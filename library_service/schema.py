@@ -0,0 +1,151 @@
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import threading
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views import View
+from drf_spectacular.generators import SchemaGenerator
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+
+logger = logging.getLogger(__name__)
+
+SOURCE_DIRS = ("book", "borrowing", "library_service", "payment", "user")
+FORMATS = {
+    "yaml": ("application/vnd.oai.openapi", OpenApiYamlRenderer),
+    "json": ("application/vnd.oai.openapi+json", OpenApiJsonRenderer),
+}
+
+
+@functools.lru_cache
+def code_version() -> str:
+    """CODE_VERSION of the deployment, or a hash of the project sources"""
+    if settings.CODE_VERSION:
+        return settings.CODE_VERSION
+    digest = hashlib.sha256()
+    for directory in SOURCE_DIRS:
+        for path in sorted((settings.BASE_DIR / directory).rglob("*.py")):
+            digest.update(str(path.relative_to(settings.BASE_DIR)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class SchemaDocument:
+    content_type: str
+    body: bytes
+    gzipped: bytes
+    etag: str
+
+
+def _document(content_type: str, body: bytes) -> SchemaDocument:
+    return SchemaDocument(
+        content_type=content_type,
+        body=body,
+        gzipped=gzip.compress(body, compresslevel=9, mtime=0),
+        etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+    )
+
+
+def schema_path(version: str, schema_format: str):
+    return settings.SCHEMA_DIR / f"openapi-{version}.{schema_format}"
+
+
+def build_schema(version: str) -> dict[str, bytes]:
+    """Introspect all views once and write the rendered schemas to SCHEMA_DIR"""
+    schema = SchemaGenerator().get_schema(request=None, public=True)
+    bodies = {
+        schema_format: renderer().render(schema, renderer_context={})
+        for schema_format, (_, renderer) in FORMATS.items()
+    }
+    try:
+        settings.SCHEMA_DIR.mkdir(parents=True, exist_ok=True)
+        for stale in settings.SCHEMA_DIR.glob("openapi-*"):
+            stale.unlink()
+        for schema_format, body in bodies.items():
+            # Renamed into place so other processes never read half a file
+            path = schema_path(version, schema_format)
+            temporary = path.with_name(f".{path.name}.{os.getpid()}")
+            temporary.write_bytes(body)
+            os.replace(temporary, path)
+    except OSError:
+        logger.warning("Could not write the schema to %s", settings.SCHEMA_DIR)
+    return bodies
+
+
+def load_schema(version: str) -> dict[str, bytes] | None:
+    try:
+        return {
+            schema_format: schema_path(version, schema_format).read_bytes()
+            for schema_format in FORMATS
+        }
+    except OSError:
+        return None
+
+
+_documents = {}
+_lock = threading.Lock()
+
+
+def get_documents() -> dict[str, SchemaDocument]:
+    """
+    Schemas of the running code version, read from SCHEMA_DIR or built on
+    first use and kept in memory for the life of the process
+    """
+    version = code_version()
+    documents = _documents.get(version)
+    if documents is not None:
+        return documents
+    with _lock:
+        if version not in _documents:
+            bodies = load_schema(version) or build_schema(version)
+            _documents.clear()
+            _documents[version] = {
+                schema_format: _document(FORMATS[schema_format][0], body)
+                for schema_format, body in bodies.items()
+            }
+        return _documents[version]
+
+
+class PrecomputedSchemaView(View):
+    """
+    Serve the OpenAPI schema from memory with a strong ETag, gzipped for
+    clients that accept it. YAML by default, JSON with ?format=json or when
+    JSON is accepted, as Swagger UI asks for it.
+    """
+
+    def get(self, request):
+        wants_json = request.GET.get("format") == "json" or (
+            "json" in request.META.get("HTTP_ACCEPT", "")
+        )
+        schema_format = "json" if wants_json else "yaml"
+        document = get_documents()[schema_format]
+        use_gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        # Each encoding is a different representation with its own ETag
+        etag = f'{document.etag[:-1]}-gzip"' if use_gzip else document.etag
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = HttpResponse(
+                document.gzipped if use_gzip else document.body,
+                content_type=document.content_type,
+            )
+            if use_gzip:
+                response["Content-Encoding"] = "gzip"
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        patch_vary_headers(response, ["Accept", "Accept-Encoding"])
+        return response
+
+
+def warm() -> None:
+    """Load or build the schema ahead of the first request"""
+    try:
+        get_documents()
+    except Exception:
+        logger.exception("Could not build the API schema")
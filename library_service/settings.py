@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 import os
 from pathlib import Path
 
-from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -42,8 +42,11 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework",
     "drf_spectacular",
+    # Management commands for the project-wide modules
+    "library_service",
     "book",
     "user",
     "borrowing",
@@ -52,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "library_service.instrumentation.RequestMetricsMiddleware",
+    "library_service.routers.ReplicaRoutingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -59,10 +64,16 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "library_service.idempotency.IdempotencyMiddleware",
 ]
 
 ROOT_URLCONF = "library_service.urls"
 
+# Views over their query budget fail instead of logging a warning.
+# The test runner turns this on for the whole test suite.
+QUERY_BUDGET_STRICT = False
+TEST_RUNNER = "library_service.test_runner.QueryBudgetTestRunner"
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -92,9 +103,87 @@ DATABASES = {
         "NAME": os.environ["POSTGRES_DB"],
         "USER": os.environ["POSTGRES_USER"],
         "PASSWORD": os.environ["POSTGRES_PASSWORD"],
+        "PORT": os.environ.get("POSTGRES_PORT", ""),
     }
 }
 
+# How web and Celery worker processes reuse database connections:
+# none        a new connection per request or task
+# persistent  keep each connection for DB_CONN_MAX_AGE seconds, checked
+#             before reuse
+# pool        process wide pool of at most DB_POOL_SIZE connections, waiting
+#             up to DB_POOL_TIMEOUT seconds for a free one
+# pgbouncer   persistent connections to PgBouncer in transaction mode, where
+#             a session can't hold server side cursors
+DB_POOL_MODE = os.environ.get("DB_POOL_MODE", "none")
+DB_CONN_MAX_AGE = int(os.environ.get("DB_CONN_MAX_AGE", 600))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+
+if DB_POOL_MODE in ("persistent", "pgbouncer"):
+    DATABASES["default"]["CONN_MAX_AGE"] = DB_CONN_MAX_AGE
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+    if DB_POOL_MODE == "pgbouncer":
+        DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+elif DB_POOL_MODE == "pool":
+    DATABASES["default"]["ENGINE"] = "library_service.postgresql_pool"
+    DATABASES["default"]["POOL"] = {
+        "SIZE": DB_POOL_SIZE,
+        "MAX_LIFETIME": DB_CONN_MAX_AGE,
+        "TIMEOUT": DB_POOL_TIMEOUT,
+    }
+elif DB_POOL_MODE != "none":
+    raise ImproperlyConfigured(f"Unknown DB_POOL_MODE {DB_POOL_MODE!r}")
+
+# Read replicas of the primary as comma separated host or host:port, used
+# for reads of safe requests unless lagging more than REPLICA_MAX_LAG seconds
+REPLICA_DATABASES = []
+for number, address in enumerate(
+    filter(None, os.environ.get("POSTGRES_REPLICA_HOSTS", "").split(",")), 1
+):
+    host, _, port = address.strip().partition(":")
+    DATABASES[f"replica_{number}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "TEST": {"MIRROR": "default"},
+    }
+    REPLICA_DATABASES.append(f"replica_{number}")
+
+DATABASE_ROUTERS = ["library_service.routers.ReplicaRouter"]
+REPLICA_MAX_LAG = float(os.environ.get("REPLICA_MAX_LAG", 5))
+REPLICA_LAG_CHECK_INTERVAL = 5
+# Seconds a client reads from the primary after writing
+REPLICA_STICKY_SECONDS = int(os.environ.get("REPLICA_STICKY_SECONDS", 10))
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+REDIS_URL = os.environ.get("REDIS_URL")
+
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Responses to Idempotency-Key requests are replayed for IDEMPOTENCY_TTL
+# seconds. Retries arriving while the first request runs wait up to
+# IDEMPOTENCY_LOCK_WAIT seconds on a lock that expires after
+# IDEMPOTENCY_LOCK_TIMEOUT seconds should its holder die. Locks only span
+# processes with REDIS_URL set.
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", 24 * 60 * 60))
+IDEMPOTENCY_LOCK_WAIT = float(os.environ.get("IDEMPOTENCY_LOCK_WAIT", 5))
+IDEMPOTENCY_LOCK_TIMEOUT = 60
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -140,16 +229,21 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
+    # Shared sliding windows in Redis, DRF's per-process cache without it
     "DEFAULT_THROTTLE_CLASSES": [
-        "rest_framework.throttling.AnonRateThrottle",
-        "rest_framework.throttling.UserRateThrottle",
+        "library_service.throttling.SlidingWindowAnonThrottle",
+        "library_service.throttling.SlidingWindowUserThrottle",
     ],
     "DEFAULT_THROTTLE_RATES": {"anon": "100/day", "user": "1000/day"},
-    "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
-    ),
+    "DEFAULT_AUTHENTICATION_CLASSES": ("user.authentication.CachedJWTAuthentication",),
 }
 
+# Version of the deployed code, e.g. the commit; the schema is rebuilt
+# when it changes. Without it a hash of the project sources is used.
+CODE_VERSION = os.environ.get("CODE_VERSION", "")
+# Where the rendered OpenAPI schema is stored between processes
+SCHEMA_DIR = Path(os.environ.get("SCHEMA_DIR", BASE_DIR / ".schema"))
+
 SPECTACULAR_SETTINGS = {
     "TITLE": "Library service API",
     "DESCRIPTION": "Documentation for Library service API",
@@ -159,8 +253,14 @@ SPECTACULAR_SETTINGS = {
 
 SIMPLE_JWT = {
     "AUTH_HEADER_NAME": "HTTP_AUTHORIZE",
+    "TOKEN_OBTAIN_SERIALIZER": "user.serializers.ClaimsTokenObtainPairSerializer",
 }
 
+# Seconds an authenticated user is served from the cache
+JWT_USER_CACHE_TIMEOUT = 300
+# Build the user from token claims instead of the cache or the database
+JWT_STATELESS_AUTH = os.environ.get("JWT_STATELESS_AUTH", "false").lower() == "true"
+
 TELEGRAM_BOT_TOKEN = os.environ["TELEGRAM_BOT_TOKEN"]
 TELEGRAM_CHAT_ID = os.environ["TELEGRAM_CHAT_ID"]
 
@@ -170,10 +270,25 @@ CELERY_TIMEZONE = "Europe/Kyiv"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
 
-CELERY_BEAT_SCHEDULE = {
-    "notification_about_overdue_borrowings": {
-        "task": "borrowing_service.tasks.notification_about_overdue_borrowings",
-        "schedule": crontab(minute=0, hour=9),
-    },
-}
+# Process overdue borrowings as a chord of primary-key range shards
+OVERDUE_FAN_OUT = os.environ.get("OVERDUE_FAN_OUT", "false").lower() == "true"
+OVERDUE_SHARD_SIZE = int(os.environ.get("OVERDUE_SHARD_SIZE", 10000))
+
+# Import time a cold web or Celery process may spend at startup, in ms,
+# checked by the profile_imports command and the test suite
+STARTUP_IMPORT_BUDGET_MS = float(os.environ.get("STARTUP_IMPORT_BUDGET_MS", 1000))
+
+# Render the borrowing list from values() rows instead of model instances
+BORROWING_FAST_READS = os.environ.get("BORROWING_FAST_READS", "false").lower() == "true"
+
 STRIPE_API_KEY = os.environ["STRIPE_API_KEY"]
+# Without it every webhook is refused, as none can be verified
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", "")
+# Use "payment.gateways.FakeGateway" to work without network access to Stripe
+PAYMENT_GATEWAY = os.environ.get("PAYMENT_GATEWAY", "payment.gateways.StripeGateway")
+# Keep-alive connections to Stripe per process, SDK retries of a failed call,
+# and the consecutive failures that open the circuit for the reset seconds
+STRIPE_POOL_SIZE = int(os.environ.get("STRIPE_POOL_SIZE", 10))
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get("STRIPE_MAX_NETWORK_RETRIES", 2))
+STRIPE_BREAKER_FAILURES = int(os.environ.get("STRIPE_BREAKER_FAILURES", 5))
+STRIPE_BREAKER_RESET_SECONDS = int(os.environ.get("STRIPE_BREAKER_RESET_SECONDS", 30))
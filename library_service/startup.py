@@ -0,0 +1,105 @@
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.conf import settings
+
+# What each kind of process imports before it can serve its first request
+# or task
+TARGETS = {
+    # The WSGI module also loads the URLconf and warms the API schema
+    "web": "import library_service.wsgi",
+    "celery": (
+        "from library_service.celery import app; app.loader.import_default_modules()"
+    ),
+}
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+@dataclass
+class ImportedModule:
+    name: str
+    self_us: int
+    cumulative_us: int
+    # Module whose import triggered this one, None at the top level
+    parent: str | None
+
+    @property
+    def package(self) -> str:
+        return self.name.split(".")[0]
+
+
+@dataclass
+class PackageTimes:
+    package: str
+    self_ms: float
+    cumulative_ms: float
+    is_project: bool
+
+
+def parse_import_times(output: str) -> list[ImportedModule]:
+    """Modules in the order -X importtime reports them, children first"""
+    entries = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            entries.append((len(indent), name, int(self_us), int(cumulative_us)))
+
+    # A parent is reported after its children with less indentation
+    modules = []
+    parents = []
+    for depth, name, self_us, cumulative_us in reversed(entries):
+        while parents and parents[-1][0] >= depth:
+            parents.pop()
+        parent = parents[-1][1] if parents else None
+        modules.append(ImportedModule(name, self_us, cumulative_us, parent))
+        parents.append((depth, name))
+    modules.reverse()
+    return modules
+
+
+def profile_imports(target: str = "web") -> list[ImportedModule]:
+    """Import a target in a fresh interpreter under -X importtime"""
+    env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TARGETS[target]],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_import_times(result.stderr)
+
+
+def total_ms(modules: list[ImportedModule]) -> float:
+    return sum(module.self_us for module in modules) / 1000
+
+
+def package_times(modules: list[ImportedModule]) -> list[PackageTimes]:
+    """
+    Import time per top-level package, slowest first. Self time is spent in
+    the package's own modules. Cumulative time also counts everything the
+    package pulled in when imported from outside of it.
+    """
+    self_us = defaultdict(int)
+    cumulative_us = defaultdict(int)
+    for module in modules:
+        self_us[module.package] += module.self_us
+        if module.parent is None or module.parent.split(".")[0] != module.package:
+            cumulative_us[module.package] += module.cumulative_us
+    times = [
+        PackageTimes(
+            package=package,
+            self_ms=self_us[package] / 1000,
+            cumulative_ms=cumulative_us[package] / 1000,
+            is_project=(settings.BASE_DIR / package / "__init__.py").exists(),
+        )
+        for package in self_us
+    ]
+    return sorted(times, key=lambda times: times.cumulative_ms, reverse=True)
@@ -0,0 +1,633 @@
+import gzip
+import json
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from psycopg2 import extensions
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from book.models import Book
+from book.serializers import BookSerializer
+from book.tests import sample_book
+from borrowing.models import Borrowing
+from book.views import BookViewSet
+from library_service import routers, schema, startup
+from library_service.circuit_breaker import CircuitBreaker, CircuitOpen
+from library_service.idempotency import cache_key
+from library_service.instrumentation import QueryBudgetExceeded
+from library_service.postgresql_pool.pool import ConnectionPool
+from library_service.routers import (
+    ReplicaRouter,
+    ReplicaRoutingMiddleware,
+    replica_lag,
+)
+from library_service.throttling import SlidingWindowAnonThrottle
+from user.tests import sample_user
+
+BOOK_URL = reverse("book:book-list")
+BORROWING_URL = reverse("borrowing:borrowing-list")
+
+
+class RequestMetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        sample_book()
+
+    def test_server_timing_header(self):
+        res = self.client.get(BOOK_URL)
+
+        entries = [entry.strip() for entry in res["Server-Timing"].split(",")]
+        self.assertRegex(entries[0], r'^db;dur=[\d.]+;desc="2 queries"$')
+        self.assertRegex(entries[-1], r"^total;dur=[\d.]+$")
+
+    def test_structured_log_line(self):
+        with self.assertLogs("library_service.instrumentation", "INFO") as logs:
+            self.client.get(BOOK_URL)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["method"], "GET")
+        self.assertEqual(record["path"], BOOK_URL)
+        self.assertEqual(record["status"], 200)
+        self.assertEqual(record["queries"], 2)
+        self.assertEqual(logs.records[0].request_metrics, record)
+
+    def test_external_call_timings(self):
+        self.client.force_authenticate(sample_user())
+
+        res = self.client.post(
+            BORROWING_URL,
+            {
+                "book": sample_book().id,
+                "expected_return_date": timezone.now() + timedelta(days=5),
+            },
+        )
+
+        self.assertEqual(res.status_code, 201)
+        self.assertIn("telegram_enqueue;dur=", res["Server-Timing"])
+
+    def test_budget_exceeded_fails_in_tests(self):
+        with mock.patch.object(BookViewSet, "query_budget", {"list": 1}):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(BOOK_URL)
+
+    def test_budget_not_enforced_on_errors(self):
+        with mock.patch.object(BookViewSet, "query_budget", {"list": 1}):
+            with mock.patch.object(
+                BookSerializer, "to_representation", side_effect=ValueError("Bad")
+            ):
+                with self.assertRaisesMessage(ValueError, "Bad"):
+                    self.client.get(BOOK_URL)
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_budget_exceeded_warns_in_production(self):
+        with mock.patch.object(BookViewSet, "query_budget", {"list": 1}):
+            with self.assertLogs("library_service.instrumentation", "WARNING") as logs:
+                res = self.client.get(BOOK_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("over its budget of 1", logs.records[-1].getMessage())
+
+
+class ThreePerMinuteThrottle(SlidingWindowAnonThrottle):
+    rate = "3/min"
+
+
+class SlidingWindowThrottleTests(TestCase):
+    def setUp(self):
+        self.request = Request(
+            APIRequestFactory().get(BOOK_URL, REMOTE_ADDR="198.51.100.1")
+        )
+        # 40 seconds into a minute window
+        self.now = 1_700_000_040.0 + 40
+
+    def allow(self, at: float) -> tuple[bool, float]:
+        throttle = ThreePerMinuteThrottle()
+        throttle.timer = lambda: at
+        allowed = throttle.allow_request(self.request, None)
+        return allowed, throttle.wait()
+
+    @override_settings(REDIS_URL=None)
+    def test_falls_back_to_drf_throttle(self):
+        cache.clear()
+        results = [self.allow(self.now)[0] for _ in range(4)]
+
+        self.assertEqual(results, [True, True, True, False])
+        self.assertEqual(self.allow(self.now + 61)[0], True)
+
+    @skipUnless(settings.REDIS_URL, "Requires a Redis server")
+    def test_sliding_window_in_redis(self):
+        client = redis.Redis.from_url(settings.REDIS_URL)
+        key = ThreePerMinuteThrottle().get_cache_key(self.request, None)
+        client.delete(key)
+        self.addCleanup(client.delete, key)
+
+        # Separate throttle instances stand in for separate workers
+        results = [self.allow(self.now)[0] for _ in range(3)]
+        allowed, wait = self.allow(self.now)
+        self.assertEqual(results, [True, True, True])
+        self.assertFalse(allowed)
+        # Free again once the next window starts in 20s
+        self.assertEqual(wait, 20)
+
+        # 30s into the next window half of the previous 3 requests still count
+        results = [self.allow(self.now + 50)[0] for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+
+        self.assertEqual(set(client.hgetall(key)), {b"start", b"current", b"previous"})
+        self.assertLessEqual(client.pttl(key), 120_000)
+
+
+class DependencyDown(Exception):
+    pass
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker(
+            "test", (DependencyDown,), failure_threshold=2, reset_timeout=30
+        )
+        self.now = 1_700_000_000.0
+        self.breaker.timer = lambda: self.now
+
+    @staticmethod
+    def down():
+        raise DependencyDown()
+
+    def open(self) -> None:
+        for _ in range(2):
+            with self.assertRaises(DependencyDown):
+                self.breaker.call(self.down)
+
+    def test_success_resets_consecutive_failures(self):
+        with self.assertRaises(DependencyDown):
+            self.breaker.call(self.down)
+        self.breaker.call(lambda: None)
+        with self.assertRaises(DependencyDown):
+            self.breaker.call(self.down)
+
+        self.assertEqual(self.breaker.state, "closed")
+        self.assertEqual(self.breaker.metrics()["failures"], 2)
+
+    def test_fails_fast_until_reset_timeout(self):
+        self.open()
+
+        self.now += 10
+        with self.assertRaises(CircuitOpen) as raised:
+            self.breaker.call(lambda: None)
+
+        self.assertEqual(raised.exception.retry_after, 20)
+
+    def test_single_trial_when_half_open(self):
+        self.open()
+        self.now += 30
+        self.assertEqual(self.breaker.state, "half_open")
+
+        def trial():
+            # Callers arriving during the trial still fail fast
+            with self.assertRaises(CircuitOpen):
+                self.breaker.call(lambda: None)
+
+        self.breaker.call(trial)
+
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_failed_trial_opens_again(self):
+        self.open()
+        self.now += 30
+
+        with self.assertRaises(DependencyDown):
+            self.breaker.call(self.down)
+
+        self.assertEqual(self.breaker.state, "open")
+        self.assertEqual(self.breaker.metrics()["opened"], 2)
+
+
+class ConnectionPoolTests(TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, max_lifetime=600, timeout=0.1)
+        self.addCleanup(self.pool.close)
+        self.connects = 0
+
+    def connect(self):
+        self.connects += 1
+        return connection.Database.connect(**connection.get_connection_params())
+
+    def test_released_connection_is_reused(self):
+        first = self.pool.acquire(self.connect)
+        self.pool.release(first)
+
+        self.assertIs(self.pool.acquire(self.connect), first)
+        self.assertEqual(self.connects, 1)
+
+    def test_acquire_times_out_when_exhausted(self):
+        self.pool.acquire(self.connect)
+        self.pool.acquire(self.connect)
+
+        with self.assertRaisesMessage(OperationalError, "all 2 are in use"):
+            self.pool.acquire(self.connect)
+
+    def test_open_transaction_rolled_back_on_release(self):
+        raw = self.pool.acquire(self.connect)
+        with raw.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        self.pool.release(raw)
+
+        self.assertEqual(
+            raw.info.transaction_status, extensions.TRANSACTION_STATUS_IDLE
+        )
+
+    def test_expired_and_closed_connections_replaced(self):
+        raw = self.pool.acquire(self.connect)
+        raw.close()
+        self.pool.release(raw)
+        self.assertIsNot(self.pool.acquire(self.connect), raw)
+
+        self.pool.max_lifetime = 0
+        old = self.pool.acquire(self.connect)
+        self.pool.release(old)
+
+        self.assertTrue(old.closed)
+        self.assertEqual(self.connects, 3)
+
+
+@override_settings(REPLICA_DATABASES=["replica_1", "replica_2"])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        routers._lag.clear()
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+        self.lag = {"replica_1": 0.0, "replica_2": 0.0}
+        patcher = mock.patch.object(routers, "replica_lag", self.lag.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_alias(self, request, status=200) -> tuple[str, HttpResponse]:
+        aliases = []
+
+        def view(request):
+            aliases.append(self.router.db_for_read(Book))
+            return HttpResponse(status=status)
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return aliases[0], response
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Book), "default")
+        self.assertEqual(self.router.db_for_write(Book), "default")
+
+    def test_safe_request_reads_from_replica(self):
+        alias, _ = self.read_alias(self.factory.get(BOOK_URL))
+
+        self.assertIn(alias, ("replica_1", "replica_2"))
+
+    def test_unsafe_request_reads_from_primary(self):
+        alias, _ = self.read_alias(self.factory.post(BOOK_URL))
+
+        self.assertEqual(alias, "default")
+
+    def test_lagging_replica_skipped(self):
+        self.lag["replica_1"] = 30.0
+        self.lag["replica_2"] = None
+
+        alias, _ = self.read_alias(self.factory.get(BOOK_URL))
+
+        self.assertEqual(alias, "default")
+
+    def test_reads_stick_to_primary_after_write_by_cookie(self):
+        _, response = self.read_alias(self.factory.post(BORROWING_URL))
+        cookie = response.cookies[routers.STICKY_COOKIE]
+        self.assertEqual(cookie["max-age"], settings.REPLICA_STICKY_SECONDS)
+
+        request = self.factory.get(BORROWING_URL)
+        request.COOKIES[routers.STICKY_COOKIE] = cookie.value
+        alias, _ = self.read_alias(request)
+
+        self.assertEqual(alias, "default")
+
+    def test_reads_stick_to_primary_after_write_by_user(self):
+        user = sample_user()
+        token = {"HTTP_AUTHORIZE": f"Bearer {AccessToken.for_user(user)}"}
+        self.read_alias(self.factory.post(BORROWING_URL, **token))
+
+        refreshed = {"HTTP_AUTHORIZE": f"Bearer {AccessToken.for_user(user)}"}
+        self.assertNotEqual(token, refreshed)
+        alias, _ = self.read_alias(self.factory.get(BORROWING_URL, **refreshed))
+        self.assertEqual(alias, "default")
+
+        other = sample_user(email="other@test.com")
+        other_token = {"HTTP_AUTHORIZE": f"Bearer {AccessToken.for_user(other)}"}
+        alias, _ = self.read_alias(self.factory.get(BORROWING_URL, **other_token))
+        self.assertNotEqual(alias, "default")
+
+    def test_invalid_token_does_not_stick(self):
+        headers = {"HTTP_AUTHORIZE": "Bearer token"}
+        self.read_alias(self.factory.post(BORROWING_URL, **headers))
+
+        alias, _ = self.read_alias(self.factory.get(BORROWING_URL, **headers))
+        self.assertNotEqual(alias, "default")
+
+    def test_failed_write_does_not_stick(self):
+        _, response = self.read_alias(self.factory.post(BORROWING_URL), status=400)
+
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+    def test_lag_of_primary_is_zero(self):
+        self.assertEqual(replica_lag("default"), 0)
+
+
+class PrecomputedSchemaTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.schema_dir = Path(directory.name)
+        settings_patch = override_settings(
+            SCHEMA_DIR=self.schema_dir, CODE_VERSION="v1"
+        )
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        self.reset()
+        self.addCleanup(self.reset)
+        self.url = reverse("schema")
+
+    @staticmethod
+    def reset():
+        schema._documents.clear()
+        schema.code_version.cache_clear()
+
+    def test_built_once_and_served_from_memory(self):
+        first = self.client.get(self.url)
+
+        with mock.patch.object(schema, "SchemaGenerator") as generator:
+            second = self.client.get(self.url)
+
+        generator.assert_not_called()
+        self.assertEqual(first.content, second.content)
+        self.assertTrue(first.content.startswith(b"openapi:"))
+        self.assertTrue((self.schema_dir / "openapi-v1.yaml").exists())
+
+    def test_json_for_swagger_ui(self):
+        res = self.client.get(self.url, HTTP_ACCEPT="application/json, */*")
+
+        self.assertIn("openapi", json.loads(res.content))
+        self.assertEqual(res["Content-Type"], "application/vnd.oai.openapi+json")
+
+    def test_strong_etag(self):
+        res = self.client.get(self.url)
+        res_not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=res["ETag"])
+
+        self.assertFalse(res["ETag"].startswith("W/"))
+        self.assertEqual(res_not_modified.status_code, 304)
+        self.assertEqual(res_not_modified.content, b"")
+
+    def test_gzip(self):
+        plain = self.client.get(self.url)
+        res = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+
+        self.assertEqual(res["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(res.content), plain.content)
+        self.assertNotEqual(res["ETag"], plain["ETag"])
+        self.assertIn("Accept-Encoding", res["Vary"])
+
+    def test_loaded_from_file_by_new_process(self):
+        self.client.get(self.url)
+        self.reset()
+
+        with mock.patch.object(schema, "SchemaGenerator") as generator:
+            res = self.client.get(self.url)
+
+        generator.assert_not_called()
+        self.assertEqual(res.status_code, 200)
+
+    def test_rebuilt_when_code_version_changes(self):
+        self.client.get(self.url)
+
+        with override_settings(CODE_VERSION="v2"):
+            self.reset()
+            with mock.patch.object(
+                schema, "SchemaGenerator", wraps=schema.SchemaGenerator
+            ) as generator:
+                self.client.get(self.url)
+
+        generator.assert_called_once()
+        self.assertEqual(
+            sorted(path.name for path in self.schema_dir.iterdir()),
+            ["openapi-v2.json", "openapi-v2.yaml"],
+        )
+
+
+class StartupImportTests(TestCase):
+    """Cold starts of web and Celery processes during autoscaling"""
+
+    # Loaded on first use only. requests is not among them, Django REST
+    # framework imports it at startup itself.
+    LAZY_PACKAGES = {"stripe", "redis"}
+    # Import times vary a little from run to run
+    TOLERANCE_MS = 100
+
+    def assert_startup(self, target: str):
+        modules = startup.profile_imports(target)
+
+        loaded = {module.package for module in modules}
+        self.assertFalse(self.LAZY_PACKAGES & loaded)
+        self.assertLess(
+            startup.total_ms(modules),
+            settings.STARTUP_IMPORT_BUDGET_MS + self.TOLERANCE_MS,
+        )
+
+    def test_web_startup(self):
+        # Deployments build the schema before the web process starts
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(SCHEMA_DIR=Path(directory.name)):
+            schema.build_schema("startup")
+
+        with mock.patch.dict(
+            "os.environ", {"SCHEMA_DIR": directory.name, "CODE_VERSION": "startup"}
+        ):
+            self.assert_startup("web")
+
+    def test_celery_startup(self):
+        self.assert_startup("celery")
+
+    def test_package_times(self):
+        modules = startup.parse_import_times(
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       100 |        100 |     redis.client\n"
+            "import time:        50 |        150 |   redis\n"
+            "import time:        20 |         20 |   book.models\n"
+            "import time:        30 |        200 | book\n"
+        )
+
+        self.assertEqual(modules[0].parent, "redis")
+        self.assertEqual(modules[1].parent, "book")
+        self.assertIsNone(modules[3].parent)
+        times = {times.package: times for times in startup.package_times(modules)}
+        self.assertEqual(times["book"].self_ms, 0.05)
+        self.assertEqual(times["book"].cumulative_ms, 0.2)
+        self.assertTrue(times["book"].is_project)
+        self.assertEqual(times["redis"].cumulative_ms, 0.15)
+        self.assertFalse(times["redis"].is_project)
+
+
+class IdempotencyMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = sample_user()
+        self.book = sample_book(inventory=5)
+        self.payload = {
+            "book": self.book.id,
+            "expected_return_date": timezone.now() + timedelta(days=5),
+        }
+        self.headers = {
+            "HTTP_IDEMPOTENCY_KEY": "borrow-1",
+            "HTTP_AUTHORIZE": self.bearer(self.user),
+        }
+
+    @staticmethod
+    def bearer(user) -> str:
+        return f"Bearer {AccessToken.for_user(user)}"
+
+    def borrow(self, payload=None, **headers):
+        return self.client.post(
+            BORROWING_URL, payload or self.payload, **{**self.headers, **headers}
+        )
+
+    def test_retry_replays_first_response(self):
+        first = self.borrow()
+        retry = self.borrow()
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Borrowing.objects.count(), 1)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.inventory, 4)
+
+    def test_key_reused_for_other_request(self):
+        self.borrow()
+
+        res = self.borrow({**self.payload, "book": sample_book().id})
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(Borrowing.objects.count(), 1)
+
+    def test_keys_scoped_to_user(self):
+        other = sample_user(email="other@test.com")
+
+        first = self.borrow()
+        self.borrow(HTTP_AUTHORIZE=self.bearer(other))
+        # The access token was refreshed before the retry
+        retry = self.borrow(HTTP_AUTHORIZE=self.bearer(self.user))
+
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Borrowing.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Borrowing.objects.filter(user=other).count(), 1)
+
+    def test_anonymous_keys_scoped_to_address(self):
+        url = reverse("user:create")
+        payload = {"email": "new@test.com", "password": "newpass123"}
+        headers = {"HTTP_IDEMPOTENCY_KEY": "register-1"}
+        client = APIClient()
+
+        first = client.post(url, payload, REMOTE_ADDR="198.51.100.1", **headers)
+        retry = client.post(url, payload, REMOTE_ADDR="198.51.100.1", **headers)
+        other = client.post(url, payload, REMOTE_ADDR="198.51.100.2", **headers)
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", other)
+
+    def test_invalid_credentials_not_stored(self):
+        first = self.borrow(HTTP_AUTHORIZE="Bearer invalid")
+        retry = self.borrow(HTTP_AUTHORIZE="Bearer invalid")
+
+        self.assertEqual(first.status_code, 401)
+        self.assertNotIn("Idempotent-Replayed", retry)
+
+    def test_without_key_not_stored(self):
+        self.client.force_authenticate(self.user)
+        self.client.post(BORROWING_URL, self.payload)
+        self.client.post(BORROWING_URL, self.payload)
+
+        self.assertEqual(Borrowing.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_LOCK_WAIT=0.1)
+    def test_concurrent_request_waits_then_conflicts(self):
+        request = APIRequestFactory().post(
+            BORROWING_URL, self.payload, format="json", **self.headers
+        )
+        cache.add(f"{cache_key(request, 'borrow-1')}:lock", "other", 60)
+
+        res = self.borrow()
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(res["Retry-After"], "1")
+        self.assertEqual(Borrowing.objects.count(), 0)
+
+    def test_concurrent_request_replays_when_first_finishes(self):
+        first = self.borrow()
+        cache.add(f"{cache_key(first.wsgi_request, 'borrow-1')}:lock", "other", 60)
+
+        with mock.patch("time.sleep") as sleep:
+            retry = self.borrow()
+
+        sleep.assert_not_called()
+        self.assertEqual(retry.content, first.content)
+
+    def test_return_applied_once(self):
+        borrowing = Borrowing.objects.create(
+            expected_return_date=timezone.now() - timedelta(days=2),
+            book=self.book,
+            user=self.user,
+        )
+        url = reverse("borrowing:borrowing-return-book", args=[borrowing.id])
+        headers = {**self.headers, "HTTP_IDEMPOTENCY_KEY": "return-1"}
+
+        first = self.client.post(url, **headers)
+        retry = self.client.post(url, **headers)
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(borrowing.payments.count(), 1)
+        again = self.client.post(url, HTTP_AUTHORIZE=self.headers["HTTP_AUTHORIZE"])
+        self.assertEqual(again.status_code, 400)
+
+    async def test_async_handler(self):
+        headers = {
+            "Authorize": f"Bearer {AccessToken.for_user(self.user)}",
+            "Idempotency-Key": "borrow-async",
+        }
+        payload = {
+            "book": self.book.id,
+            "expected_return_date": self.payload["expected_return_date"].isoformat(),
+        }
+
+        first = await self.async_client.post(
+            BORROWING_URL, payload, content_type="application/json", headers=headers
+        )
+        retry = await self.async_client.post(
+            BORROWING_URL, payload, content_type="application/json", headers=headers
+        )
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(await Borrowing.objects.acount(), 1)
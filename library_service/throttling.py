@@ -0,0 +1,136 @@
+import functools
+import logging
+
+from django.conf import settings
+from rest_framework.throttling import AnonRateThrottle, UserRateThrottle
+
+logger = logging.getLogger(__name__)
+
+# Sliding window approximated from two fixed windows: the count of the
+# previous window weighted by how much of it still overlaps the sliding
+# window, plus the count of the current one. Each client is one hash of
+# three fields whatever its request rate.
+#
+# KEYS[1]  hash of the client
+# ARGV[1]  current time, ms
+# ARGV[2]  window length, ms
+# ARGV[3]  allowed requests per window
+# Returns {allowed, wait ms}
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local start = now - now % window
+
+local state = redis.call("HMGET", KEYS[1], "start", "current", "previous")
+local current_start = tonumber(state[1]) or start
+local current = tonumber(state[2]) or 0
+local previous = tonumber(state[3]) or 0
+if current_start ~= start then
+    if start - current_start == window then
+        previous = current
+    else
+        previous = 0
+    end
+    current = 0
+end
+
+local elapsed = now - start
+local estimate = previous * (window - elapsed) / window + current
+local allowed = 0
+local wait = 0
+if estimate < limit then
+    allowed = 1
+    current = current + 1
+elseif current < limit then
+    -- Wait until the previous window's share has shrunk enough
+    wait = window - elapsed - (limit - current) * window / previous
+else
+    -- Wait for the next window and for this one's share to shrink
+    wait = window - elapsed + window - limit * window / current
+end
+
+redis.call("HSET", KEYS[1], "start", start, "current", current, "previous", previous)
+redis.call("PEXPIRE", KEYS[1], window * 2)
+return {allowed, math.ceil(wait)}
+"""
+
+
+@functools.lru_cache
+def _get_client(url: str):
+    # Imported here so processes without Redis never load it
+    import redis
+
+    return redis.Redis.from_url(url)
+
+
+@functools.lru_cache
+def _get_script(url: str):
+    return _get_client(url).register_script(SLIDING_WINDOW_SCRIPT)
+
+
+def get_redis():
+    """Shared Redis client, or None when no Redis server is configured"""
+    if not settings.REDIS_URL:
+        return None
+    return _get_client(settings.REDIS_URL)
+
+
+def get_sliding_window_script():
+    """Shared throttle script, or None when no Redis server is configured"""
+    if not settings.REDIS_URL:
+        return None
+    return _get_script(settings.REDIS_URL)
+
+
+class SlidingWindowThrottleMixin:
+    """
+    Keep throttle state in Redis and update it atomically with one script
+    call, so the limit holds across all workers and nodes. Without REDIS_URL
+    the plain DRF throttle is used.
+    """
+
+    wait_seconds = None
+
+    def allow_request(self, request, view):
+        script = get_sliding_window_script()
+        if script is None:
+            return super().allow_request(request, view)
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        # Already loaded by get_sliding_window_script
+        from redis import RedisError
+
+        try:
+            allowed, wait = script(
+                keys=[self.key],
+                args=[
+                    int(self.timer() * 1000),
+                    self.duration * 1000,
+                    self.num_requests,
+                ],
+            )
+        except RedisError:
+            # An unavailable Redis must not take the API down with it
+            logger.warning("Throttle state unavailable", exc_info=True)
+            return True
+        self.wait_seconds = wait / 1000
+        return bool(allowed)
+
+    def wait(self):
+        if self.wait_seconds is None:
+            return super().wait()
+        return self.wait_seconds
+
+
+class SlidingWindowAnonThrottle(SlidingWindowThrottleMixin, AnonRateThrottle):
+    pass
+
+
+class SlidingWindowUserThrottle(SlidingWindowThrottleMixin, UserRateThrottle):
+    pass
@@ -16,7 +16,9 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
+from drf_spectacular.views import SpectacularSwaggerView
+
+from library_service.schema import PrecomputedSchemaView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -30,7 +32,7 @@ urlpatterns = [
         "api/payments/",
         include("payment.urls", namespace="payment"),
     ),
-    path("api/doc/", SpectacularAPIView.as_view(), name="schema"),
+    path("api/doc/", PrecomputedSchemaView.as_view(), name="schema"),
     path(
         "api/doc/swagger/",
         SpectacularSwaggerView.as_view(url_name="schema"),
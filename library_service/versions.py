@@ -0,0 +1,39 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+# A version stamp is a timestamp stored in the cache. Cached data is keyed
+# on the stamp it was built under and invalidated by setting a newer one.
+
+
+def get_version(key: str, timeout: int | None = None) -> float:
+    """Return the version stamp stored under key, creating it if missing"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), timeout=timeout)
+        version = cache.get(key)
+    return version
+
+
+async def aget_version(key: str, timeout: int | None = None) -> float:
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time(), timeout=timeout)
+        version = await cache.aget(key)
+    return version
+
+
+def _set_versions(keys: list[str], timeout: int | None) -> None:
+    now = time.time()
+    cache.set_many({key: now for key in keys}, timeout=timeout)
+
+
+def bump_versions(keys, timeout: int | None = None) -> None:
+    """
+    Set newer stamps under keys. The bump is repeated after commit so data
+    cached from what was read before the commit is dropped as well.
+    """
+    keys = list(keys)
+    _set_versions(keys, timeout)
+    transaction.on_commit(lambda: _set_versions(keys, timeout))
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "library_service.settings")
 
 application = get_wsgi_application()
+
+# Build the API schema now rather than on the first request for it
+from library_service.schema import warm  # noqa: E402
+
+warm()
@@ -1,5 +1,13 @@
 from django.contrib import admin
 
-from payment.models import Payment
+from payment.models import (
+    Payment,
+    PaymentOutbox,
+    ReconciliationCursor,
+    StripeEvent,
+)
 
 admin.site.register(Payment)
+admin.site.register(PaymentOutbox)
+admin.site.register(StripeEvent)
+admin.site.register(ReconciliationCursor)
@@ -0,0 +1,319 @@
+import functools
+import json
+import time
+import uuid
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from library_service.circuit_breaker import OPEN, CircuitBreaker
+from library_service.instrumentation import timed
+
+SESSION_LIFETIME = 24 * 60 * 60
+LIST_PAGE_SIZE = 100
+# (connect, read) seconds per Stripe call, listing a page can take longer
+TIMEOUTS = {
+    "create": (3.05, 10),
+    "retrieve": (3.05, 5),
+    "list": (3.05, 20),
+}
+
+
+@dataclass
+class CheckoutSession:
+    id: str
+    url: str
+    amount_total: int
+    payment_status: str
+    created: int
+    expires_at: int
+    status: str = "open"
+
+
+@dataclass
+class SessionPage:
+    sessions: list[CheckoutSession]
+    has_more: bool
+
+
+@dataclass
+class WebhookEvent:
+    id: str
+    type: str
+    session_id: str
+    payment_status: str
+    payload: dict
+
+
+@functools.lru_cache
+def stripe_sdk():
+    """The Stripe SDK, imported on first use as it is slow to import"""
+    import stripe
+
+    from payment.stripe_client import PooledRequestsClient
+
+    stripe.api_key = settings.STRIPE_API_KEY
+    # Failed requests are retried by the SDK with jittered exponential
+    # backoff, POSTs under an idempotency key
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    stripe.default_http_client = PooledRequestsClient(
+        timeout=TIMEOUTS["create"], pool_size=settings.STRIPE_POOL_SIZE
+    )
+    return stripe
+
+
+class WebhookError(Exception):
+    """Webhook request that is not signed by the provider or is malformed"""
+
+
+class GatewayUnavailable(Exception):
+    """Provider unreachable or failing even after retries"""
+
+
+def parse_stripe_event(payload: bytes, signature: str) -> WebhookEvent:
+    """Verify the Stripe-Signature header of a webhook request and parse it"""
+    # An empty secret would accept events signed with an empty key
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise WebhookError("Webhook signing secret is not configured")
+    stripe = stripe_sdk()
+    try:
+        event = stripe.Webhook.construct_event(
+            payload, signature, settings.STRIPE_WEBHOOK_SECRET
+        )
+        session = event["data"]["object"]
+        return WebhookEvent(
+            id=event["id"],
+            type=event["type"],
+            session_id=session["id"],
+            payment_status=session.get("payment_status", ""),
+            payload=json.loads(payload),
+        )
+    except (stripe.error.SignatureVerificationError, ValueError, KeyError) as exc:
+        raise WebhookError(str(exc)) from exc
+
+
+class PaymentGateway:
+    """Interface of the checkout provider used by the payment app"""
+
+    def create_checkout_session(
+        self,
+        line_items: list[dict],
+        success_url: str,
+        cancel_url: str,
+        idempotency_key: str = None,
+    ) -> CheckoutSession:
+        raise NotImplementedError
+
+    def retrieve_checkout_session(self, session_id: str) -> CheckoutSession:
+        raise NotImplementedError
+
+    def list_checkout_sessions(
+        self,
+        created_since: int,
+        starting_after: str = None,
+        limit: int = LIST_PAGE_SIZE,
+    ) -> SessionPage:
+        """
+        Page of sessions created at or after the given timestamp, newest first.
+        Pass the id of the last session of a page to get the next one.
+        """
+        raise NotImplementedError
+
+    def construct_event(self, payload: bytes, signature: str) -> WebhookEvent:
+        raise NotImplementedError
+
+    def is_available(self) -> bool:
+        """False while calls to the provider are known to fail"""
+        return True
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class StripeGateway(PaymentGateway):
+    """
+    Gateway backed by the Stripe checkout API. Calls share a keep-alive
+    connection pool, have per-call timeouts and go through a circuit breaker
+    that makes them fail fast with CircuitOpen while Stripe is unhealthy.
+    """
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(
+            "stripe",
+            failure_exceptions=(GatewayUnavailable,),
+            failure_threshold=settings.STRIPE_BREAKER_FAILURES,
+            reset_timeout=settings.STRIPE_BREAKER_RESET_SECONDS,
+        )
+
+    @property
+    def stripe(self):
+        return stripe_sdk()
+
+    def _call(self, operation: str, method, **params):
+        return self.breaker.call(self._send, operation, method, **params)
+
+    def _send(self, operation: str, method, **params):
+        from payment.stripe_client import call_timeout
+
+        errors = self.stripe.error
+        try:
+            with timed("stripe"), call_timeout(TIMEOUTS[operation]):
+                return method(**params)
+        except (
+            errors.APIConnectionError,
+            errors.APIError,
+            errors.RateLimitError,
+        ) as exc:
+            raise GatewayUnavailable(str(exc)) from exc
+
+    @staticmethod
+    def _to_session(session) -> CheckoutSession:
+        return CheckoutSession(
+            id=session.id,
+            url=session.url,
+            amount_total=session.amount_total,
+            payment_status=session.payment_status,
+            created=session.created,
+            expires_at=session.expires_at,
+            status=session.status,
+        )
+
+    def create_checkout_session(
+        self,
+        line_items: list[dict],
+        success_url: str,
+        cancel_url: str,
+        idempotency_key: str = None,
+    ) -> CheckoutSession:
+        session = self._call(
+            "create",
+            self.stripe.checkout.Session.create,
+            line_items=[
+                {
+                    "price_data": {
+                        "currency": "usd",
+                        "product_data": {"name": item["name"]},
+                        "unit_amount": item["unit_amount"],
+                    },
+                    "quantity": item.get("quantity", 1),
+                }
+                for item in line_items
+            ],
+            mode="payment",
+            success_url=success_url,
+            cancel_url=cancel_url,
+            idempotency_key=idempotency_key,
+        )
+        return self._to_session(session)
+
+    def retrieve_checkout_session(self, session_id: str) -> CheckoutSession:
+        session = self._call(
+            "retrieve", self.stripe.checkout.Session.retrieve, id=session_id
+        )
+        return self._to_session(session)
+
+    def list_checkout_sessions(
+        self,
+        created_since: int,
+        starting_after: str = None,
+        limit: int = LIST_PAGE_SIZE,
+    ) -> SessionPage:
+        params = {"created": {"gte": created_since}, "limit": limit}
+        if starting_after:
+            params["starting_after"] = starting_after
+        page = self._call("list", self.stripe.checkout.Session.list, **params)
+        return SessionPage(
+            sessions=[self._to_session(session) for session in page.data],
+            has_more=page.has_more,
+        )
+
+    def construct_event(self, payload: bytes, signature: str) -> WebhookEvent:
+        return parse_stripe_event(payload, signature)
+
+    def is_available(self) -> bool:
+        return self.breaker.state != OPEN
+
+    def metrics(self) -> dict:
+        return self.breaker.metrics()
+
+
+class FakeGateway(PaymentGateway):
+    """In-process stand-in for Stripe, used for local development and tests"""
+
+    sessions = {}
+    idempotency_keys = {}
+
+    def create_checkout_session(
+        self,
+        line_items: list[dict],
+        success_url: str,
+        cancel_url: str,
+        idempotency_key: str = None,
+    ) -> CheckoutSession:
+        if idempotency_key in self.idempotency_keys:
+            return self.sessions[self.idempotency_keys[idempotency_key]]
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        created = int(time.time())
+        session = CheckoutSession(
+            id=session_id,
+            url=f"{settings.BACKEND_URL}fake-checkout/{session_id}",
+            amount_total=sum(
+                item["unit_amount"] * item.get("quantity", 1) for item in line_items
+            ),
+            payment_status="unpaid",
+            created=created,
+            expires_at=created + SESSION_LIFETIME,
+        )
+        self.sessions[session_id] = session
+        if idempotency_key:
+            self.idempotency_keys[idempotency_key] = session_id
+        return session
+
+    def retrieve_checkout_session(self, session_id: str) -> CheckoutSession:
+        return self.sessions[session_id]
+
+    def list_checkout_sessions(
+        self,
+        created_since: int,
+        starting_after: str = None,
+        limit: int = LIST_PAGE_SIZE,
+    ) -> SessionPage:
+        # Newest first like Stripe, ties in creation order reversed
+        sessions = [
+            session
+            for session in reversed(self.sessions.values())
+            if session.created >= created_since
+        ]
+        sessions.sort(key=lambda session: session.created, reverse=True)
+        if starting_after:
+            ids = [session.id for session in sessions]
+            sessions = sessions[ids.index(starting_after) + 1 :]
+        return SessionPage(sessions=sessions[:limit], has_more=len(sessions) > limit)
+
+    def construct_event(self, payload: bytes, signature: str) -> WebhookEvent:
+        # Fake sessions are confirmed with the same signed events Stripe sends
+        return parse_stripe_event(payload, signature)
+
+    @classmethod
+    def mark_paid(cls, session_id: str) -> None:
+        cls.sessions[session_id].payment_status = "paid"
+        cls.sessions[session_id].status = "complete"
+
+    @classmethod
+    def expire(cls, session_id: str) -> None:
+        cls.sessions[session_id].status = "expired"
+
+    @classmethod
+    def reset(cls) -> None:
+        cls.sessions.clear()
+        cls.idempotency_keys.clear()
+
+
+@functools.lru_cache
+def _load_gateway(path: str) -> PaymentGateway:
+    return import_string(path)()
+
+
+def get_gateway() -> PaymentGateway:
+    return _load_gateway(settings.PAYMENT_GATEWAY)
@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0005_reconciliation_cursor"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["borrowing", "type", "status"],
+                name="payment_borrowing_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                condition=models.Q(("status", "PENDING")),
+                fields=["session_expires_at"],
+                name="payment_pending_expiry_idx",
+            ),
+        ),
+    ]
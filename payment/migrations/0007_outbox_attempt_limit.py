@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0006_payment_reuse_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paymentoutbox",
+            name="failed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="paymentoutbox",
+            name="next_attempt_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("PENDING", "Pending"),
+                    ("PAID", "Paid"),
+                    ("EXPIRED", "Expired"),
+                    ("FAILED", "Failed"),
+                ],
+                max_length=7,
+            ),
+        ),
+    ]
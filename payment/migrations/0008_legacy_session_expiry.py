@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 21:30
+
+from datetime import timedelta
+
+from django.db import migrations
+from django.utils import timezone
+
+# Longest a Stripe checkout session stays open
+SESSION_LIFETIME = timedelta(hours=24)
+
+
+def backfill_legacy_session_expiry(apps, schema_editor):
+    """
+    Pending payments opened before session expiries were recorded have no
+    expiry, so they were never swept. Payments have no creation time, so
+    their sessions are given the longest lifetime from now. They stay
+    payable until then and are swept as expired afterwards.
+    """
+    Payment = apps.get_model("payment", "Payment")
+    Payment.objects.filter(status="PENDING", session_expires_at__isnull=True).exclude(
+        session_id=""
+    ).update(session_expires_at=timezone.now() + SESSION_LIFETIME)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0007_outbox_attempt_limit"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_legacy_session_expiry, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2 on 2026-10-18 22:10
+
+from django.db import migrations
+from django.db.models import F
+
+
+def legacy_amounts_to_dollars(apps, schema_editor):
+    """
+    Payments created before the outbox stored the session's amount_total,
+    which is in cents, while money_to_pay is now in dollars. Only those
+    payments have no outbox.
+    """
+    Payment = apps.get_model("payment", "Payment")
+    Payment.objects.filter(outbox__isnull=True).update(
+        money_to_pay=F("money_to_pay") / 100
+    )
+
+
+def legacy_amounts_to_cents(apps, schema_editor):
+    Payment = apps.get_model("payment", "Payment")
+    Payment.objects.filter(outbox__isnull=True).update(
+        money_to_pay=F("money_to_pay") * 100
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("payment", "0008_legacy_session_expiry"),
+    ]
+
+    operations = [
+        migrations.RunPython(legacy_amounts_to_dollars, legacy_amounts_to_cents),
+    ]
@@ -3,10 +3,33 @@ from django.db import models
 from borrowing.models import Borrowing
 
 
+class PaymentOutbox(models.Model):
+    """Checkout session waiting to be opened by a worker after commit"""
+
+    line_items = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(blank=True, null=True)
+    failed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        if self.processed_at:
+            state = "processed"
+        elif self.failed_at:
+            state = "failed"
+        else:
+            state = "pending"
+        return f"Checkout session outbox #{self.id} ({state})"
+
+
 class Payment(models.Model):
     class Status(models.TextChoices):
         PENDING = "PENDING"
         PAID = "PAID"
+        EXPIRED = "EXPIRED"
+        FAILED = "FAILED"
 
     class Type(models.TextChoices):
         PAYMENT = "PAYMENT"
@@ -17,9 +40,68 @@ class Payment(models.Model):
     borrowing = models.ForeignKey(
         Borrowing, on_delete=models.CASCADE, related_name="payments"
     )
-    session_url = models.CharField(max_length=500)
-    session_id = models.CharField(max_length=500)
+    outbox = models.ForeignKey(
+        PaymentOutbox,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="payments",
+    )
+    session_url = models.CharField(max_length=500, blank=True)
+    session_id = models.CharField(max_length=500, blank=True)
+    session_expires_at = models.DateTimeField(blank=True, null=True)
     money_to_pay = models.DecimalField(max_digits=8, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["session_id"], name="payment_session_id_idx"),
+            # Lookup of a pending payment to reuse for a borrowing
+            models.Index(
+                fields=["borrowing", "type", "status"],
+                name="payment_borrowing_status_idx",
+            ),
+            # Sweep of pending payments whose session has expired
+            models.Index(
+                fields=["session_expires_at"],
+                condition=models.Q(status="PENDING"),
+                name="payment_pending_expiry_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.money_to_pay}USD {self.type} in status {self.status}"
+
+
+class StripeEvent(models.Model):
+    """Stripe webhook event, queued until it is applied to the payments"""
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=64)
+    session_id = models.CharField(max_length=500)
+    payment_status = models.CharField(max_length=32, blank=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="stripe_event_pending_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id}"
+
+
+class ReconciliationCursor(models.Model):
+    """Creation time from which provider sessions still need reconciling"""
+
+    name = models.CharField(max_length=64, unique=True)
+    created_since = models.BigIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} reconciled since {self.created_since}"
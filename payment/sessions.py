@@ -1,57 +1,155 @@
-import stripe
+from datetime import timedelta
+from decimal import Decimal
 
+from django.db import transaction
+from django.db.models import Q
 from django.urls import reverse
+from django.utils import timezone
 
 from borrowing.models import Borrowing
 from library_service import settings
-from payment.models import Payment
+from payment.models import Payment, PaymentOutbox
+from payment.tasks import create_checkout_session
 
-stripe.api_key = settings.STRIPE_API_KEY
 BACKEND_URL = settings.BACKEND_URL
 FINE_MULTIPLIER = 2
+# A session about to expire is not worth handing out again
+REUSE_MIN_REMAINING = timedelta(minutes=10)
 
 
-def create_payment(
-    borrowing: Borrowing, session: stripe.checkout.Session, payment_type: str
-) -> None:
-    Payment.objects.create(
-        status="PENDING",
-        type=payment_type,
-        borrowing=borrowing,
-        session_url=session.url,
-        session_id=session.id,
-        money_to_pay=session.amount_total,
+def get_success_url() -> str:
+    return (
+        f"{BACKEND_URL}{reverse('payment:success')}"
+        + "?session_id={CHECKOUT_SESSION_ID}"
     )
 
 
-def create_payment_session(
-    borrowing: Borrowing, days: int = None
-) -> stripe.checkout.Session:
+def get_cancel_url() -> str:
+    return (
+        f"{BACKEND_URL}{reverse('payment:cancel')}"
+        + "?session_id={CHECKOUT_SESSION_ID}"
+    )
+
+
+def line_item(title: str, days: int, amount: int) -> dict:
+    return {
+        "name": f"{title} borrowing for {days} days",
+        "unit_amount": amount,
+        "quantity": 1,
+    }
+
+
+def build_line_item(borrowing: Borrowing, days: int = None) -> tuple[dict, str]:
+    """Return the checkout line item for a borrowing and its payment type"""
     if days:
         amount = int(borrowing.book.daily_fee) * days * 100 * FINE_MULTIPLIER
-        payment_type = "FINE"
+        payment_type = Payment.Type.FINE
     else:
         days = (borrowing.expected_return_date - borrowing.borrow_date).days
         amount = int(borrowing.book.daily_fee) * days * 100
-        payment_type = "PAYMENT"
-    session = stripe.checkout.Session.create(
-        line_items=[
-            {
-                "price_data": {
-                    "currency": "usd",
-                    "product_data": {
-                        "name": f"{borrowing.book.title} borrowing for {days} days",
-                    },
-                    "unit_amount": amount,
-                },
-                "quantity": 1,
-            }
+        payment_type = Payment.Type.PAYMENT
+    return line_item(borrowing.book.title, days, amount), payment_type
+
+
+def payment_key(borrowing_id: int, item: dict, payment_type: str) -> tuple:
+    return borrowing_id, payment_type, Decimal(item["unit_amount"]) / 100
+
+
+def find_reusable_payments(entries: list[tuple[int, dict, str]]) -> dict:
+    """
+    Pending payments for the same borrowing, type and amount as the entries
+    whose checkout session can still be paid or is still being opened,
+    looked up with one query on the (borrowing, type, status) index
+    """
+    payments = Payment.objects.filter(
+        borrowing_id__in={borrowing_id for borrowing_id, _, _ in entries},
+        type__in={payment_type for _, _, payment_type in entries},
+        status=Payment.Status.PENDING,
+    ).filter(
+        Q(
+            session_id="",
+            outbox__isnull=False,
+            outbox__processed_at__isnull=True,
+            outbox__failed_at__isnull=True,
+        )
+        | Q(session_expires_at__gt=timezone.now() + REUSE_MIN_REMAINING)
+    )
+    return {
+        (payment.borrowing_id, payment.type, payment.money_to_pay): payment
+        for payment in payments
+    }
+
+
+def write_outbox_payments(
+    groups: list[list[tuple[int, dict, str]]]
+) -> list[list[Payment]]:
+    """
+    Write one outbox record per group of (borrowing_id, line_item,
+    payment_type) entries and a pending payment per entry, with one INSERT
+    for all the records and one for all the payments. Each group becomes
+    its own checkout session, opened by a worker once the transaction
+    commits, so the request never waits on the payment provider.
+    """
+    outboxes = PaymentOutbox.objects.bulk_create(
+        PaymentOutbox(line_items=[item for _, item, _ in entries]) for entries in groups
+    )
+    payments = iter(
+        Payment.objects.bulk_create(
+            Payment(
+                status=Payment.Status.PENDING,
+                type=payment_type,
+                borrowing_id=borrowing_id,
+                outbox=outbox,
+                money_to_pay=Decimal(item["unit_amount"]) / 100,
+            )
+            for outbox, entries in zip(outboxes, groups)
+            for borrowing_id, item, payment_type in entries
+        )
+    )
+    for outbox in outboxes:
+        # A broker error only logs, the committed record is re-enqueued by
+        # dispatch_payment_outbox
+        transaction.on_commit(
+            lambda outbox_id=outbox.id: create_checkout_session.delay(outbox_id),
+            robust=True,
+        )
+    return [[next(payments) for _ in entries] for entries in groups]
+
+
+def create_outbox_payments(
+    entries: list[tuple[int, dict, str]], reuse_pending: bool = True
+) -> list[Payment]:
+    """
+    Return one pending payment per (borrowing_id, line_item, payment_type)
+    entry. A still valid pending payment of the entry is returned as it is,
+    so a retried request does not open a second session. The others are
+    written with a single outbox record holding their line items in the
+    current transaction. Pass reuse_pending=False for borrowings created in
+    this transaction.
+    """
+    reusable = find_reusable_payments(entries) if reuse_pending else {}
+    new_entries = [entry for entry in entries if payment_key(*entry) not in reusable]
+    created = iter(write_outbox_payments([new_entries])[0] if new_entries else [])
+    return [reusable.get(payment_key(*entry)) or next(created) for entry in entries]
+
+
+def create_combined_payment_session(
+    borrowings: list[Borrowing], days: dict[int, int] = None, reuse_pending: bool = True
+) -> list[Payment]:
+    """One checkout session with a line item for each of the borrowings"""
+    days = days or {}
+    return create_outbox_payments(
+        [
+            (borrowing.id, *build_line_item(borrowing, days.get(borrowing.id)))
+            for borrowing in borrowings
         ],
-        mode="payment",
-        success_url=f"{BACKEND_URL}{reverse('payment:success')}"
-        + "?session_id={CHECKOUT_SESSION_ID}",
-        cancel_url=f"{BACKEND_URL}{reverse('payment:cancel')}"
-        + "?session_id={CHECKOUT_SESSION_ID}",
+        reuse_pending,
     )
-    create_payment(borrowing, session, payment_type)
-    return session
+
+
+def create_payment_session(
+    borrowing: Borrowing, days: int = None, reuse_pending: bool = True
+) -> Payment:
+    return create_combined_payment_session(
+        [borrowing], {borrowing.id: days}, reuse_pending
+    )[0]
@@ -0,0 +1,40 @@
+import contextlib
+import contextvars
+
+import requests
+from requests.adapters import HTTPAdapter
+from stripe.http_client import RequestsClient
+
+_timeout = contextvars.ContextVar("stripe_timeout", default=None)
+
+
+@contextlib.contextmanager
+def call_timeout(timeout: tuple[float, float]):
+    """(connect, read) timeout of the Stripe requests made inside the block"""
+    token = _timeout.set(timeout)
+    try:
+        yield
+    finally:
+        _timeout.reset(token)
+
+
+class PooledRequestsClient(RequestsClient):
+    """
+    Stripe HTTP client sharing one pool of keep-alive connections between
+    the threads of a process instead of opening a session per thread
+    """
+
+    def __init__(self, timeout: tuple[float, float], pool_size: int):
+        session = requests.Session()
+        session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        )
+        super().__init__(timeout=timeout, session=session)
+
+    @property
+    def _timeout(self):
+        return _timeout.get() or self.default_timeout
+
+    @_timeout.setter
+    def _timeout(self, timeout):
+        self.default_timeout = timeout
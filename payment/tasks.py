@@ -0,0 +1,265 @@
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from celery import shared_task
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from library_service.circuit_breaker import CircuitOpen
+from payment.gateways import CheckoutSession, get_gateway
+from payment.models import (
+    Payment,
+    PaymentOutbox,
+    ReconciliationCursor,
+    StripeEvent,
+)
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_RETRY_AFTER = timedelta(minutes=1)
+# With the delay doubling after each failure, attempts span about two hours
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BATCH_SIZE = 500
+STRIPE_EVENT_BATCH_SIZE = 500
+EXPIRE_BATCH_SIZE = 1000
+
+PAID_EVENTS = (
+    "checkout.session.completed",
+    "checkout.session.async_payment_succeeded",
+)
+EXPIRED_EVENTS = ("checkout.session.expired",)
+
+RECONCILIATION_CURSOR = "checkout_sessions"
+RECONCILIATION_PAGE_SIZE = 100
+# How far back the very first reconciliation run looks
+RECONCILIATION_LOOKBACK = timedelta(days=7)
+
+
+def open_checkout_session(outbox_id: int) -> None:
+    """Create the provider session for an outbox record and fill in its payments"""
+    from payment.sessions import get_cancel_url, get_success_url
+
+    outbox = PaymentOutbox.objects.filter(
+        pk=outbox_id, processed_at__isnull=True, failed_at__isnull=True
+    ).first()
+    if outbox is None:
+        return
+
+    # The idempotency key makes a retry after a crash return the same session
+    # instead of opening a second one.
+    session = get_gateway().create_checkout_session(
+        line_items=outbox.line_items,
+        success_url=get_success_url(),
+        cancel_url=get_cancel_url(),
+        idempotency_key=f"payment-outbox-{outbox.id}",
+    )
+    outbox.payments.update(
+        session_id=session.id,
+        session_url=session.url,
+        session_expires_at=datetime.fromtimestamp(session.expires_at, dt_timezone.utc),
+    )
+    PaymentOutbox.objects.filter(pk=outbox.id).update(processed_at=timezone.now())
+
+
+def record_outbox_failure(outbox_id: int, error: str) -> None:
+    """
+    Count a failed attempt and schedule the next one with exponential
+    backoff. After OUTBOX_MAX_ATTEMPTS the record and its payments fail.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        outbox = (
+            PaymentOutbox.objects.select_for_update()
+            .filter(pk=outbox_id, processed_at__isnull=True, failed_at__isnull=True)
+            .first()
+        )
+        if outbox is None:
+            return
+        outbox.attempts += 1
+        outbox.last_error = error
+        if outbox.attempts >= OUTBOX_MAX_ATTEMPTS:
+            outbox.failed_at = now
+            outbox.payments.filter(status=Payment.Status.PENDING).update(
+                status=Payment.Status.FAILED
+            )
+            logger.error(
+                "Checkout session outbox #%s failed after %s attempts: %s",
+                outbox_id,
+                outbox.attempts,
+                error,
+            )
+        else:
+            outbox.next_attempt_at = now + OUTBOX_RETRY_AFTER * 2 ** (
+                outbox.attempts - 1
+            )
+        outbox.save(
+            update_fields=["attempts", "last_error", "failed_at", "next_attempt_at"]
+        )
+
+
+@shared_task
+def create_checkout_session(outbox_id: int) -> None:
+    try:
+        open_checkout_session(outbox_id)
+    except CircuitOpen as exc:
+        # Not an attempt: the record stays queued in the outbox and is
+        # dispatched again once the provider is back
+        PaymentOutbox.objects.filter(pk=outbox_id).update(last_error=str(exc))
+    except Exception as exc:
+        # Retried by dispatch_payment_outbox once the backoff is over
+        logger.warning("Checkout session outbox #%s failed", outbox_id, exc_info=True)
+        record_outbox_failure(outbox_id, str(exc))
+
+
+@shared_task
+def dispatch_payment_outbox() -> int:
+    """
+    Re-enqueue outbox records whose after-commit dispatch was lost, that
+    were held back while the provider was unavailable or whose backoff
+    after a failed attempt is over
+    """
+    if not get_gateway().is_available():
+        return 0
+    now = timezone.now()
+    outbox_ids = list(
+        PaymentOutbox.objects.filter(
+            Q(next_attempt_at__isnull=True, created_at__lt=now - OUTBOX_RETRY_AFTER)
+            | Q(next_attempt_at__lte=now),
+            processed_at__isnull=True,
+            failed_at__isnull=True,
+        ).values_list("id", flat=True)[:OUTBOX_BATCH_SIZE]
+    )
+    for outbox_id in outbox_ids:
+        create_checkout_session.delay(outbox_id)
+    return len(outbox_ids)
+
+
+def apply_stripe_events(batch_size: int = STRIPE_EVENT_BATCH_SIZE) -> int:
+    """
+    Apply one batch of queued webhook events with one UPDATE per status.
+    Rows locked by a concurrent worker are skipped, not waited for.
+    """
+    with transaction.atomic():
+        events = list(
+            StripeEvent.objects.filter(processed_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .only("type", "session_id", "payment_status")
+            .order_by("id")[:batch_size]
+        )
+        paid = {
+            event.session_id
+            for event in events
+            if event.type in PAID_EVENTS and event.payment_status == "paid"
+        }
+        expired = {event.session_id for event in events if event.type in EXPIRED_EVENTS}
+        # Paid first, so a session reported both ways in one batch ends up paid
+        if paid:
+            Payment.objects.filter(session_id__in=paid).exclude(
+                status=Payment.Status.PAID
+            ).update(status=Payment.Status.PAID)
+        if expired:
+            Payment.objects.filter(
+                session_id__in=expired, status=Payment.Status.PENDING
+            ).update(status=Payment.Status.EXPIRED)
+        StripeEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            processed_at=timezone.now()
+        )
+    return len(events)
+
+
+@shared_task
+def process_stripe_events() -> int:
+    """Drain the webhook event queue in batches"""
+    processed = 0
+    while applied := apply_stripe_events():
+        processed += applied
+    return processed
+
+
+@shared_task
+def expire_payment_sessions(batch_size: int = EXPIRE_BATCH_SIZE) -> int:
+    """
+    Mark pending payments whose checkout session has expired, in batches so
+    each UPDATE holds its row locks briefly. Catches up on expirations whose
+    webhook event never arrived.
+    """
+    now = timezone.now()
+    expired = 0
+    while True:
+        payment_ids = list(
+            Payment.objects.filter(
+                status=Payment.Status.PENDING, session_expires_at__lte=now
+            ).values_list("id", flat=True)[:batch_size]
+        )
+        if not payment_ids:
+            return expired
+        expired += Payment.objects.filter(
+            pk__in=payment_ids, status=Payment.Status.PENDING
+        ).update(status=Payment.Status.EXPIRED)
+
+
+def reconcile_session_page(sessions: list[CheckoutSession]) -> int:
+    """Update the pending payments of one page of sessions with one query"""
+    statuses = {}
+    for session in sessions:
+        if session.payment_status == "paid":
+            statuses[session.id] = Payment.Status.PAID
+        elif session.status == "expired":
+            statuses[session.id] = Payment.Status.EXPIRED
+    if not statuses:
+        return 0
+
+    # A combined checkout session covers several payments
+    payment_ids = defaultdict(list)
+    for session_id, payment_id in Payment.objects.filter(
+        session_id__in=statuses, status=Payment.Status.PENDING
+    ).values_list("session_id", "id"):
+        payment_ids[session_id].append(payment_id)
+
+    payments = [
+        Payment(id=payment_id, status=statuses[session_id])
+        for session_id, ids in payment_ids.items()
+        for payment_id in ids
+    ]
+    Payment.objects.bulk_update(payments, ["status"])
+    return len(payments)
+
+
+@shared_task
+def reconcile_payments() -> int:
+    """
+    Walk the provider's sessions created since the stored cursor page by
+    page and settle the matching pending payments. The cursor then moves
+    to the oldest session that is still open, as it may be paid later.
+    """
+    gateway = get_gateway()
+    cursor, _ = ReconciliationCursor.objects.get_or_create(
+        name=RECONCILIATION_CURSOR,
+        defaults={
+            "created_since": int(time.time() - RECONCILIATION_LOOKBACK.total_seconds())
+        },
+    )
+
+    updated = 0
+    newest = cursor.created_since
+    oldest_open = None
+    starting_after = None
+    while True:
+        page = gateway.list_checkout_sessions(
+            cursor.created_since, starting_after, RECONCILIATION_PAGE_SIZE
+        )
+        updated += reconcile_session_page(page.sessions)
+        for session in page.sessions:
+            newest = max(newest, session.created)
+            if session.status == "open":
+                oldest_open = min(oldest_open or session.created, session.created)
+        if not page.has_more or not page.sessions:
+            break
+        starting_after = page.sessions[-1].id
+
+    cursor.created_since = newest if oldest_open is None else oldest_open
+    cursor.save(update_fields=["created_since", "updated_at"])
+    return updated
@@ -1,7 +1,22 @@
+import copy
+import hashlib
+import hmac
+import importlib
+import json
+import time
 from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
 
+import requests
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
@@ -10,8 +25,26 @@ from rest_framework.test import APIClient
 from book.tests import sample_book
 from borrowing.models import Borrowing
 from borrowing.tests import sample_borrowing
-from payment.models import Payment
+from library_service.circuit_breaker import CircuitOpen
+from payment.gateways import (
+    TIMEOUTS,
+    FakeGateway,
+    GatewayUnavailable,
+    get_gateway,
+    stripe_sdk,
+)
+from payment.models import Payment, PaymentOutbox, ReconciliationCursor, StripeEvent
 from payment.serializers import PaymentSerializer
+from payment.sessions import create_combined_payment_session, create_payment_session
+from payment.tasks import (
+    OUTBOX_MAX_ATTEMPTS,
+    apply_stripe_events,
+    create_checkout_session,
+    dispatch_payment_outbox,
+    expire_payment_sessions,
+    process_stripe_events,
+    reconcile_payments,
+)
 
 PAYMENT_URL = reverse("payment:payment-list")
 
@@ -123,3 +156,622 @@ class AdminPaymentApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertIn(serializer1.data, res.data)
         self.assertIn(serializer2.data, res.data)
+
+
+@override_settings(PAYMENT_GATEWAY="payment.gateways.FakeGateway")
+class PaymentOutboxTests(TestCase):
+    def setUp(self):
+        FakeGateway.reset()
+        self.borrowing = sample_borrowing()
+
+    def test_session_is_opened_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            payment = create_payment_session(self.borrowing)
+
+        self.assertEqual(payment.status, Payment.Status.PENDING)
+        self.assertEqual(payment.session_url, "")
+        self.assertEqual(len(callbacks), 1)
+
+        create_checkout_session(payment.outbox_id)
+        payment.refresh_from_db()
+
+        self.assertIn(payment.session_id, FakeGateway.sessions)
+        self.assertTrue(payment.session_url.endswith(payment.session_id))
+        self.assertGreater(payment.session_expires_at, timezone.now())
+        self.assertIsNotNone(payment.outbox.processed_at)
+
+    def test_broker_outage_leaves_outbox_for_dispatcher(self):
+        with mock.patch.object(
+            create_checkout_session, "delay", side_effect=OSError("Broker down")
+        ), self.assertLogs("django.test", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                payment = create_payment_session(self.borrowing)
+
+        PaymentOutbox.objects.filter(pk=payment.outbox_id).update(
+            created_at=timezone.now() - timedelta(minutes=2)
+        )
+        with mock.patch.object(create_checkout_session, "delay") as delay:
+            dispatch_payment_outbox()
+
+        delay.assert_called_once_with(payment.outbox_id)
+
+    def test_outbox_is_processed_once(self):
+        payment = create_payment_session(self.borrowing)
+
+        create_checkout_session(payment.outbox_id)
+        create_checkout_session(payment.outbox_id)
+
+        self.assertEqual(len(FakeGateway.sessions), 1)
+
+    @mock.patch.object(
+        FakeGateway, "create_checkout_session", side_effect=ValueError("Invalid")
+    )
+    def test_failing_record_backs_off_then_fails(self, create):
+        payment = create_payment_session(self.borrowing)
+        outbox = payment.outbox
+
+        with self.assertLogs("payment.tasks", "WARNING"), mock.patch.object(
+            create_checkout_session, "delay"
+        ):
+            for attempt in range(1, OUTBOX_MAX_ATTEMPTS):
+                create_checkout_session(outbox.id)
+                outbox.refresh_from_db()
+                self.assertEqual(outbox.attempts, attempt)
+                self.assertEqual(outbox.last_error, "Invalid")
+                self.assertEqual(dispatch_payment_outbox(), 0)
+                PaymentOutbox.objects.update(next_attempt_at=timezone.now())
+                self.assertEqual(dispatch_payment_outbox(), 1)
+            backoff = outbox.next_attempt_at - timezone.now()
+
+            create_checkout_session(outbox.id)
+            PaymentOutbox.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(dispatch_payment_outbox(), 0)
+
+        self.assertGreater(backoff, timedelta(minutes=60))
+        outbox.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertIsNotNone(outbox.failed_at)
+        self.assertEqual(payment.status, Payment.Status.FAILED)
+        self.assertEqual(create.call_count, OUTBOX_MAX_ATTEMPTS)
+
+        create_checkout_session(outbox.id)
+        self.assertEqual(create.call_count, OUTBOX_MAX_ATTEMPTS)
+
+    def test_fine_amount(self):
+        payment = create_payment_session(self.borrowing, days=3)
+
+        self.assertEqual(payment.type, Payment.Type.FINE)
+        self.assertEqual(payment.money_to_pay, Decimal("12.00"))
+
+    def test_legacy_amounts_converted_to_dollars(self):
+        legacy = Payment.objects.create(
+            status=Payment.Status.PAID,
+            type=Payment.Type.PAYMENT,
+            borrowing=self.borrowing,
+            session_id="cs_old",
+            money_to_pay=Decimal("1200"),
+        )
+        payment = create_payment_session(self.borrowing, days=3)
+
+        migration = importlib.import_module(
+            "payment.migrations.0009_legacy_amounts_in_dollars"
+        )
+        migration.legacy_amounts_to_dollars(apps, None)
+        legacy.refresh_from_db()
+        payment.refresh_from_db()
+
+        self.assertEqual(legacy.money_to_pay, Decimal("12.00"))
+        self.assertEqual(payment.money_to_pay, Decimal("12.00"))
+
+
+@override_settings(PAYMENT_GATEWAY="payment.gateways.FakeGateway")
+class PaymentSessionReuseTests(TestCase):
+    def setUp(self):
+        FakeGateway.reset()
+        self.borrowing = sample_borrowing()
+
+    def open_fine(self, days: int = 3) -> Payment:
+        payment = create_payment_session(self.borrowing, days=days)
+        create_checkout_session(payment.outbox_id)
+        payment.refresh_from_db()
+        return payment
+
+    def test_valid_pending_session_is_reused(self):
+        payment = self.open_fine()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertNumQueries(1):
+                reused = create_payment_session(self.borrowing, days=3)
+
+        self.assertEqual(reused.pk, payment.pk)
+        self.assertEqual(reused.session_url, payment.session_url)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(PaymentOutbox.objects.count(), 1)
+
+    def test_session_being_opened_is_reused(self):
+        payment = create_payment_session(self.borrowing, days=3)
+
+        self.assertEqual(create_payment_session(self.borrowing, days=3), payment)
+
+    def test_expiring_expired_or_different_payments_not_reused(self):
+        payment = self.open_fine()
+        Payment.objects.filter(pk=payment.pk).update(
+            session_expires_at=timezone.now() + timedelta(minutes=5)
+        )
+        self.assertNotEqual(create_payment_session(self.borrowing, days=3), payment)
+
+        self.assertNotEqual(
+            create_payment_session(self.borrowing, days=4).money_to_pay,
+            payment.money_to_pay,
+        )
+        self.assertEqual(
+            create_payment_session(self.borrowing).type, Payment.Type.PAYMENT
+        )
+        self.assertEqual(Payment.objects.count(), 4)
+
+    def test_legacy_and_abandoned_payments_not_reused(self):
+        legacy = Payment.objects.create(
+            status=Payment.Status.PENDING,
+            type=Payment.Type.FINE,
+            borrowing=self.borrowing,
+            session_url="https://old",
+            session_id="cs_old",
+            money_to_pay=Decimal("12.00"),
+        )
+        abandoned = create_payment_session(self.borrowing, days=3)
+        PaymentOutbox.objects.update(failed_at=timezone.now())
+
+        payment = create_payment_session(self.borrowing, days=3)
+
+        self.assertNotIn(payment, (legacy, abandoned))
+
+        migration = importlib.import_module(
+            "payment.migrations.0008_legacy_session_expiry"
+        )
+        migration.backfill_legacy_session_expiry(apps, None)
+        legacy.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertEqual(legacy.status, Payment.Status.PENDING)
+        self.assertGreater(
+            legacy.session_expires_at, timezone.now() + timedelta(hours=23)
+        )
+        self.assertIsNone(payment.session_expires_at)
+
+    def test_combined_session_only_for_missing_payments(self):
+        other = Borrowing.objects.create(
+            expected_return_date=self.borrowing.expected_return_date,
+            book=self.borrowing.book,
+            user=self.borrowing.user,
+        )
+        payment = create_payment_session(self.borrowing)
+
+        payments = create_combined_payment_session([self.borrowing, other])
+
+        self.assertEqual(payments[0], payment)
+        self.assertEqual(payments[1].borrowing, other)
+        self.assertEqual(len(payments[1].outbox.line_items), 1)
+
+    def test_expired_sessions_swept(self):
+        expired, valid = self.open_fine(), self.open_fine(days=4)
+        paid = self.open_fine(days=5)
+        Payment.objects.filter(pk=paid.pk).update(status=Payment.Status.PAID)
+        Payment.objects.exclude(pk=valid.pk).update(
+            session_expires_at=timezone.now() - timedelta(minutes=1)
+        )
+
+        self.assertEqual(expire_payment_sessions(batch_size=1), 1)
+
+        self.assertEqual(
+            [
+                Payment.objects.get(pk=payment.pk).status
+                for payment in (expired, valid, paid)
+            ],
+            [Payment.Status.EXPIRED, Payment.Status.PENDING, Payment.Status.PAID],
+        )
+
+
+WEBHOOK_URL = reverse("payment:payment-webhook")
+WEBHOOK_SECRET = "whsec_test_secret"
+STRIPE_EVENTS_DIR = Path(__file__).parent / "fixtures" / "stripe_events"
+
+
+def stripe_event(name: str) -> dict:
+    return json.loads((STRIPE_EVENTS_DIR / f"{name}.json").read_text())
+
+
+def sign(payload: str, secret: str = WEBHOOK_SECRET) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.completed = stripe_event("checkout.session.completed")
+        self.expired = stripe_event("checkout.session.expired")
+        self.borrowing = sample_borrowing()
+        self.payment = self.sample_payment(self.completed["data"]["object"]["id"])
+
+    def sample_payment(self, session_id: str) -> Payment:
+        return Payment.objects.create(
+            status=Payment.Status.PENDING,
+            type=Payment.Type.PAYMENT,
+            borrowing=self.borrowing,
+            session_url=f"https://checkout.stripe.com/c/pay/{session_id}",
+            session_id=session_id,
+            money_to_pay=10,
+        )
+
+    def post_event(self, event: dict, signature: str = None):
+        payload = json.dumps(event)
+        return self.client.post(
+            WEBHOOK_URL,
+            payload,
+            content_type="application/json",
+            HTTP_STRIPE_SIGNATURE=signature or sign(payload),
+        )
+
+    def test_completed_session_marks_payment_paid(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            res = self.post_event(self.completed)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["status"], "queued")
+        self.assertEqual(len(callbacks), 1)
+
+        self.assertEqual(process_stripe_events(), 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.Status.PAID)
+        self.assertIsNotNone(StripeEvent.objects.get().processed_at)
+
+    def test_broker_outage_still_acknowledges_event(self):
+        with mock.patch.object(
+            process_stripe_events,
+            "delay",
+            autospec=True,
+            side_effect=OSError("Broker down"),
+        ), self.assertLogs("django.test", "ERROR"):
+            with self.captureOnCommitCallbacks(execute=True):
+                res = self.post_event(self.completed)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(process_stripe_events(), 1)
+
+    def test_expired_session_marks_payment_expired(self):
+        payment = self.sample_payment(self.expired["data"]["object"]["id"])
+
+        self.post_event(self.expired)
+        process_stripe_events()
+
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.Status.EXPIRED)
+
+    def test_duplicate_event_is_dropped(self):
+        self.post_event(self.completed)
+
+        res = self.post_event(self.completed)
+
+        self.assertEqual(res.data["status"], "duplicate")
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_invalid_signature(self):
+        payload = json.dumps(self.completed)
+
+        res = self.post_event(self.completed, sign(payload, "whsec_other"))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    @override_settings(STRIPE_WEBHOOK_SECRET="")
+    def test_rejected_without_secret(self):
+        payload = json.dumps(self.completed)
+
+        res = self.post_event(self.completed, sign(payload, ""))
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_missing_signature(self):
+        res = self.client.post(
+            WEBHOOK_URL, json.dumps(self.completed), content_type="application/json"
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unhandled_event_is_ignored(self):
+        res = self.post_event(stripe_event("charge.succeeded"))
+
+        self.assertEqual(res.data["status"], "ignored")
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_events_are_applied_in_bulk(self):
+        for index in range(20):
+            event = copy.deepcopy(self.completed)
+            event["id"] = f"evt_completed_{index}"
+            event["data"]["object"]["id"] = f"cs_test_{index}"
+            self.sample_payment(f"cs_test_{index}")
+            self.post_event(event)
+
+        # select, paid update, processed update, plus the savepoint pair
+        with self.assertNumQueries(5):
+            self.assertEqual(apply_stripe_events(), 20)
+
+        self.assertEqual(Payment.objects.filter(status=Payment.Status.PAID).count(), 20)
+
+    def test_success_reads_local_state(self):
+        self.client.force_authenticate(self.payment.borrowing.user)
+        url = reverse("payment:success")
+        params = {"session_id": self.payment.session_id}
+
+        with mock.patch("stripe.checkout.Session.retrieve") as retrieve:
+            pending = self.client.get(url, params)
+            self.post_event(self.completed)
+            process_stripe_events()
+            paid = self.client.get(url, params)
+
+        retrieve.assert_not_called()
+        self.assertEqual(pending.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(paid.status_code, status.HTTP_200_OK)
+        self.assertEqual(paid.data["status"], Payment.Status.PAID)
+
+    def test_cancel_reports_time_left(self):
+        self.client.force_authenticate(self.payment.borrowing.user)
+        self.payment.session_expires_at = timezone.now() + timedelta(hours=2)
+        self.payment.save()
+
+        res = self.client.get(
+            reverse("payment:cancel"), {"session_id": self.payment.session_id}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn("available for the next 1:59", res.data["message"])
+
+    def test_combined_session(self):
+        self.client.force_authenticate(self.payment.borrowing.user)
+        other = self.sample_payment(self.payment.session_id)
+        params = {"session_id": self.payment.session_id}
+
+        pending = self.client.get(reverse("payment:success"), params)
+        self.post_event(self.completed)
+        process_stripe_events()
+        paid = self.client.get(reverse("payment:success"), params)
+        cancel = self.client.get(reverse("payment:cancel"), params)
+
+        self.assertEqual(pending.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(paid.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [payment["id"] for payment in paid.data], [self.payment.id, other.id]
+        )
+        self.assertEqual(cancel.status_code, status.HTTP_200_OK)
+        self.assertEqual(cancel.data["message"], "Your payment has been already paid.")
+        self.assertEqual(len(cancel.data["data"]), 2)
+
+    def test_unknown_session(self):
+        self.client.force_authenticate(self.payment.borrowing.user)
+
+        res = self.client.get(reverse("payment:success"), {"session_id": "cs_none"})
+        empty = self.client.get(reverse("payment:cancel"), {"session_id": ""})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(empty.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(PAYMENT_GATEWAY="payment.gateways.FakeGateway")
+class PaymentReconciliationTests(TestCase):
+    def setUp(self):
+        FakeGateway.reset()
+        self.borrowing = sample_borrowing()
+
+    def open_payment(self, created: int = None) -> Payment:
+        payment = create_payment_session(self.borrowing, reuse_pending=False)
+        create_checkout_session(payment.outbox_id)
+        payment.refresh_from_db()
+        if created is not None:
+            FakeGateway.sessions[payment.session_id].created = created
+        return payment
+
+    def statuses(self, payments: list[Payment]) -> list[str]:
+        return [Payment.objects.get(pk=payment.pk).status for payment in payments]
+
+    def test_settles_paid_and_expired_sessions(self):
+        paid, expired, still_open = [self.open_payment() for _ in range(3)]
+        FakeGateway.mark_paid(paid.session_id)
+        FakeGateway.expire(expired.session_id)
+
+        self.assertEqual(reconcile_payments(), 2)
+
+        self.assertEqual(
+            self.statuses([paid, expired, still_open]),
+            [Payment.Status.PAID, Payment.Status.EXPIRED, Payment.Status.PENDING],
+        )
+
+    def test_one_bulk_update_per_page(self):
+        payments = [self.open_payment() for _ in range(5)]
+        for payment in payments:
+            FakeGateway.mark_paid(payment.session_id)
+
+        with mock.patch("payment.tasks.RECONCILIATION_PAGE_SIZE", 2):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(reconcile_payments(), 5)
+
+        updates = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "payment_payment"')
+        ]
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(set(self.statuses(payments)), {Payment.Status.PAID})
+
+    def test_combined_session_settles_every_payment(self):
+        borrowings = [self.borrowing] * 2
+        payments = create_combined_payment_session(borrowings, reuse_pending=False)
+        create_checkout_session(payments[0].outbox_id)
+        session_id = Payment.objects.get(pk=payments[0].pk).session_id
+        FakeGateway.mark_paid(session_id)
+
+        self.assertEqual(reconcile_payments(), 2)
+
+    def test_cursor_resumes_from_oldest_open_session(self):
+        now = int(time.time())
+        old_paid = self.open_payment(created=now - 300)
+        old_open = self.open_payment(created=now - 200)
+        self.open_payment(created=now - 100)
+        FakeGateway.mark_paid(old_paid.session_id)
+
+        reconcile_payments()
+        cursor = ReconciliationCursor.objects.get()
+        self.assertEqual(cursor.created_since, now - 200)
+
+        FakeGateway.mark_paid(old_open.session_id)
+        with mock.patch.object(
+            FakeGateway,
+            "list_checkout_sessions",
+            wraps=FakeGateway().list_checkout_sessions,
+        ) as list_sessions:
+            self.assertEqual(reconcile_payments(), 1)
+
+        self.assertEqual(list_sessions.call_args.args[0], now - 200)
+        cursor.refresh_from_db()
+        self.assertEqual(cursor.created_since, now - 100)
+
+
+STRIPE_SESSION = {
+    "id": "cs_test_1",
+    "object": "checkout.session",
+    "url": "https://checkout.stripe.com/c/pay/cs_test_1",
+    "amount_total": 1000,
+    "payment_status": "unpaid",
+    "created": 1_700_000_000,
+    "expires_at": 1_700_086_400,
+    "status": "open",
+}
+
+
+def stripe_response(body: dict, status_code: int = 200) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode()
+    return response
+
+
+@override_settings(
+    PAYMENT_GATEWAY="payment.gateways.StripeGateway",
+    STRIPE_BREAKER_FAILURES=2,
+    STRIPE_MAX_NETWORK_RETRIES=1,
+)
+class StripeGatewayTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        stripe_sdk.cache_clear()
+        self.addCleanup(stripe_sdk.cache_clear)
+        self.gateway = get_gateway()
+        for patcher in (
+            mock.patch("requests.Session.request", autospec=True),
+            mock.patch("stripe.http_client.time.sleep"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.request = requests.Session.request
+        self.request.return_value = stripe_response(STRIPE_SESSION)
+
+    def fail(self) -> None:
+        self.request.side_effect = requests.ConnectionError("Connection refused")
+        for _ in range(2):
+            with self.assertRaises(GatewayUnavailable):
+                self.gateway.retrieve_checkout_session("cs_test_1")
+
+    def test_pooled_session_and_per_call_timeouts(self):
+        self.gateway.retrieve_checkout_session("cs_test_1")
+        self.request.return_value = stripe_response(
+            {"object": "list", "data": [STRIPE_SESSION], "has_more": False}
+        )
+        page = self.gateway.list_checkout_sessions(created_since=0)
+
+        self.assertEqual(page.sessions[0].id, "cs_test_1")
+        calls = self.request.call_args_list
+        self.assertEqual(
+            [call.kwargs["timeout"] for call in calls],
+            [TIMEOUTS["retrieve"], TIMEOUTS["list"]],
+        )
+        session = calls[0].args[0]
+        self.assertIs(calls[1].args[0], session)
+        self.assertEqual(
+            session.get_adapter("https://api.stripe.com")._pool_maxsize,
+            settings.STRIPE_POOL_SIZE,
+        )
+
+    def test_failures_retried_then_circuit_opens(self):
+        self.fail()
+        # One retry of each call
+        self.assertEqual(self.request.call_count, 4)
+
+        with self.assertRaises(CircuitOpen):
+            self.gateway.retrieve_checkout_session("cs_test_1")
+
+        self.assertEqual(self.request.call_count, 4)
+        metrics = self.gateway.metrics()
+        self.assertEqual(metrics["state"], "open")
+        self.assertEqual(metrics["opened"], 1)
+        self.assertEqual(metrics["rejected"], 1)
+        self.assertFalse(self.gateway.is_available())
+
+    def test_trial_call_closes_circuit(self):
+        self.fail()
+        self.gateway.breaker.timer = lambda: time.time() + 31
+        self.addCleanup(delattr, self.gateway.breaker, "timer")
+        self.request.side_effect = None
+
+        self.gateway.retrieve_checkout_session("cs_test_1")
+
+        self.assertEqual(self.gateway.metrics()["state"], "closed")
+
+    def test_client_errors_do_not_open_circuit(self):
+        self.request.return_value = stripe_response(
+            {"error": {"type": "invalid_request_error", "message": "No such session"}},
+            status_code=404,
+        )
+
+        for _ in range(3):
+            with self.assertRaises(Exception) as raised:
+                self.gateway.retrieve_checkout_session("cs_none")
+            self.assertNotIsInstance(raised.exception, GatewayUnavailable)
+
+        self.assertEqual(self.gateway.metrics()["state"], "closed")
+
+    def test_session_creation_queued_while_circuit_open(self):
+        self.gateway.breaker.open()
+        payment = create_payment_session(sample_borrowing())
+
+        create_checkout_session(payment.outbox_id)
+
+        self.request.assert_not_called()
+        payment.outbox.refresh_from_db()
+        self.assertIsNone(payment.outbox.processed_at)
+        self.assertEqual(payment.outbox.attempts, 0)
+        PaymentOutbox.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        with mock.patch.object(create_checkout_session, "delay") as delay:
+            self.assertEqual(dispatch_payment_outbox(), 0)
+            cache.clear()
+            self.assertEqual(dispatch_payment_outbox(), 1)
+        delay.assert_called_once_with(payment.outbox_id)
+
+    def test_metrics_for_staff(self):
+        url = reverse("payment:payment-gateway-status")
+        client = APIClient()
+        client.force_authenticate(sample_borrowing().user)
+        self.assertEqual(client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(
+            get_user_model().objects.create_user(
+                "staff@test.com", "staffpass", is_staff=True
+            )
+        )
+        res = client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data["gateway"], "StripeGateway")
+        self.assertEqual(res.data["state"], "closed")
@@ -1,20 +1,23 @@
-from datetime import datetime, timedelta
-
-import stripe
+from django.db import IntegrityError, transaction
+from django.http import Http404
+from django.utils import timezone
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
-from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 
 
-from payment.models import Payment
+from library_service.pagination import OptionalCursorPagination
+from payment.gateways import WebhookError, get_gateway
+from payment.models import Payment, StripeEvent
 from payment.serializers import PaymentSerializer
+from payment.tasks import EXPIRED_EVENTS, PAID_EVENTS, process_stripe_events
 
 
-class PaymentPagination(PageNumberPagination):
+class PaymentPagination(OptionalCursorPagination):
     page_size = 5
     max_page_size = 100
+    ordering = ("id",)
 
 
 class PaymentViewSet(
@@ -26,6 +29,15 @@ class PaymentViewSet(
     permission_classes = (IsAuthenticated,)
     serializer_class = PaymentSerializer
     pagination_class = PaymentPagination
+    # Including the user lookup of JWT authentication
+    query_budget = {
+        "list": 3,
+        "retrieve": 2,
+        "success": 2,
+        "cancel": 2,
+        "webhook": 4,
+        "gateway_status": 1,
+    }
 
     def get_queryset(self):
         queryset = self.queryset
@@ -35,24 +47,49 @@ class PaymentViewSet(
 
         return queryset
 
+    @staticmethod
+    def session_payments(request) -> list[Payment]:
+        """Payments of the checkout session, several for a combined one"""
+        session_id = request.query_params.get("session_id", "")
+        payments = (
+            list(Payment.objects.filter(session_id=session_id).order_by("id"))
+            if session_id
+            else []
+        )
+        if not payments:
+            raise Http404("No payment for this checkout session.")
+        return payments
+
+    @staticmethod
+    def serialize(payments: list[Payment]):
+        """A single payment as before, the payments of a combined session as a list"""
+        if len(payments) == 1:
+            return PaymentSerializer(payments[0]).data
+        return PaymentSerializer(payments, many=True).data
+
     @action(
         methods=["GET"],
         detail=False,
         url_path="success",
     )
     def success(self, request) -> Response:
-        """Success stripe payment endpoint"""
-        session_id = request.query_params.get("session_id", False)
-        payment = Payment.objects.get(session_id=session_id)
-        session = stripe.checkout.Session.retrieve(session_id)
-        if session.payment_status == "paid":
-            serializer = PaymentSerializer(
-                payment, data={"status": "PAID"}, partial=True
+        """
+        Success stripe payment endpoint. The payment is confirmed by the
+        webhook, which may arrive after the customer is redirected here.
+        """
+        payments = self.session_payments(request)
+        statuses = {payment.status for payment in payments}
+        if statuses == {Payment.Status.PAID}:
+            return Response(self.serialize(payments), status=status.HTTP_200_OK)
+        if Payment.Status.PENDING in statuses:
+            return Response(
+                {
+                    "status": "pending",
+                    "message": "Your payment is being confirmed, "
+                    "please check back shortly.",
+                },
+                status=status.HTTP_202_ACCEPTED,
             )
-            if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data, status=status.HTTP_200_OK)
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         return Response(
             {"status": "error", "message": "Payment is not success"},
             status=status.HTTP_400_BAD_REQUEST,
@@ -65,25 +102,85 @@ class PaymentViewSet(
     )
     def cancel(self, request) -> Response:
         """Cancel stripe payment endpoint"""
-        session_id = request.query_params.get("session_id")
-        payment = Payment.objects.get(session_id=session_id)
-        session = stripe.checkout.Session.retrieve(session_id)
-        serializer = PaymentSerializer(payment)
-        if session.payment_status == "unpaid":
-            session_expires_at = datetime.fromtimestamp(session.created) + timedelta(
-                hours=24
-            )
-            time_remaining = session_expires_at - datetime.now()
-            message = (
-                "Your payment has been cancelled. You can pay later, but please note that the session is "
-                f"available for the next {time_remaining}."
-            )
-            return Response(
-                {"message": message, "data": serializer.data},
-                status=status.HTTP_200_OK,
-            )
-        message = f"Your payment has been already paid."
+        payments = self.session_payments(request)
+        statuses = {payment.status for payment in payments}
+        expires_at = min(
+            (
+                payment.session_expires_at
+                for payment in payments
+                if payment.session_expires_at
+            ),
+            default=None,
+        )
+        if statuses == {Payment.Status.PAID}:
+            message = "Your payment has been already paid."
+        elif Payment.Status.EXPIRED in statuses:
+            message = "Your payment session has expired."
+        else:
+            message = "Your payment has been cancelled. You can pay later"
+            if expires_at:
+                time_remaining = expires_at - timezone.now()
+                message += (
+                    ", but please note that the session is "
+                    f"available for the next {time_remaining}"
+                )
+            message += "."
+        return Response(
+            {"message": message, "data": self.serialize(payments)},
+            status=status.HTTP_200_OK,
+        )
+
+    @action(
+        methods=["GET"],
+        detail=False,
+        url_path="gateway",
+        permission_classes=[IsAdminUser],
+    )
+    def gateway_status(self, request) -> Response:
+        """Circuit breaker state and call counters of the payment gateway"""
+        gateway = get_gateway()
         return Response(
-            {"message": message, "data": serializer.data},
+            {"gateway": type(gateway).__name__, **gateway.metrics()},
             status=status.HTTP_200_OK,
         )
+
+    @action(
+        methods=["POST"],
+        detail=False,
+        url_path="webhook",
+        authentication_classes=[],
+        permission_classes=[AllowAny],
+        throttle_classes=[],
+    )
+    def webhook(self, request) -> Response:
+        """
+        Stripe webhook endpoint. Verified events are stored once per event id
+        and applied to the payments in bulk by a worker.
+        """
+        try:
+            event = get_gateway().construct_event(
+                request.body, request.META.get("HTTP_STRIPE_SIGNATURE", "")
+            )
+        except WebhookError as exc:
+            return Response(
+                {"status": "error", "message": str(exc)},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if event.type not in PAID_EVENTS + EXPIRED_EVENTS:
+            return Response({"status": "ignored"}, status=status.HTTP_200_OK)
+
+        try:
+            with transaction.atomic():
+                StripeEvent.objects.create(
+                    event_id=event.id,
+                    type=event.type,
+                    session_id=event.session_id,
+                    payment_status=event.payment_status,
+                    payload=event.payload,
+                )
+                # A broker error only logs, the stored event is picked up by
+                # the scheduled process_stripe_events run
+                transaction.on_commit(process_stripe_events.delay, robust=True)
+        except IntegrityError:
+            return Response({"status": "duplicate"}, status=status.HTTP_200_OK)
+        return Response({"status": "queued"}, status=status.HTTP_200_OK)
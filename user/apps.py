@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UserServiceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "user"
+
+    def ready(self):
+        import user.signals  # noqa: F401
@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from library_service.routers import primary_reads
+from library_service.versions import bump_versions, get_version
+
+# Copied into access tokens so stateless authentication can build the user
+USER_CLAIMS = ("email", "first_name", "last_name", "is_staff", "is_superuser")
+VERSION_CLAIM = "ver"
+
+
+def auth_version_key(user_id) -> str:
+    return f"user:{user_id}:auth:version"
+
+
+def bump_auth_version(user_id) -> None:
+    """Invalidate the cached user and the claims of tokens issued so far"""
+    bump_versions([auth_version_key(user_id)])
+
+
+def add_user_claims(token, user) -> None:
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    token[VERSION_CLAIM] = get_version(auth_version_key(user.pk))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user from a short lived cache entry
+    keyed by user id and auth version instead of a query per request. With
+    JWT_STATELESS_AUTH the user is built from the token claims as long as
+    the token was issued at the current auth version.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        version = get_version(auth_version_key(user_id))
+        if (
+            settings.JWT_STATELESS_AUTH
+            and validated_token.get(VERSION_CLAIM) == version
+        ):
+            return self.user_from_claims(user_id, validated_token)
+
+        cache_key = f"user:{user_id}:auth:{version}"
+        user = cache.get(cache_key)
+        if user is None:
+            # A lagging replica could return the user as it was before the
+            # change that bumped the version, to be cached under it
+            with primary_reads():
+                user = super().get_user(validated_token)
+            cache.set(cache_key, user, settings.JWT_USER_CACHE_TIMEOUT)
+        elif not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    @staticmethod
+    def user_from_claims(user_id, validated_token):
+        """Unsaved user carrying only the fields present in the token"""
+        user = get_user_model()(
+            pk=user_id,
+            **{claim: validated_token.get(claim) for claim in USER_CLAIMS},
+        )
+        user._state.adding = False
+        return user
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """Document CachedJWTAuthentication as the simplejwt bearer scheme"""
+
+    target_class = CachedJWTAuthentication
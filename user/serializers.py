@@ -1,5 +1,8 @@
 from django.contrib.auth import get_user_model
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+
+from user.authentication import add_user_claims
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -29,3 +32,12 @@ class UserSerializer(serializers.ModelSerializer):
             user.save()
 
         return user
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls, user):
+        """Embed the user fields needed for stateless authentication"""
+        token = super().get_token(user)
+        add_user_claims(token, user)
+        return token
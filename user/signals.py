@@ -0,0 +1,28 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from user.authentication import bump_auth_version
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_auth(sender, instance, **kwargs):
+    bump_auth_version(instance.pk)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        user_ids = [instance.pk] if action.startswith("post_") else []
+    elif action in ("post_add", "post_remove"):
+        user_ids = pk_set
+    elif action == "pre_clear":
+        # Changed from the group or permission side, users are gone after it
+        user_ids = list(instance.user_set.values_list("pk", flat=True))
+    else:
+        user_ids = []
+    for user_id in user_ids:
+        bump_auth_version(user_id)
@@ -1,13 +1,20 @@
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from library_service import routers
+from user.authentication import CachedJWTAuthentication
 from user.serializers import UserSerializer
 
 USER_CREATE_URL = reverse("user:create")
 USER_MANAGE_URL = reverse("user:manage")
+TOKEN_URL = reverse("user:token_obtain_pair")
 
 
 def sample_user(**params):
@@ -63,3 +70,101 @@ class AuthenticatedUserApiTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
         self.assertNotEqual(res.data["email"], user1.email)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            "jwt@test.com", "testpass", first_name="Jwt"
+        )
+        self.authentication = CachedJWTAuthentication()
+
+    def token(self):
+        res = APIClient().post(
+            TOKEN_URL, {"email": "jwt@test.com", "password": "testpass"}
+        )
+        return self.authentication.get_validated_token(res.data["access"])
+
+    def test_token_carries_user_claims(self):
+        token = self.token()
+
+        self.assertEqual(token["email"], "jwt@test.com")
+        self.assertEqual(token["first_name"], "Jwt")
+        self.assertIs(token["is_staff"], False)
+        self.assertIn("ver", token)
+
+    def test_user_served_from_cache(self):
+        token = self.token()
+        with self.assertNumQueries(1):
+            self.authentication.get_user(token)
+
+        with self.assertNumQueries(0):
+            user = self.authentication.get_user(token)
+
+        self.assertEqual(user, self.user)
+
+    def test_cache_cleared_on_update(self):
+        token = self.token()
+        self.authentication.get_user(token)
+
+        self.user.is_staff = True
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            user = self.authentication.get_user(token)
+        self.assertTrue(user.is_staff)
+
+    def test_cache_cleared_on_group_change(self):
+        token = self.token()
+        self.authentication.get_user(token)
+
+        self.user.groups.add(Group.objects.create(name="librarians"))
+
+        with self.assertNumQueries(1):
+            self.authentication.get_user(token)
+
+    def test_cache_cleared_on_manage_user_update(self):
+        token = self.token()
+        self.authentication.get_user(token)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        client.patch(USER_MANAGE_URL, {"first_name": "Updated"})
+
+        self.assertEqual(self.authentication.get_user(token).first_name, "Updated")
+
+    def test_user_read_from_primary_during_replica_reads(self):
+        token = self.token()
+        self.user.is_staff = True
+        self.user.save()
+        token_var = routers._replica_reads.set(True)
+        self.addCleanup(routers._replica_reads.reset, token_var)
+
+        # No "replica" database exists, reading the user from it would fail
+        with mock.patch.object(routers, "healthy_replicas", return_value=["replica"]):
+            user = self.authentication.get_user(token)
+
+        self.assertTrue(user.is_staff)
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_stateless_user_from_claims(self):
+        token = self.token()
+
+        with self.assertNumQueries(0):
+            user = self.authentication.get_user(token)
+
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.email, "jwt@test.com")
+        self.assertFalse(user.is_staff)
+
+    @override_settings(JWT_STATELESS_AUTH=True)
+    def test_stateless_claims_ignored_after_permission_change(self):
+        token = self.token()
+
+        self.user.is_staff = True
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            user = self.authentication.get_user(token)
+        self.assertTrue(user.is_staff)